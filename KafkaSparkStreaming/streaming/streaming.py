@@ -115,23 +115,45 @@ vehicles_jdbc = spark \
     })
 
 
-activity_log_df \
-    .join(vehicles_jdbc, activity_log_df['vehicle_id'] == vehicles_jdbc['id'], how="inner") \
+vehicle_type_counts = [
+    F.sum(F.when(vehicles_jdbc["vehicle_type"] == vehicle_type, 1).otherwise(0)).alias(vehicle_type)
+    for vehicle_type in ['car', 'motorbike', 'truck']
+]
+
+activity_log_vehicle_df = activity_log_df \
+    .join(vehicles_jdbc, activity_log_df['vehicle_id'] == vehicles_jdbc['id'], how="inner")
+
+# Update mode only re-emits the hours that changed in a micro-batch and lets the watermark
+# drop closed hours, so keys expired by the serving layer's retention are not rewritten
+activity_log_vehicle_df \
     .groupBy(F.window("timestamp", "1 hour")) \
-    .agg(F.sum(F.when(vehicles_jdbc["vehicle_type"] == 'car', 1).otherwise(0)).alias('car'),
-         F.sum(F.when(vehicles_jdbc["vehicle_type"] == 'motorbike', 1).otherwise(0)).alias('motorbike'),
-         F.sum(F.when(vehicles_jdbc["vehicle_type"] == 'truck', 1).otherwise(0)).alias('truck')) \
+    .agg(*vehicle_type_counts) \
     .withColumn("key", F.expr("CAST(window.start AS STRING)")) \
     .withColumn("value", F.to_json(F.struct("car", "motorbike", "truck"))) \
     .select("key", "value") \
     .writeStream \
-    .outputMode("complete") \
+    .outputMode("update") \
     .format("kafka") \
     .option("kafka.bootstrap.servers", kafka_brokers) \
     .option("topic", "parking_lot_vehicle") \
     .option("checkpointLocation", f"{checkpoint_path}/parking_lot_vehicle") \
     .start()
 
+activity_log_vehicle_df \
+    .groupBy(F.window("timestamp", "1 hour"), activity_log_df["parking_lot_id"]) \
+    .agg(*vehicle_type_counts) \
+    .withColumn("key", F.concat_ws(":", F.col("parking_lot_id").cast(StringType()),
+                                   F.expr("CAST(window.start AS STRING)"))) \
+    .withColumn("value", F.to_json(F.struct("car", "motorbike", "truck"))) \
+    .select("key", "value") \
+    .writeStream \
+    .outputMode("update") \
+    .format("kafka") \
+    .option("kafka.bootstrap.servers", kafka_brokers) \
+    .option("topic", "parking_lot_vehicle_by_lot") \
+    .option("checkpointLocation", f"{checkpoint_path}/parking_lot_vehicle_by_lot") \
+    .start()
+
 sensors_schema = StructType([
     StructField("id", StringType(), False),
     StructField("vehicle_id", IntegerType(), True),
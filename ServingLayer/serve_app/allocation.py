@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Optional, Sequence
+
+from confluent_kafka import KafkaException
+from fastapi import HTTPException, status
+from sqlalchemy import case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .kafka import DeliveryProducer
+from .models import ActivityLog, ParkingSpace
+
+SPACE_STATE_TOPIC = 'parking_space_state_raw'
+DELIVERY_WAIT_SECONDS = float(os.getenv('KAFKA_DELIVERY_WAIT_SECONDS', 5))
+ALLOCATION_CANDIDATES = 8
+
+
+def free_space_claims(parking_lot_id: int, vehicle_type: str, candidates: Sequence[int] = ()) -> list:
+    # Rows locked by a concurrent claim are skipped instead of waited on, so two gates
+    # can never be handed the same space and neither blocks the other.
+    query = select(ParkingSpace).where(
+        ParkingSpace.parking_lot_id == parking_lot_id,
+        ParkingSpace.vehicle_type == vehicle_type,
+        ParkingSpace.state == 'free',
+        ParkingSpace.is_active == True,
+    ).limit(1).with_for_update(skip_locked=True)
+    claims = []
+    if candidates:
+        # Prefer the nearest candidates in the given order, only the returned row is locked
+        rank = case({space_id: i for i, space_id in enumerate(candidates)}, value=ParkingSpace.id)
+        claims.append(query.where(ParkingSpace.id.in_(candidates)).order_by(rank))
+    claims.append(query)
+    return claims
+
+
+def reserve(parking_space: ParkingSpace):
+    parking_space.state = 'reserved'
+    parking_space.updated_at = datetime.utcnow()
+
+
+def claim_free_space(db: Session, parking_lot_id: int, vehicle_type: str,
+                     candidates: Sequence[int] = ()) -> Optional[ParkingSpace]:
+    for claim in free_space_claims(parking_lot_id, vehicle_type, candidates):
+        parking_space = db.scalars(claim).first()
+        if parking_space is not None:
+            reserve(parking_space)
+            db.flush()
+            return parking_space
+    return None
+
+
+async def claim_free_space_async(db: AsyncSession, parking_lot_id: int, vehicle_type: str,
+                                 candidates: Sequence[int] = ()) -> Optional[ParkingSpace]:
+    for claim in free_space_claims(parking_lot_id, vehicle_type, candidates):
+        parking_space = (await db.scalars(claim)).first()
+        if parking_space is not None:
+            reserve(parking_space)
+            await db.flush()
+            return parking_space
+    return None
+
+
+def release_space(parking_space: ParkingSpace):
+    parking_space.state = 'free'
+    parking_space.updated_at = datetime.utcnow()
+
+
+def release_claim(db: Session, parking_space: ParkingSpace, activity_log: ActivityLog):
+    # Compensates a committed claim whose reservation did not reach Kafka. Claims are committed
+    # before publishing so the row lock is not held while the broker is waited on.
+    release_space(parking_space)
+    db.delete(activity_log)
+    db.commit()
+
+
+async def release_claim_async(db: AsyncSession, parking_space: ParkingSpace, activity_log: ActivityLog):
+    release_space(parking_space)
+    await db.delete(activity_log)
+    await db.commit()
+
+
+def send_space_state(kafka_producer: DeliveryProducer, parking_space_id: int, vehicle_id: Optional[int],
+                     state: str) -> Future:
+    message = {
+        'vehicle_id': vehicle_id,
+        'updated_at': datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        'state': state,
+    }
+    return kafka_producer.produce(SPACE_STATE_TOPIC, key=str(parking_space_id), value=json.dumps(message))
+
+
+def delivery_failed(parking_space_id: int, e: Exception) -> HTTPException:
+    print(f"Failed to deliver state of parking space {parking_space_id}: {e!r}")
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to reserve space')
+
+
+def publish_space_state(kafka_producer: DeliveryProducer, parking_space_id: int, vehicle_id: Optional[int],
+                        state: str):
+    try:
+        send_space_state(kafka_producer, parking_space_id, vehicle_id, state).result(timeout=DELIVERY_WAIT_SECONDS)
+    except (KafkaException, BufferError, FutureTimeoutError) as e:
+        raise delivery_failed(parking_space_id, e)
+
+
+async def publish_space_state_async(kafka_producer: DeliveryProducer, parking_space_id: int,
+                                    vehicle_id: Optional[int], state: str):
+    delivery = asyncio.wrap_future(send_space_state(kafka_producer, parking_space_id, vehicle_id, state))
+    try:
+        # Shielded so a timeout does not cancel the future the poller thread will still resolve
+        await asyncio.wait_for(asyncio.shield(delivery), DELIVERY_WAIT_SECONDS)
+    except (KafkaException, BufferError, asyncio.TimeoutError) as e:
+        raise delivery_failed(parking_space_id, e)
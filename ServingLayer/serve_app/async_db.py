@@ -0,0 +1,29 @@
+import os
+from typing import Annotated
+
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .db import DATABASE_URI
+from .metrics import instrument_engine, pool_collector
+
+ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URI', DATABASE_URI.replace('postgresql://', 'postgresql+asyncpg://', 1))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URI,
+    pool_size=int(os.getenv('ASYNC_DATABASE_POOL_SIZE', 20)),
+    max_overflow=int(os.getenv('ASYNC_DATABASE_MAX_OVERFLOW', 20)),
+    pool_pre_ping=True,
+)
+instrument_engine(async_engine.sync_engine, 'async')
+pool_collector.add_engine('async', async_engine.sync_engine)
+# Handlers return ORM rows after commit, which must not trigger a lazy refresh outside the greenlet
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+AsyncDatabaseDependency = Annotated[AsyncSession, Depends(get_async_db)]
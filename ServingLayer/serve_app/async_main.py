@@ -0,0 +1,238 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Annotated, Optional
+
+from fastapi import Depends, FastAPI, Query, status, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from .allocation import (ALLOCATION_CANDIDATES, claim_free_space_async, publish_space_state_async,
+                         release_claim_async)
+from .async_db import AsyncDatabaseDependency, async_engine
+from .async_redis import AsyncRedisDependency, async_redis_pool
+from .auth import api_key_header, camera_cache, lookup_device, sensor_cache
+from .forecast import FORECAST_MAX_HOURS, occupancy_forecaster
+from .kafka import KafkaProducerDependency
+from .metrics import MetricsMiddleware, metrics_response
+from .main import MAX_HOUR_RANGE, get_stats as get_sync_stats, ingest_events, lifespan, stream_parking_lot_capacity
+from .models import ParkingSpace, Vehicle, ActivityLog, Sensor, Camera
+from .occupancy import occupancy_index
+from .plates import find_vehicle_async
+from .ratings import rating_report, rating_report_query
+from .schemas import (CapacityReport, IngestResult, ParkingSpaceState, ParkingSpaceOut, ReserveOrder, RatingReport,
+                      ValidateModel, VehicleReport, OccupancyForecast)
+from .spatial import spatial_index
+from .vehicle_counts import fetch_hourly_counts_async
+
+
+@asynccontextmanager
+async def async_lifespan(app: FastAPI):
+    # Indexes, stream listeners and the Kafka producer are shared with the sync app
+    async with lifespan(app):
+        yield
+    await async_redis_pool.disconnect()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=async_lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MetricsMiddleware)
+
+
+async def get_sensor_by_api_key(db: AsyncDatabaseDependency, api_key: str = Depends(api_key_header)):
+    sensor = await db.run_sync(lookup_device, sensor_cache, Sensor, api_key)
+    if not sensor:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid API key')
+    return sensor
+
+
+SensorDependency = Annotated[Sensor, Depends(get_sensor_by_api_key)]
+
+
+async def get_camera_by_api_key(db: AsyncDatabaseDependency, api_key: str = Depends(api_key_header)):
+    camera = await db.run_sync(lookup_device, camera_cache, Camera, api_key)
+    if not camera:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid API key')
+    return camera
+
+
+CameraDependency = Annotated[Camera, Depends(get_camera_by_api_key)]
+
+
+async def get_registered_vehicle(db, info: ValidateModel) -> Vehicle:
+    vehicle = await find_vehicle_async(db, info.license_plate)
+    if vehicle is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vehicle not registered')
+    if vehicle.owner_id != info.user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Vehicle not owned by user')
+    return vehicle
+
+
+@app.get("/parking_lots", response_model=CapacityReport, status_code=status.HTTP_200_OK)
+async def get_parking_space_from_parking_lot(
+        parking_lot_id: Optional[int] = Query(default=None),
+):
+    response = occupancy_index.report(parking_lot_id)
+    if not response:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
+    return response
+
+
+app.get("/parking_lots/stream", status_code=status.HTTP_200_OK)(stream_parking_lot_capacity)
+
+
+@app.get('/sensors', response_model=ParkingSpaceState, status_code=status.HTTP_200_OK)
+async def get_sensor_state(
+    sensor: SensorDependency,
+    db: AsyncDatabaseDependency,
+):
+    parking_space = (await db.scalars(
+        select(ParkingSpace).options(selectinload(ParkingSpace.vehicle))
+        .where(ParkingSpace.id == sensor.parking_space_id).limit(1)
+    )).first()
+    if not parking_space:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='Associated parking space not found')
+    return parking_space
+
+
+@app.get('/recommend', response_model=list[ParkingSpaceOut], status_code=status.HTTP_200_OK)
+async def recommend_parking_space(
+        db: AsyncDatabaseDependency,
+        parking_lot_id: Optional[int] = Query(default=None),
+        vehicle_type: str = Query(regex='^(car|motorbike|truck)$'),
+        num_results: int = Query(default=1, gt=0, le=10),
+        longitude: Optional[float] = Query(default=None),
+        latitude: Optional[float] = Query(default=None),
+):
+    if parking_lot_id is not None:
+        results = spatial_index.nearest(parking_lot_id, vehicle_type, num_results, longitude, latitude)
+    else:
+        results = (await db.scalars(select(ParkingSpace).where(
+            ParkingSpace.vehicle_type == vehicle_type,
+            ParkingSpace.state == 'free'
+        ).limit(num_results))).all()
+    if not results:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No parking space available')
+    return results
+
+
+@app.get('/rating', response_model=RatingReport, status_code=status.HTTP_200_OK)
+async def get_rating_from_parking_lot(
+        db: AsyncDatabaseDependency,
+        parking_lot_id: Optional[int] = Query(default=None),
+):
+    response = rating_report(parking_lot_id, (await db.execute(rating_report_query(parking_lot_id))).one())
+    if not response:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
+    return response
+
+
+@app.post('/reserve', status_code=status.HTTP_204_NO_CONTENT)
+async def reserve_space(
+        reserve_order: ReserveOrder,
+        kafka_producer: KafkaProducerDependency
+):
+    await publish_space_state_async(kafka_producer, reserve_order.parking_space_id, reserve_order.vehicle_id,
+                                    'reserved')
+    return
+
+
+@app.post('/validate/in', response_model=ParkingSpaceOut, status_code=status.HTTP_200_OK)
+async def validate_in(
+        camera: CameraDependency,
+        db: AsyncDatabaseDependency,
+        kafka_producer: KafkaProducerDependency,
+        info: ValidateModel
+):
+    vehicle = await get_registered_vehicle(db, info)
+
+    parking_lot_id = camera.parking_lot_id
+    candidates = [space['id'] for space in
+                  spatial_index.nearest(parking_lot_id, vehicle.vehicle_type, ALLOCATION_CANDIDATES)]
+    parking_space = await claim_free_space_async(db, parking_lot_id, vehicle.vehicle_type, candidates)
+    if parking_space is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Parking lot is full')
+
+    activity_log = ActivityLog(
+        activity_type='in',
+        vehicle_id=vehicle.id,
+        parking_lot_id=parking_lot_id,
+        timestamp=info.timestamp,
+    )
+    db.add(activity_log)
+    await db.commit()
+    try:
+        await publish_space_state_async(kafka_producer, parking_space.id, vehicle.id, 'reserved')
+    except HTTPException:
+        await release_claim_async(db, parking_space, activity_log)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Fail to reserve parking space')
+    spatial_index.apply(parking_space.id, 'reserved')
+    return parking_space
+
+
+@app.post('/validate/out', status_code=status.HTTP_204_NO_CONTENT)
+async def validate_out(
+        camera: CameraDependency,
+        db: AsyncDatabaseDependency,
+        info: ValidateModel
+):
+    vehicle = await get_registered_vehicle(db, info)
+    activity_log = ActivityLog(
+        activity_type='out',
+        vehicle_id=vehicle.id,
+        parking_lot_id=camera.parking_lot_id,
+        timestamp=info.timestamp,
+    )
+    db.add(activity_log)
+    await db.commit()
+    return
+
+
+@app.get('/vehicles', response_model=list[VehicleReport], status_code=status.HTTP_200_OK)
+async def get_vehicle_by_hour(
+        redis: AsyncRedisDependency,
+        final_time: int = Query(default_factory=lambda: int(datetime.utcnow().timestamp()), ge=0),
+        hour_range: int = Query(default=24, ge=1, le=MAX_HOUR_RANGE),
+        parking_lot_id: Optional[int] = Query(default=None),
+):
+    return await fetch_hourly_counts_async(redis, final_time, hour_range, parking_lot_id)
+
+
+@app.get('/forecast', response_model=list[OccupancyForecast], status_code=status.HTTP_200_OK)
+async def get_occupancy_forecast(
+        parking_lot_id: int = Query(),
+        hours: int = Query(default=24, ge=1, le=FORECAST_MAX_HOURS),
+):
+    response = occupancy_forecaster.forecast(parking_lot_id, hours)
+    if response is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
+    return response
+
+
+# Batch ingest is shared with the sync app, its handler runs in the threadpool
+app.post('/ingest', response_model=list[IngestResult], status_code=status.HTTP_200_OK)(ingest_events)
+
+
+@app.get('/stats', status_code=status.HTTP_200_OK)
+def get_stats():
+    # The state behind the sync app's stats is shared, this app adds its own Redis pool
+    return {**get_sync_stats(), 'async_redis_pool': async_redis_pool.stats()}
+
+
+@app.get('/metrics', include_in_schema=False)
+def get_metrics():
+    return metrics_response()
+
+
+@app.get('/', status_code=status.HTTP_200_OK)
+async def health_check():
+    return {'message': 'OK'}
@@ -0,0 +1,52 @@
+import os
+import time
+from typing import Annotated
+
+import redis.asyncio as redis
+from fastapi import Depends
+
+from .metrics import pool_collector, redis_latency
+
+
+class MeteredAsyncConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, name: str = 'async', **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        connection.metered_command = ('PIPELINE' if command_name == 'MULTI' else command_name, start)
+        return connection
+
+    async def release(self, connection):
+        command_name, start = connection.metered_command
+        redis_latency.labels(self.name, command_name).observe(time.perf_counter() - start)
+        await super().release(connection)
+
+    def stats(self) -> dict:
+        in_use = len(self._in_use_connections)
+        return {
+            'max_connections': self.max_connections,
+            'created': in_use + len(self._available_connections),
+            'in_use': in_use,
+        }
+
+
+async_redis_pool = MeteredAsyncConnectionPool(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+    timeout=float(os.getenv('REDIS_POOL_TIMEOUT', 2)),
+    health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    socket_keepalive=True,
+)
+async_redis_client = redis.Redis(connection_pool=async_redis_pool)
+pool_collector.add_redis_pool('async', async_redis_pool)
+
+
+def get_async_redis():
+    return async_redis_client
+
+
+AsyncRedisDependency = Annotated[redis.Redis, Depends(get_async_redis)]
@@ -1,15 +1,50 @@
+import os
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
+from .cache import MISSING, TTLCache
 from .db import DatabaseDependency
+from .metrics import device_auth_cache_requests
 from .models import Sensor, Camera
+from .redis import DEVICE_INVALIDATION_CHANNEL, ChannelListener, device_events_redis
 
 api_key_header = APIKeyHeader(name="X-API-Key")
 
+DEVICE_CACHE_SIZE = int(os.getenv('DEVICE_CACHE_SIZE', 10000))
+DEVICE_CACHE_TTL_SECONDS = float(os.getenv('DEVICE_CACHE_TTL_SECONDS', 300))
+DEVICE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('DEVICE_CACHE_NEGATIVE_TTL_SECONDS', 30))
+
+sensor_cache = TTLCache(DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL_SECONDS, DEVICE_CACHE_NEGATIVE_TTL_SECONDS)
+camera_cache = TTLCache(DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL_SECONDS, DEVICE_CACHE_NEGATIVE_TTL_SECONDS)
+
+
+def lookup_device(db, cache: TTLCache, model, api_key: str):
+    device = cache.get(api_key)
+    if device is MISSING:
+        device_auth_cache_requests.labels(model.__name__.lower(), 'miss').inc()
+        device = db.query(model).filter(model.api_key == api_key, model.is_active == True).first()
+        if device is not None:
+            # Cached devices outlive the session, only their column attributes are read
+            db.expunge(device)
+        cache.set(api_key, device)
+    else:
+        device_auth_cache_requests.labels(model.__name__.lower(), 'hit' if device is not None else 'negative_hit').inc()
+    return device
+
+
+def invalidate_api_key(api_key: str):
+    sensor_cache.invalidate(api_key)
+    camera_cache.invalidate(api_key)
+
+
+def clear_device_caches():
+    sensor_cache.clear()
+    camera_cache.clear()
+
 
 def get_sensor_by_api_key(db: DatabaseDependency, api_key: str = Depends(api_key_header)):
-    sensor = db.query(Sensor).filter(Sensor.api_key == api_key).first()
+    sensor = lookup_device(db, sensor_cache, Sensor, api_key)
     if not sensor:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid API key')
     return sensor
@@ -19,10 +54,14 @@ SensorDependency = Annotated[Sensor, Depends(get_sensor_by_api_key)]
 
 
 def get_camera_by_api_key(db: DatabaseDependency, api_key: str = Depends(api_key_header)):
-    camera = db.query(Camera).filter(Camera.api_key == api_key).first()
+    camera = lookup_device(db, camera_cache, Camera, api_key)
     if not camera:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid API key')
     return camera
 
 
 CameraDependency = Annotated[Camera, Depends(get_camera_by_api_key)]
+
+
+device_invalidation_listener = ChannelListener(device_events_redis, DEVICE_INVALIDATION_CHANNEL,
+                                               on_subscribe=clear_device_caches)
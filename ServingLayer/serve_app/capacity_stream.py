@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import threading
+from typing import AsyncIterator, Optional
+
+from .kafka import SpaceStateEvent
+from .occupancy import ALL_LOTS, OccupancyIndex, occupancy_index
+from .schemas import CapacityReport
+
+STREAM_INTERVAL_SECONDS = float(os.getenv('CAPACITY_STREAM_INTERVAL_SECONDS', 1))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv('CAPACITY_STREAM_KEEPALIVE_SECONDS', 15))
+
+
+def capacity_message(parking_lot_id: Optional[int], report: dict) -> str:
+    data = {'parking_lot_id': parking_lot_id, **CapacityReport.model_validate(report).model_dump()}
+    return f'event: capacity\ndata: {json.dumps(data)}\n\n'
+
+
+class CapacityBroadcaster:
+    def __init__(self, index: OccupancyIndex, interval: float = STREAM_INTERVAL_SECONDS):
+        self.index = index
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._subscribers = {}
+        self._last_sent = {}
+        self._task = None
+        self.flushes = 0
+        self.messages = 0
+
+    def on_space_state(self, event: SpaceStateEvent):
+        # Runs on the listener thread after the occupancy index applied the event, only the
+        # lot is recorded here and bursts collapse into one message at the next flush
+        parking_lot_id = self.index.parking_lot_of(event.parking_space_id)
+        if parking_lot_id is None:
+            return
+        with self._lock:
+            self._dirty.add(parking_lot_id)
+            self._dirty.add(ALL_LOTS)
+
+    def mark_all_dirty(self):
+        with self._lock:
+            self._dirty.update(list(self._subscribers))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Capacity stream flush failed: {e}")
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        self.flushes += 1
+        for parking_lot_id in dirty:
+            queues = self._subscribers.get(parking_lot_id)
+            if not queues:
+                self._last_sent.pop(parking_lot_id, None)
+                continue
+            message = capacity_message(parking_lot_id, self.index.report(parking_lot_id))
+            if message == self._last_sent.get(parking_lot_id):
+                continue
+            self._last_sent[parking_lot_id] = message
+            for queue in queues:
+                offer(queue, message)
+                self.messages += 1
+
+    def subscribe(self, parking_lot_id: Optional[int]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        queue.put_nowait(capacity_message(parking_lot_id, self.index.report(parking_lot_id)))
+        self._subscribers.setdefault(parking_lot_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, parking_lot_id: Optional[int], queue: asyncio.Queue):
+        queues = self._subscribers.get(parking_lot_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[parking_lot_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def stream(self, parking_lot_id: Optional[int]) -> AsyncIterator[str]:
+        queue = self.subscribe(parking_lot_id)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(parking_lot_id, queue)
+
+
+def offer(queue: asyncio.Queue, message: str):
+    # Every message is a full snapshot of the lot, so a slow client only needs the latest one
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+capacity_broadcaster = CapacityBroadcaster(occupancy_index)
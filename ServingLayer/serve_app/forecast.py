@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .models import ActivityLog, Vehicle
+from .occupancy import OccupancyIndex, occupancy_index
+from .vehicle_counts import HOUR_FORMAT, VEHICLE_TYPES
+
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 56))
+FORECAST_REFIT_SECONDS = float(os.getenv('FORECAST_REFIT_SECONDS', 24 * 3600))
+FORECAST_MAX_HOURS = 168
+SEASON_HOURS = 168
+# 1970-01-01 was a Thursday, the offset makes hour of week 0 Monday midnight
+WEEK_OFFSET_HOURS = 72
+LEVEL_SMOOTHING = 0.2
+SEASON_SMOOTHING = 0.1
+ACTIVITY_TYPES = ['in', 'out']
+
+
+def hour_of_week(epoch_hours):
+    return (epoch_hours + WEEK_OFFSET_HOURS) % SEASON_HOURS
+
+
+def initial_state(counts: np.ndarray, first_hour: int):
+    # Seasonal baseline: the mean of every hour of the week over the history, as a deviation from the
+    # overall mean. Rows are independent series, columns consecutive hours.
+    slots = hour_of_week(first_hour + np.arange(counts.shape[1]))
+    totals = np.zeros((counts.shape[0], SEASON_HOURS))
+    np.add.at(totals.T, slots, counts.T)
+    seen = np.bincount(slots, minlength=SEASON_HOURS)
+    level = counts.mean(axis=1) if counts.shape[1] else np.zeros(counts.shape[0])
+    season = np.divide(totals, seen, out=np.zeros_like(totals), where=seen > 0) - level[:, None]
+    season[:, seen == 0] = 0
+    return level, season
+
+
+def smooth(level: np.ndarray, season: np.ndarray, counts: np.ndarray, first_hour: int):
+    # Additive exponential smoothing without trend, one step per hour across all series at once
+    for offset in range(counts.shape[1]):
+        slot = hour_of_week(first_hour + offset)
+        observed = counts[:, offset]
+        level = LEVEL_SMOOTHING * (observed - season[:, slot]) + (1 - LEVEL_SMOOTHING) * level
+        season[:, slot] = SEASON_SMOOTHING * (observed - level) + (1 - SEASON_SMOOTHING) * season[:, slot]
+    return level, season
+
+
+def project(level: np.ndarray, season: np.ndarray, next_hour: int, hours: int) -> np.ndarray:
+    slots = hour_of_week(next_hour + np.arange(hours))
+    return np.maximum(level[:, None] + season[:, slots], 0)
+
+
+def hourly_activity(db: Session, start_hour: int, end_hour: int) -> list:
+    # One row per lot and epoch hour in [start_hour, end_hour) with a count per activity and vehicle type,
+    # pivoted in SQL so a refit reads a row per busy lot hour rather than one per series
+    epoch_hour = func.floor(func.extract('epoch', ActivityLog.timestamp) / 3600)
+    counts = [func.count().filter(ActivityLog.activity_type == activity_type, Vehicle.vehicle_type == vehicle_type)
+              for activity_type in ACTIVITY_TYPES for vehicle_type in VEHICLE_TYPES]
+    query = select(ActivityLog.parking_lot_id, epoch_hour, *counts) \
+        .join(Vehicle, Vehicle.id == ActivityLog.vehicle_id) \
+        .where(ActivityLog.timestamp >= datetime.utcfromtimestamp(start_hour * 3600),
+               ActivityLog.timestamp < datetime.utcfromtimestamp(end_hour * 3600)) \
+        .group_by(ActivityLog.parking_lot_id, epoch_hour)
+    return db.execute(query).all()
+
+
+def bucket_counts(rows: list, lot_ids: np.ndarray, start_hour: int, hours: int) -> np.ndarray:
+    # One row per lot, activity type and vehicle type, in that order, with a column per hour.
+    # lot_ids is sorted and gives the order of the lots.
+    series = len(ACTIVITY_TYPES) * len(VEHICLE_TYPES)
+    counts = np.zeros((len(lot_ids), series, hours))
+    if rows and len(lot_ids):
+        table = np.array(rows, dtype=np.float64).reshape(-1, 2 + series)
+        lot_rows = np.minimum(np.searchsorted(lot_ids, table[:, 0]), len(lot_ids) - 1)
+        offsets = table[:, 1].astype(np.int64) - start_hour
+        valid = (lot_ids[lot_rows] == table[:, 0]) & (offsets >= 0) & (offsets < hours)
+        counts[lot_rows[valid], :, offsets[valid]] = table[valid, 2:]
+    return counts.reshape(-1, hours)
+
+
+class OccupancyForecaster:
+    # Every lot has one series per activity type and vehicle type. The state is refitted from the
+    # history once a day and advanced by one smoothing step as each hour closes, projections for the
+    # next FORECAST_MAX_HOURS are cached so requests only slice them.
+    def __init__(self, index: OccupancyIndex, clock=time.time):
+        self.index = index
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._lot_ids = np.empty(0, dtype=np.int64)
+        self._rows = {}
+        self._level = None
+        self._season = None
+        self._projection = None
+        self.next_hour = None
+        self.fitted_at = None
+        self.fit_seconds = None
+
+    def fit(self, db: Session):
+        started = time.perf_counter()
+        end_hour = int(self.clock() // 3600)
+        start_hour = end_hour - FORECAST_HISTORY_DAYS * 24
+        rows = hourly_activity(db, start_hour, end_hour)
+        lot_ids = np.array(sorted({row[0] for row in rows} | self.index.parking_lots()), dtype=np.int64)
+        counts = bucket_counts(rows, lot_ids, start_hour, end_hour - start_hour)
+        level, season = initial_state(counts, start_hour)
+        level, season = smooth(level, season, counts, start_hour)
+        projection = project(level, season, end_hour, FORECAST_MAX_HOURS)
+        with self._lock:
+            self._lot_ids = lot_ids
+            self._rows = {parking_lot_id: i for i, parking_lot_id in enumerate(lot_ids.tolist())}
+            self._level, self._season, self._projection = level, season, projection
+            self.next_hour = end_hour
+            self.fitted_at = self.clock()
+        self.fit_seconds = time.perf_counter() - started
+
+    def advance(self, db: Session):
+        end_hour = int(self.clock() // 3600)
+        start_hour = self.next_hour
+        if end_hour <= start_hour:
+            return
+        # Lots created since the last fit have no row yet and join at the next refit
+        rows = hourly_activity(db, start_hour, end_hour)
+        counts = bucket_counts(rows, self._lot_ids, start_hour, end_hour - start_hour)
+        level, season = smooth(self._level, self._season.copy(), counts, start_hour)
+        projection = project(level, season, end_hour, FORECAST_MAX_HOURS)
+        with self._lock:
+            self._level, self._season, self._projection = level, season, projection
+            self.next_hour = end_hour
+
+    def refresh(self, db: Session):
+        if self.fitted_at is None or self.clock() - self.fitted_at >= FORECAST_REFIT_SECONDS:
+            self.fit(db)
+        else:
+            self.advance(db)
+
+    def forecast(self, parking_lot_id: int, hours: int) -> Optional[list]:
+        with self._lock:
+            row = self._rows.get(parking_lot_id)
+            if row is None:
+                return None
+            next_hour = self.next_hour
+            series = self._projection.reshape(len(self._rows), len(ACTIVITY_TYPES), len(VEHICLE_TYPES), -1)[row]
+        arrivals, departures = series[0, :, :hours], series[1, :, :hours]
+        # Free spaces drift from the live count by the expected net arrivals, within the lot's capacity
+        capacity = self.index.report(parking_lot_id)
+        free_now = np.array([capacity.get(vehicle_type, {}).get('free', 0) for vehicle_type in VEHICLE_TYPES])
+        total = np.array([sum(capacity.get(vehicle_type, {}).values()) for vehicle_type in VEHICLE_TYPES])
+        free = np.clip(free_now[:, None] - np.cumsum(arrivals - departures, axis=1), 0, total[:, None])
+        res = []
+        for offset in range(hours):
+            record = {
+                'hour': datetime.utcfromtimestamp((next_hour + offset) * 3600).strftime(HOUR_FORMAT),
+            }
+            for i, vehicle_type in enumerate(VEHICLE_TYPES):
+                record[vehicle_type] = {
+                    'arrivals': round(float(arrivals[i, offset]), 2),
+                    'departures': round(float(departures[i, offset]), 2),
+                    'free': int(round(free[i, offset])),
+                }
+            res.append(record)
+        return res
+
+    def stats(self) -> dict:
+        return {
+            'lots': len(self._rows),
+            'next_hour': self.next_hour,
+            'fit_seconds': round(self.fit_seconds, 3) if self.fit_seconds is not None else None,
+        }
+
+
+occupancy_forecaster = OccupancyForecaster(occupancy_index)
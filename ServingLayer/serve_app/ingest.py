@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+import msgpack
+import redis
+from confluent_kafka import KafkaException
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.orm import Session, selectinload
+
+from .allocation import (ALLOCATION_CANDIDATES, DELIVERY_WAIT_SECONDS, claim_free_space, release_space,
+                         send_space_state)
+from .auth import camera_cache, lookup_device, sensor_cache
+from .kafka import DeliveryProducer
+from .models import ActivityLog, Camera, ParkingSpace, Sensor, Vehicle
+from .plates import fuzzy_vehicle_id
+from .schemas import IngestEvent, IngestEventType, IngestResult, ParkingSpaceOut, ParkingSpaceState
+from .spatial import spatial_index
+
+INGEST_MAX_EVENTS = int(os.getenv('INGEST_MAX_EVENTS', 500))
+INGEST_MAX_BYTES = int(os.getenv('INGEST_MAX_BYTES', 4 * 1024 * 1024))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('INGEST_IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_KEY_PREFIX = 'ingest'
+# Claims expire on their own if the result is never stored
+PENDING_TTL_SECONDS = 60
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+PENDING = b'pending'
+
+events_adapter = TypeAdapter(list[IngestEvent])
+
+
+def decompress(body: bytes) -> bytes:
+    # Bounded so a small gzip body cannot expand into an unbounded allocation
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, INGEST_MAX_BYTES)
+    except zlib.error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid gzip body')
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Batch too large')
+    return data
+
+
+async def read_body(request: Request) -> bytes:
+    # Bounded while it arrives, compressed or not, so an oversized batch is refused without reading it whole
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Batch too large')
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > INGEST_MAX_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Batch too large')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def read_ingest_batch(request: Request) -> list[IngestEvent]:
+    body = await read_body(request)
+    if request.headers.get('content-encoding', '').lower() == 'gzip':
+        body = decompress(body)
+    if len(body) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Batch too large')
+    content_type = request.headers.get('content-type', 'application/json').split(';')[0].strip().lower()
+    try:
+        if content_type == 'application/json':
+            payload = json.loads(body)
+        elif content_type in MSGPACK_CONTENT_TYPES:
+            payload = msgpack.unpackb(body, timestamp=3)
+        else:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail='Unsupported content type')
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Malformed batch')
+    try:
+        events = events_adapter.validate_python(payload)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    if len(events) > INGEST_MAX_EVENTS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Batch too large')
+    return events
+
+
+def idempotency_key(event: IngestEvent) -> str:
+    # Keyed on a digest so the device API key is not readable from Redis
+    api_key_digest = hashlib.sha1(event.api_key.encode()).hexdigest()
+    return f'{IDEMPOTENCY_KEY_PREFIX}:{api_key_digest}:{event.idempotency_key}'
+
+
+def claim_events(redis_client: redis.Redis, events: list[IngestEvent]) -> list[Optional[IngestResult]]:
+    # A key is claimed with SET NX before the event is applied. Resent events get the stored
+    # result back, or a conflict while the first delivery is still being applied.
+    pipeline = redis_client.pipeline(transaction=False)
+    for event in events:
+        pipeline.set(idempotency_key(event), PENDING, nx=True, ex=PENDING_TTL_SECONDS)
+    claimed = pipeline.execute()
+    for event, is_new in zip(events, claimed):
+        if not is_new:
+            pipeline.get(idempotency_key(event))
+    previous = iter(pipeline.execute())
+    res = []
+    for event, is_new in zip(events, claimed):
+        if is_new:
+            res.append(None)
+            continue
+        stored = next(previous)
+        if stored is None or stored == PENDING:
+            res.append(IngestResult(idempotency_key=event.idempotency_key, status=status.HTTP_409_CONFLICT,
+                                    detail='Event is already being processed'))
+        else:
+            res.append(IngestResult.model_validate_json(stored).model_copy(update={'replayed': True}))
+    return res
+
+
+def release_events(redis_client: redis.Redis, events: list[IngestEvent]):
+    redis_client.delete(*[idempotency_key(event) for event in events])
+
+
+def store_results(redis_client: redis.Redis, events: list[IngestEvent], results: list[IngestResult]):
+    # Server-side failures are released rather than stored so the gateway can retry them
+    pipeline = redis_client.pipeline(transaction=False)
+    for event, result in zip(events, results):
+        if result.status >= 500:
+            pipeline.delete(idempotency_key(event))
+        else:
+            pipeline.set(idempotency_key(event), result.model_dump_json(), ex=IDEMPOTENCY_TTL_SECONDS)
+    pipeline.execute()
+
+
+def process_events(db: Session, kafka_producer: DeliveryProducer, events: list[IngestEvent]) -> list[IngestResult]:
+    results = [None] * len(events)
+
+    def done(i, status_code, detail=None, **kwargs):
+        results[i] = IngestResult(idempotency_key=events[i].idempotency_key, status=status_code, detail=detail,
+                                  **kwargs)
+
+    devices = {}
+    for i, event in enumerate(events):
+        if event.type == IngestEventType.sensor:
+            cache, model = sensor_cache, Sensor
+        else:
+            cache, model = camera_cache, Camera
+        if (model, event.api_key) not in devices:
+            devices[model, event.api_key] = lookup_device(db, cache, model, event.api_key)
+        if devices[model, event.api_key] is None:
+            done(i, status.HTTP_403_FORBIDDEN, 'Invalid API key')
+        elif event.type != IngestEventType.sensor and None in (event.license_plate, event.user_id, event.timestamp):
+            done(i, status.HTTP_422_UNPROCESSABLE_ENTITY, 'license_plate, user_id and timestamp are required')
+
+    sensor_events = [i for i, event in enumerate(events)
+                     if results[i] is None and event.type == IngestEventType.sensor]
+    space_ids = {devices[Sensor, events[i].api_key].parking_space_id for i in sensor_events}
+    spaces = {space.id: space for space in db.query(ParkingSpace).options(selectinload(ParkingSpace.vehicle))
+              .filter(ParkingSpace.id.in_(space_ids))} if space_ids else {}
+    for i in sensor_events:
+        parking_space = spaces.get(devices[Sensor, events[i].api_key].parking_space_id)
+        if parking_space is None:
+            done(i, status.HTTP_404_NOT_FOUND, 'Associated parking space not found')
+        else:
+            done(i, status.HTTP_200_OK, sensor_state=ParkingSpaceState.model_validate(parking_space))
+
+    camera_events = [i for i, event in enumerate(events) if results[i] is None]
+    plates = {events[i].license_plate for i in camera_events}
+    vehicles = {vehicle.license_plate: vehicle for vehicle in
+                db.query(Vehicle).filter(Vehicle.license_plate.in_(plates))} if plates else {}
+    misread = {plate: fuzzy_vehicle_id(plate) for plate in plates - vehicles.keys()}
+    matched_ids = {vehicle_id for vehicle_id in misread.values() if vehicle_id is not None}
+    if matched_ids:
+        matched = {vehicle.id: vehicle for vehicle in db.query(Vehicle).filter(Vehicle.id.in_(matched_ids))}
+        vehicles.update({plate: matched.get(vehicle_id) for plate, vehicle_id in misread.items()})
+    claims = []
+    activity_logs = {}
+    for i in camera_events:
+        event = events[i]
+        vehicle = vehicles.get(event.license_plate)
+        if vehicle is None:
+            done(i, status.HTTP_404_NOT_FOUND, 'Vehicle not registered')
+            continue
+        if vehicle.owner_id != event.user_id:
+            done(i, status.HTTP_403_FORBIDDEN, 'Vehicle not owned by user')
+            continue
+        parking_lot_id = devices[Camera, event.api_key].parking_lot_id
+        if event.type == IngestEventType.validate_in:
+            candidates = [space['id'] for space in
+                          spatial_index.nearest(parking_lot_id, vehicle.vehicle_type, ALLOCATION_CANDIDATES)]
+            parking_space = claim_free_space(db, parking_lot_id, vehicle.vehicle_type, candidates)
+            if parking_space is None:
+                done(i, status.HTTP_400_BAD_REQUEST, 'Parking lot is full')
+                continue
+            # Taken before the commit expires the row
+            claims.append((i, parking_space, vehicle.id, ParkingSpaceOut.model_validate(parking_space,
+                                                                                       from_attributes=True)))
+        activity_logs[i] = ActivityLog(
+            activity_type=event.type.value,
+            vehicle_id=vehicle.id,
+            parking_lot_id=parking_lot_id,
+            timestamp=event.timestamp,
+        )
+    db.add_all(activity_logs.values())
+    # Claims are committed before publishing so no row lock is held while the broker is waited on
+    db.commit()
+
+    # Every state message is in flight before the first one is waited on
+    deliveries = [(i, parking_space, space_out, send_space_state(kafka_producer, space_out.id, vehicle_id,
+                                                                 'reserved'))
+                  for i, parking_space, vehicle_id, space_out in claims]
+    deadline = time.monotonic() + DELIVERY_WAIT_SECONDS
+    reserved = []
+    released = False
+    for i, parking_space, space_out, delivery in deliveries:
+        try:
+            delivery.result(timeout=max(0.0, deadline - time.monotonic()))
+            reserved.append((i, space_out))
+        except (KafkaException, BufferError, FutureTimeoutError) as e:
+            print(f"Failed to deliver state of parking space {space_out.id}: {e!r}")
+            release_space(parking_space)
+            db.delete(activity_logs[i])
+            released = True
+            done(i, status.HTTP_500_INTERNAL_SERVER_ERROR, 'Fail to reserve parking space')
+    if released:
+        db.commit()
+    for i, parking_space in reserved:
+        spatial_index.apply(parking_space.id, 'reserved')
+        done(i, status.HTTP_200_OK, parking_space=parking_space)
+    for i in activity_logs:
+        if results[i] is None:
+            done(i, status.HTTP_204_NO_CONTENT)
+    return results
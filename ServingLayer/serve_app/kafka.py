@@ -1,18 +1,173 @@
-from typing import Annotated
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Annotated, Callable, NamedTuple, Optional
 
 from fastapi import Depends
-from confluent_kafka import Producer
-import os
+from confluent_kafka import Consumer, KafkaException, Producer
+
+from .metrics import kafka_delivery_latency
+
+ASSIGN_TIMEOUT_SECONDS = float(os.getenv('KAFKA_ASSIGN_TIMEOUT_SECONDS', 10))
+
+
+def producer_config() -> dict:
+    return {
+        'bootstrap.servers': os.getenv('KAFKA_BOOTSTRAP_SERVERS'),
+        'linger.ms': int(os.getenv('KAFKA_LINGER_MS', 5)),
+        'batch.size': int(os.getenv('KAFKA_BATCH_SIZE', 65536)),
+        'compression.type': os.getenv('KAFKA_COMPRESSION_TYPE', 'lz4'),
+        'acks': os.getenv('KAFKA_ACKS', 'all'),
+        'delivery.timeout.ms': int(os.getenv('KAFKA_DELIVERY_TIMEOUT_MS', 10000)),
+    }
+
+
+class DeliveryProducer:
+    def __init__(self, config: dict):
+        self.config = config
+        self._producer = None
+        self._thread = None
+        self._running = threading.Event()
+
+    def start(self):
+        self._producer = Producer(self.config)
+        self._running.set()
+        self._thread = threading.Thread(target=self._poll, name='kafka-producer-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._producer is not None:
+            self._producer.flush(timeout)
+
+    def _poll(self):
+        # Delivery callbacks are served here, so request threads never call poll() themselves
+        while self._running.is_set():
+            self._producer.poll(0.1)
+
+    def produce(self, topic: str, key: Optional[str], value: str) -> Future:
+        delivery = Future()
+        sent_at = time.perf_counter()
+
+        def on_delivery(err, msg):
+            outcome = 'ok' if err is None else 'error'
+            kafka_delivery_latency.labels(topic, outcome).observe(time.perf_counter() - sent_at)
+            if err is not None:
+                delivery.set_exception(KafkaException(err))
+            else:
+                delivery.set_result(msg)
+
+        try:
+            self._producer.produce(topic, key=key, value=value, on_delivery=on_delivery)
+        except BufferError as e:
+            delivery.set_exception(e)
+        return delivery
+
+
+kafka_producer = DeliveryProducer(producer_config())
+
+
+def get_kafka_producer() -> DeliveryProducer:
+    return kafka_producer
+
+
+KafkaProducerDependency = Annotated[DeliveryProducer, Depends(get_kafka_producer)]
+
+
+class SpaceStateEvent(NamedTuple):
+    parking_space_id: int
+    state: str
+    vehicle_id: Optional[int]
+    updated_at: Optional[str]
+
+
+def parse_space_state(key: bytes, value: bytes) -> SpaceStateEvent:
+    # parking_space_state carries the JsonConverter envelope expected by the JDBC sink
+    payload = json.loads(value)['payload']
+    return SpaceStateEvent(
+        parking_space_id=int(json.loads(key)['payload']['id']),
+        state=payload['state'],
+        vehicle_id=payload.get('vehicle_id'),
+        updated_at=payload.get('updated_at'),
+    )
+
+
+class VehicleEvent(NamedTuple):
+    vehicle_id: int
+    license_plate: Optional[str]
+
+
+def parse_vehicle(key: bytes, value: bytes) -> VehicleEvent:
+    # jdbc_vehicles is written by the JDBC source connector with schemas disabled
+    row = json.loads(value)
+    return VehicleEvent(vehicle_id=int(row['id']), license_plate=row.get('license_plate'))
+
+
+class TopicListener:
+    def __init__(self, topic: str, decode: Callable[[bytes, bytes], object]):
+        self.topic = topic
+        self.decode = decode
+        self.handlers = []
+        # Set once the consumer owns its partitions, messages produced after that are not missed
+        self.assigned = threading.Event()
+        self._consumer = None
+        self._thread = None
+        self._running = threading.Event()
+
+    def add_handler(self, handler: Callable[[object], None]):
+        self.handlers.append(handler)
+
+    def start(self):
+        # Every process needs every update, so each one joins its own consumer group
+        self._consumer = Consumer({
+            'bootstrap.servers': os.getenv('KAFKA_BOOTSTRAP_SERVERS'),
+            'group.id': f'serving-layer-{self.topic}-{uuid.uuid4().hex}',
+            'auto.offset.reset': 'latest',
+            'enable.auto.commit': False,
+        })
+        self._consumer.subscribe([self.topic], on_assign=lambda consumer, partitions: self.assigned.set())
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name=f'{self.topic}-listener', daemon=True)
+        self._thread.start()
+
+    def wait_until_assigned(self, timeout: float = ASSIGN_TIMEOUT_SECONDS):
+        if not self.assigned.wait(timeout):
+            print(f"Listener on {self.topic} not assigned after {timeout}s, earlier updates may be missed")
 
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
 
-def get_kafka_producer() -> Producer:
-    producer = Producer({
-        'bootstrap.servers': os.getenv('KAFKA_BOOTSTRAP_SERVERS')
-    })
-    try:
-        yield producer
-    finally:
-        producer.flush()
+    def _run(self):
+        try:
+            while self._running.is_set():
+                msg = self._consumer.poll(1.0)
+                if msg is None:
+                    continue
+                if msg.error():
+                    print(f"Consumer error on {self.topic}: {msg.error()}")
+                    continue
+                try:
+                    event = self.decode(msg.key(), msg.value())
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping malformed message on {self.topic}: {e}")
+                    continue
+                for handler in self.handlers:
+                    try:
+                        handler(event)
+                    except Exception as e:
+                        print(f"Handler {handler} failed on {self.topic}: {e}")
+        finally:
+            self._consumer.close()
 
 
-KafkaProducerDependency = Annotated[Producer, Depends(get_kafka_producer)]
\ No newline at end of file
+space_state_listener = TopicListener('parking_space_state', decode=parse_space_state)
+vehicles_listener = TopicListener('jdbc_vehicles', decode=parse_vehicle)
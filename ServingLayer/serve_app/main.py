@@ -1,20 +1,116 @@
-import json
+import os
+from contextlib import asynccontextmanager
 from datetime import datetime
-import collections
-import requests
-from typing import Optional
-from sqlalchemy import func as F
-from fastapi import FastAPI, Query, status, HTTPException
+from typing import Annotated, Optional
+from redis import RedisError
+from fastapi import Depends, FastAPI, Query, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .db import DatabaseDependency
-from .auth import SensorDependency, CameraDependency
-from .models import ParkingSpace, RatingFeedback, Vehicle, ActivityLog
-from .redis import RedisDependency
+from fastapi.responses import StreamingResponse
+from .db import DatabaseDependency, ReadDatabaseDependency, SessionLocal, read_session, replica_router
+from .auth import (SensorDependency, CameraDependency, camera_cache, device_invalidation_listener, invalidate_api_key,
+                   sensor_cache)
+from .models import ParkingLot, ParkingSpace, Vehicle, ActivityLog
+from .redis import RedisDependency, redis_client, redis_pool
 from .schemas import (CapacityReport, ParkingSpaceState, ParkingSpaceOut, ReserveOrder, RatingReport, ValidateModel,
-                      VehicleReport)
-from .kafka import KafkaProducerDependency
+                      VehicleReport, IngestEvent, IngestResult, OccupancyForecast)
+from .metrics import MetricsMiddleware, metrics_response
+from .kafka import KafkaProducerDependency, kafka_producer, space_state_listener, vehicles_listener
+from .capacity_stream import capacity_broadcaster
+from .allocation import ALLOCATION_CANDIDATES, claim_free_space, publish_space_state, release_claim
+from .forecast import FORECAST_MAX_HOURS, occupancy_forecaster
+from .ingest import claim_events, process_events, read_ingest_batch, release_events, store_results
+from .occupancy import occupancy_index
+from .plates import find_vehicle, plate_index
+from .ratings import rating_report, rating_report_query
+from .replicas import ReadYourWritesMiddleware
+from .reservations import RESERVATION_TICK_SECONDS, reservation_expiry
+from .spatial import spatial_index
+from .tasks import PeriodicTask
+from .vehicle_counts import expire_hourly_counts, fetch_hourly_counts
 
-app = FastAPI()
+
+MAX_HOUR_RANGE = 24 * 31
+
+
+def reconcile_indexes():
+    with SessionLocal() as db:
+        drift = occupancy_index.load(db)
+        spatial_index.begin_load()
+        spaces = db.query(ParkingSpace.id, ParkingSpace.parking_lot_id, ParkingSpace.vehicle_type,
+                          ParkingSpace.longitude, ParkingSpace.latitude, ParkingSpace.state) \
+            .filter(ParkingSpace.is_active == True).all()
+        gates = db.query(ParkingLot.id, ParkingLot.longitude, ParkingLot.latitude) \
+            .filter(ParkingLot.longitude.isnot(None), ParkingLot.latitude.isnot(None)).all()
+    spatial_index.build(spaces, {parking_lot_id: (x, y) for parking_lot_id, x, y in gates})
+    if drift:
+        print(f"Occupancy index drifted from parking_spaces by {drift} spaces, reloaded")
+        capacity_broadcaster.mark_all_dirty()
+
+
+def load_plate_index():
+    # From the primary, a lagging replica would miss vehicles whose events were published before the listener started
+    with SessionLocal() as db:
+        plate_index.load(db.query(Vehicle.id, Vehicle.license_plate).yield_per(10000))
+
+
+def refresh_forecast():
+    with read_session() as db:
+        occupancy_forecaster.refresh(db)
+
+
+def add_listener_handlers():
+    vehicles_listener.add_handler(plate_index.on_vehicle)
+    space_state_listener.add_handler(occupancy_index.on_space_state)
+    space_state_listener.add_handler(spatial_index.on_space_state)
+    space_state_listener.add_handler(capacity_broadcaster.on_space_state)
+    space_state_listener.add_handler(reservation_expiry.on_space_state)
+    device_invalidation_listener.add_handler(invalidate_api_key)
+
+
+index_reconciler = PeriodicTask('index-reconciler', float(os.getenv('INDEX_RECONCILE_SECONDS', 300)),
+                                reconcile_indexes)
+reservation_expiry_task = PeriodicTask('reservation-expiry', RESERVATION_TICK_SECONDS, reservation_expiry.tick)
+forecast_refresher = PeriodicTask('forecast-refresher', float(os.getenv('FORECAST_REFRESH_SECONDS', 60)),
+                                  refresh_forecast)
+vehicle_counts_retention = PeriodicTask('vehicle-counts-retention', 3600,
+                                        lambda: expire_hourly_counts(redis_client))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    replica_router.start()
+    kafka_producer.start()
+    add_listener_handlers()
+    # Before the indexes load, they replay the changes that arrive while they scan
+    space_state_listener.start()
+    vehicles_listener.start()
+    space_state_listener.wait_until_assigned()
+    vehicles_listener.wait_until_assigned()
+    reconcile_indexes()
+    reservation_expiry.load()
+    load_plate_index()
+    refresh_forecast()
+    device_invalidation_listener.start()
+    index_reconciler.start()
+    reservation_expiry_task.start()
+    vehicle_counts_retention.start()
+    forecast_refresher.start()
+    capacity_broadcaster.start()
+    yield
+    await capacity_broadcaster.stop()
+    forecast_refresher.stop()
+    vehicle_counts_retention.stop()
+    reservation_expiry_task.stop()
+    index_reconciler.stop()
+    device_invalidation_listener.stop()
+    vehicles_listener.stop()
+    space_state_listener.stop()
+    kafka_producer.stop()
+    replica_router.stop()
+    redis_pool.disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,27 +119,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ReadYourWritesMiddleware, router=replica_router)
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/parking_lots", response_model=CapacityReport, status_code=status.HTTP_200_OK)
 def get_parking_space_from_parking_lot(
-        db: DatabaseDependency,
         parking_lot_id: Optional[int] = Query(default=None),
 ):
-    response = collections.defaultdict(dict)
-    query = db.query(ParkingSpace.vehicle_type, ParkingSpace.state, F.count()).group_by(
-        ParkingSpace.vehicle_type, ParkingSpace.state
-    )
-    if parking_lot_id is not None:
-        query = query.filter(ParkingSpace.parking_lot_id == parking_lot_id)
-    result = query.all()
-    if not result:
+    response = occupancy_index.report(parking_lot_id)
+    if not response:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
-    for vehicle_type, state, count in result:
-        response[vehicle_type][state] = count
     return response
 
 
+@app.get("/parking_lots/stream", status_code=status.HTTP_200_OK)
+async def stream_parking_lot_capacity(
+        parking_lot_id: Optional[int] = Query(default=None),
+):
+    return StreamingResponse(capacity_broadcaster.stream(parking_lot_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.get('/sensors', response_model=ParkingSpaceState, status_code=status.HTTP_200_OK)
 def get_sensor_state(
     sensor: SensorDependency,
@@ -59,18 +156,20 @@ def get_sensor_state(
 
 @app.get('/recommend', response_model=list[ParkingSpaceOut], status_code=status.HTTP_200_OK)
 def recommend_parking_space(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         parking_lot_id: Optional[int] = Query(default=None),
         vehicle_type: str = Query(regex='^(car|motorbike|truck)$'),
-        num_results: int = Query(default=1, gt=0, le=10)
+        num_results: int = Query(default=1, gt=0, le=10),
+        longitude: Optional[float] = Query(default=None),
+        latitude: Optional[float] = Query(default=None),
 ):
-    query = db.query(ParkingSpace)
     if parking_lot_id is not None:
-        query = query.filter(ParkingSpace.parking_lot_id == parking_lot_id)
-    results = query.filter(
-        ParkingSpace.vehicle_type == vehicle_type,
-        ParkingSpace.state == 'free'
-    ).limit(num_results).all()
+        results = spatial_index.nearest(parking_lot_id, vehicle_type, num_results, longitude, latitude)
+    else:
+        results = db.query(ParkingSpace).filter(
+            ParkingSpace.vehicle_type == vehicle_type,
+            ParkingSpace.state == 'free'
+        ).limit(num_results).all()
     if not results:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No parking space available')
     return results
@@ -78,27 +177,12 @@ def recommend_parking_space(
 
 @app.get('/rating', response_model=RatingReport, status_code=status.HTTP_200_OK)
 def get_rating_from_parking_lot(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         parking_lot_id: Optional[int] = Query(default=None),
 ):
-    response = RatingReport(parking_lot_id=parking_lot_id)
-    query = db.query(RatingFeedback.rating, F.count()).group_by(RatingFeedback.rating)
-    if parking_lot_id is not None:
-        query = query.filter(RatingFeedback.parking_lot_id == parking_lot_id)
-    result = query.all()
-    if not result:
+    response = rating_report(parking_lot_id, db.execute(rating_report_query(parking_lot_id)).one())
+    if not response:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
-    for rating, count in result:
-        if rating == 1:
-            response.one_star = count
-        elif rating == 2:
-            response.two_star = count
-        elif rating == 3:
-            response.three_star = count
-        elif rating == 4:
-            response.four_star = count
-        elif rating == 5:
-            response.five_star = count
     return response
 
 
@@ -107,28 +191,7 @@ def reserve_space(
         reserve_order: ReserveOrder,
         kafka_producer: KafkaProducerDependency
 ):
-    exception = None
-
-    def acked(err, msg):
-        if err is not None:
-            nonlocal exception
-            print(f"Failed to deliver message {msg}: {err}")
-            exception = HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                      detail='Failed to reserve space')
-
-    message = reserve_order.model_dump()
-    del message['parking_space_id']
-    message['updated_at'] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-    message['state'] = 'reserved'
-    kafka_producer.produce(
-        topic='parking_space_state_raw',
-        key=str(reserve_order.parking_space_id),
-        value=json.dumps(message),
-        callback=acked
-    )
-    kafka_producer.poll(1)
-    if exception:
-        raise exception
+    publish_space_state(kafka_producer, reserve_order.parking_space_id, reserve_order.vehicle_id, 'reserved')
     return
 
 
@@ -136,42 +199,22 @@ def reserve_space(
 def validate_in(
         camera: CameraDependency,
         db: DatabaseDependency,
+        kafka_producer: KafkaProducerDependency,
         info: ValidateModel
 ):
-    license_plate = info.license_plate
-    vehicle = db.query(Vehicle).filter(Vehicle.license_plate == license_plate).first()
+    vehicle = find_vehicle(db, info.license_plate)
     if vehicle is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vehicle not registered')
     if vehicle.owner_id != info.user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Vehicle not owned by user')
 
-    vehicle_type = vehicle.vehicle_type
     parking_lot_id = camera.parking_lot_id
-    resp = requests.get('http://localhost:8000/parking_lots', params={
-        'parking_lot_id': parking_lot_id,
-    })
-    if resp.status_code != 200:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f'Fail to get space status for parking lot {parking_lot_id}')
-    free_space = resp.json()[vehicle_type]['free']
-    if free_space == 0:
+    candidates = [space['id'] for space in
+                  spatial_index.nearest(parking_lot_id, vehicle.vehicle_type, ALLOCATION_CANDIDATES)]
+    parking_space = claim_free_space(db, parking_lot_id, vehicle.vehicle_type, candidates)
+    if parking_space is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Parking lot is full')
 
-    parking_space_list = requests.get('http://localhost:8000/recommend', params={
-        'parking_lot_id': parking_lot_id,
-        'vehicle_type': vehicle_type,
-    })
-    if parking_space_list.status_code != 200:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Fail to get parking space')
-    parking_space = parking_space_list.json()[0]
-
-    response = requests.post('http://localhost:8000/reserve', json={
-        'parking_space_id': parking_space['id'],
-        'vehicle_id': vehicle.id,
-    })
-    if response.status_code != 204:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Fail to reserve parking space')
-
     activity_log = ActivityLog(
         activity_type='in',
         vehicle_id=vehicle.id,
@@ -179,7 +222,15 @@ def validate_in(
         timestamp=info.timestamp,
     )
     db.add(activity_log)
+    # Read before the commit expires them, so no connection is checked out while the broker is waited on
+    parking_space_id, vehicle_id = parking_space.id, vehicle.id
     db.commit()
+    try:
+        publish_space_state(kafka_producer, parking_space_id, vehicle_id, 'reserved')
+    except HTTPException:
+        release_claim(db, parking_space, activity_log)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Fail to reserve parking space')
+    spatial_index.apply(parking_space_id, 'reserved')
     return parking_space
 
 
@@ -189,8 +240,7 @@ def validate_out(
         db: DatabaseDependency,
         info: ValidateModel
 ):
-    license_plate = info.license_plate
-    vehicle = db.query(Vehicle).filter(Vehicle.license_plate == license_plate).first()
+    vehicle = find_vehicle(db, info.license_plate)
     if vehicle is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vehicle not registered')
     if vehicle.owner_id != info.user_id:
@@ -206,26 +256,71 @@ def validate_out(
     return
 
 
+@app.post('/ingest', response_model=list[IngestResult], status_code=status.HTTP_200_OK)
+def ingest_events(
+        db: DatabaseDependency,
+        redis: RedisDependency,
+        kafka_producer: KafkaProducerDependency,
+        events: Annotated[list[IngestEvent], Depends(read_ingest_batch)],
+):
+    try:
+        previous = claim_events(redis, events)
+    except RedisError as e:
+        print(f"Failed to claim idempotency keys: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Idempotency store unavailable')
+    fresh = [event for event, result in zip(events, previous) if result is None]
+    try:
+        fresh_results = process_events(db, kafka_producer, fresh) if fresh else []
+    except Exception:
+        release_events(redis, fresh)
+        raise
+    try:
+        store_results(redis, fresh, fresh_results)
+    except RedisError as e:
+        print(f"Failed to store ingest results: {e}")
+    fresh_results = iter(fresh_results)
+    return [result if result is not None else next(fresh_results) for result in previous]
+
+
 @app.get('/vehicles', response_model=list[VehicleReport], status_code=status.HTTP_200_OK)
 def get_vehicle_by_hour(
         redis: RedisDependency,
         final_time: int = Query(default_factory=lambda: int(datetime.utcnow().timestamp()), ge=0),
-        hour_range: int = Query(default=24, ge=1, le=24),
+        hour_range: int = Query(default=24, ge=1, le=MAX_HOUR_RANGE),
+        parking_lot_id: Optional[int] = Query(default=None),
+):
+    return fetch_hourly_counts(redis, final_time, hour_range, parking_lot_id)
+
+
+@app.get('/forecast', response_model=list[OccupancyForecast], status_code=status.HTTP_200_OK)
+def get_occupancy_forecast(
+        parking_lot_id: int = Query(),
+        hours: int = Query(default=24, ge=1, le=FORECAST_MAX_HOURS),
 ):
-    res = []
-    for hour in range(hour_range):
-        datetime_format = datetime.fromtimestamp(final_time - 3600 * hour).strftime("%Y-%m-%d %H:00:00")
-        key = f'parking_lot_vehicle:{datetime_format}'
-        record = {
-            'hour': datetime_format,
-        }
-        for vehicle_type in ['car', 'motorbike', 'truck']:
-            vehicle = redis.hget(key, vehicle_type)
-            if not vehicle:
-                vehicle = 0
-            record[vehicle_type] = int(vehicle)
-        res.append(record)
-    return res
+    response = occupancy_forecaster.forecast(parking_lot_id, hours)
+    if response is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Information not found')
+    return response
+
+
+@app.get('/stats', status_code=status.HTTP_200_OK)
+def get_stats():
+    return {
+        'redis_pool': redis_pool.stats(),
+        'capacity_stream_subscribers': capacity_broadcaster.subscriber_count(),
+        'reservations': reservation_expiry.stats(),
+        'forecast': occupancy_forecaster.stats(),
+        'replicas': replica_router.stats(),
+        'device_auth_cache': {
+            'sensors': sensor_cache.stats(),
+            'cameras': camera_cache.stats(),
+        },
+    }
+
+
+@app.get('/metrics', include_in_schema=False)
+def get_metrics():
+    return metrics_response()
 
 
 @app.get('/', status_code=status.HTTP_200_OK)
@@ -0,0 +1,125 @@
+# Copy of SmartParkingLotBackend/app/utils/metrics.py, which is the one to change first. Each image builds
+# from its own directory only, so the module cannot be shared.
+import time
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+request_latency = Histogram('http_request_duration_seconds', 'Time to the response start by route',
+                            ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+sql_latency = Histogram('db_statement_duration_seconds', 'SQL statement execution time',
+                        ['engine', 'operation'], buckets=LATENCY_BUCKETS)
+redis_latency = Histogram('redis_command_duration_seconds', 'Redis command time from pool checkout to release',
+                          ['pool', 'command'], buckets=LATENCY_BUCKETS)
+db_read_routes = Counter('db_read_routes_total', 'Reads that could go to a replica by the engine they went to and why',
+                         ['engine', 'reason'])
+replica_lag = Gauge('db_replica_lag_seconds', 'Replication lag at the last health check, NaN if unreachable',
+                    ['engine'])
+replica_healthy = Gauge('db_replica_healthy', 'Whether the replica takes reads', ['engine'])
+response_cache_requests = Counter('response_cache_requests_total', 'Requests to cached routes by outcome',
+                                  ['route', 'outcome'])
+response_cache_saved_db = Counter('response_cache_saved_db_seconds_total',
+                                  'DB time of cache hits, as measured on the miss that filled the entry', ['route'])
+# Serving layer only, the backend never observes these
+device_auth_cache_requests = Counter('device_auth_cache_requests_total', 'Device API key lookups by cache outcome',
+                                     ['device', 'outcome'])
+plate_index_lookups = Counter('plate_index_lookups_total', 'Plate index lookups after an exact plate miss by outcome',
+                              ['outcome'])
+kafka_delivery_latency = Histogram('kafka_delivery_duration_seconds', 'Kafka produce to delivery report time',
+                                   ['topic', 'outcome'], buckets=LATENCY_BUCKETS)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, BaseHTTPMiddleware would buffer streamed responses like the capacity stream. The clock
+    # stops at the response start so long lived streams are not reported as slow requests.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+                observe_request(scope, message['status'], time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not started:
+                observe_request(scope, 500, time.perf_counter() - start)
+            raise
+
+
+def observe_request(scope, status_code: int, elapsed: float):
+    # Labelled by route template, unmatched paths share one label so scanners cannot blow up the series
+    route = scope.get('route')
+    request_latency.labels(scope['method'], route.path if route is not None else 'unmatched',
+                           status_code).observe(elapsed)
+
+
+def instrument_engine(engine: Engine, name: str):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['statement_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('statement_start', None)
+        if start is not None:
+            operation = (statement.split(None, 1) or ['UNKNOWN'])[0].upper()
+            sql_latency.labels(name, operation).observe(time.perf_counter() - start)
+
+
+class PoolCollector:
+    # Pool gauges are read at scrape time rather than updated on every checkout
+    def __init__(self):
+        self.engines = {}
+        self.redis_pools = {}
+
+    def add_engine(self, name: str, engine: Engine):
+        self.engines[name] = engine
+
+    def add_redis_pool(self, name: str, pool):
+        self.redis_pools[name] = pool
+
+    def collect(self):
+        db_pool = GaugeMetricFamily('db_pool_connections', 'SQLAlchemy pool connections by state',
+                                    labels=['engine', 'state'])
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            db_pool.add_metric([name, 'checked_out'], pool.checkedout())
+            db_pool.add_metric([name, 'idle'], pool.checkedin())
+            db_pool.add_metric([name, 'overflow'], max(0, pool.overflow()))
+            db_pool.add_metric([name, 'size'], pool.size())
+        yield db_pool
+        redis_pool = GaugeMetricFamily('redis_pool_connections', 'Redis pool connections by state',
+                                       labels=['pool', 'state'])
+        for name, pool in self.redis_pools.items():
+            stats = pool.stats()
+            redis_pool.add_metric([name, 'in_use'], stats['in_use'])
+            redis_pool.add_metric([name, 'created'], stats['created'])
+            redis_pool.add_metric([name, 'max'], stats['max_connections'])
+        yield redis_pool
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -36,6 +36,19 @@ class ParkingSpace(Base):
     vehicle = relationship("Vehicle")
 
 
+class ParkingLot(Base):
+    __tablename__ = "parking_lots"
+
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    name = Column(String, unique=True, index=True)
+    longitude = Column(Float)
+    latitude = Column(Float)
+    created_at = Column(TIMESTAMP, server_default=text("now()"))
+    updated_at = Column(TIMESTAMP, server_default=text("NULL"))
+    is_active = Column(Boolean, default=True)
+    deleted_at = Column(TIMESTAMP, server_default=text("NULL"))
+
+
 class RatingFeedback(Base):
     __tablename__ = "rating_feedbacks"
 
@@ -82,3 +95,17 @@ class Vehicle(Base):
     updated_at = Column(TIMESTAMP, server_default=text("NULL"))
     owner_id = Column(Integer, nullable=False)
     created_at = Column(TIMESTAMP, server_default=text("now()"))
+
+
+class RatingAggregate(Base):
+    __tablename__ = "rating_aggregates"
+
+    parking_lot_id = Column(Integer, primary_key=True)
+    one_star = Column(Integer, nullable=False, server_default=text("0"))
+    two_star = Column(Integer, nullable=False, server_default=text("0"))
+    three_star = Column(Integer, nullable=False, server_default=text("0"))
+    four_star = Column(Integer, nullable=False, server_default=text("0"))
+    five_star = Column(Integer, nullable=False, server_default=text("0"))
+    rating_count = Column(Integer, nullable=False, server_default=text("0"))
+    rating_sum = Column(Integer, nullable=False, server_default=text("0"))
+    updated_at = Column(TIMESTAMP, server_default=text("now()"))
@@ -0,0 +1,101 @@
+import collections
+import threading
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from .kafka import SpaceStateEvent
+from .models import ParkingSpace
+from .schemas import StateType, VehicleType
+
+ALL_LOTS = None
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spaces = {}
+        self._counts = collections.Counter()
+        self._replay = None
+        self.last_reconciled_at = None
+        self.last_drift = 0
+
+    def load(self, db: Session) -> int:
+        # State changes that arrive during the scan may predate it or not, so they are kept and
+        # replayed over the scan once it is swapped in instead of being lost with the old maps
+        with self._lock:
+            self._replay = []
+        try:
+            rows = db.query(ParkingSpace.id, ParkingSpace.parking_lot_id, ParkingSpace.vehicle_type,
+                            ParkingSpace.state).all()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        spaces = {}
+        counts = collections.Counter()
+        for parking_space_id, parking_lot_id, vehicle_type, state in rows:
+            spaces[parking_space_id] = (parking_lot_id, vehicle_type, state)
+            counts[(parking_lot_id, vehicle_type, state)] += 1
+            counts[(ALL_LOTS, vehicle_type, state)] += 1
+        with self._lock:
+            old_counts = self._counts
+            self._spaces = spaces
+            self._counts = counts
+            replay, self._replay = self._replay, None
+            for parking_space_id, state in replay:
+                self._apply(parking_space_id, state)
+            drift = 0
+            if self.last_reconciled_at is not None:
+                drift = sum((old_counts - counts).values()) + sum((counts - old_counts).values())
+        self.last_reconciled_at = datetime.utcnow()
+        self.last_drift = drift
+        return drift
+
+    def _apply(self, parking_space_id: int, state: str) -> bool:
+        entry = self._spaces.get(parking_space_id)
+        if entry is None:
+            # Spaces created after the last scan are picked up by the next reconciliation
+            return False
+        parking_lot_id, vehicle_type, old_state = entry
+        if old_state == state:
+            return False
+        self._spaces[parking_space_id] = (parking_lot_id, vehicle_type, state)
+        for lot in (parking_lot_id, ALL_LOTS):
+            self._counts[(lot, vehicle_type, old_state)] -= 1
+            self._counts[(lot, vehicle_type, state)] += 1
+        return True
+
+    def apply(self, parking_space_id: int, state: str) -> bool:
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((parking_space_id, state))
+            return self._apply(parking_space_id, state)
+
+    def on_space_state(self, event: SpaceStateEvent):
+        self.apply(event.parking_space_id, event.state)
+
+    def parking_lot_of(self, parking_space_id: int):
+        entry = self._spaces.get(parking_space_id)
+        return entry[0] if entry is not None else None
+
+    def state_of(self, parking_space_id: int):
+        entry = self._spaces.get(parking_space_id)
+        return entry[2] if entry is not None else None
+
+    def parking_lots(self) -> set:
+        with self._lock:
+            return {parking_lot_id for parking_lot_id, _, _ in self._spaces.values()}
+
+    def report(self, parking_lot_id=ALL_LOTS) -> dict:
+        response = collections.defaultdict(dict)
+        with self._lock:
+            for vehicle_type in VehicleType:
+                for state in StateType:
+                    count = self._counts.get((parking_lot_id, vehicle_type.value, state.value), 0)
+                    if count > 0:
+                        response[vehicle_type.value][state.value] = count
+        return response
+
+
+occupancy_index = OccupancyIndex()
@@ -0,0 +1,195 @@
+import itertools
+import os
+import threading
+from collections import defaultdict
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .kafka import VehicleEvent
+from .metrics import plate_index_lookups
+from .models import Vehicle
+
+PLATE_MAX_EDITS = int(os.getenv('PLATE_MAX_EDITS', 1))
+PLATE_MERGE_THRESHOLD = 50_000
+
+
+def normalize_plate(license_plate: str) -> str:
+    return ''.join(ch for ch in license_plate.upper() if ch.isalnum())
+
+
+def deletion_variants(plate: str, max_edits: int) -> set:
+    variants = {plate}
+    for edits in range(1, min(max_edits, len(plate)) + 1):
+        for positions in itertools.combinations(range(len(plate)), edits):
+            variants.add(''.join(ch for i, ch in enumerate(plate) if i not in positions))
+    return variants
+
+
+def variant_hashes(plate: str, max_edits: int) -> np.ndarray:
+    return np.fromiter((hash(variant) for variant in deletion_variants(plate, max_edits)), dtype=np.int64)
+
+
+def edit_distance(a: str, b: str, max_edits: int) -> int:
+    # Levenshtein distance, anything above max_edits is reported as max_edits + 1
+    if abs(len(a) - len(b)) > max_edits:
+        return max_edits + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_edits:
+            return max_edits + 1
+        previous = current
+    return min(previous[-1], max_edits + 1)
+
+
+class PlateIndex:
+    # Two plates within k edits share at least one variant obtained by deleting up to k characters
+    # from each, so a lookup only verifies vehicles sharing a variant hash. Hashes live in sorted
+    # numpy arrays, plates added since the last build go to a small dict merged in once it grows.
+    def __init__(self, max_edits: int = PLATE_MAX_EDITS):
+        self.max_edits = max_edits
+        self._lock = threading.Lock()
+        self._vehicles = {}
+        self._plates = {}
+        self._hashes = np.empty(0, dtype=np.int64)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._pending = defaultdict(list)
+        self._pending_size = 0
+        self._replay = None
+
+    def load(self, rows: Iterable[Tuple[int, str]]):
+        # rows is read lazily here, vehicle events that arrive meanwhile are replayed over the loaded plates
+        with self._lock:
+            self._replay = []
+        vehicles, plates, hashes, ids = {}, {}, [], []
+        try:
+            for vehicle_id, license_plate in rows:
+                if not license_plate:
+                    continue
+                plate = normalize_plate(license_plate)
+                vehicles[vehicle_id] = plate
+                plates[plate] = vehicle_id
+                variants = deletion_variants(plate, self.max_edits)
+                hashes.extend(hash(variant) for variant in variants)
+                ids.extend([vehicle_id] * len(variants))
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        hashes, ids = self._sorted([np.array(hashes, dtype=np.int64)], [np.array(ids, dtype=np.int64)])
+        with self._lock:
+            self._vehicles, self._plates = vehicles, plates
+            self._hashes, self._ids = hashes, ids
+            self._pending = defaultdict(list)
+            self._pending_size = 0
+            replay, self._replay = self._replay, None
+            for vehicle_id, license_plate in replay:
+                self._upsert(vehicle_id, license_plate)
+
+    @staticmethod
+    def _sorted(hashes: list, ids: list):
+        hashes, ids = np.concatenate(hashes), np.concatenate(ids)
+        order = np.argsort(hashes, kind='stable')
+        return hashes[order], ids[order]
+
+    def _upsert(self, vehicle_id: int, license_plate: Optional[str]):
+        plate = normalize_plate(license_plate) if license_plate else None
+        previous = self._vehicles.get(vehicle_id)
+        if previous == plate:
+            return
+        if previous is not None and self._plates.get(previous) == vehicle_id:
+            del self._plates[previous]
+        if plate is None:
+            # Hashes of the old plate stay behind and are discarded when a lookup verifies them
+            self._vehicles.pop(vehicle_id, None)
+            return
+        self._vehicles[vehicle_id] = plate
+        self._plates[plate] = vehicle_id
+        for variant in variant_hashes(plate, self.max_edits):
+            self._pending[int(variant)].append(vehicle_id)
+            self._pending_size += 1
+        if self._pending_size >= PLATE_MERGE_THRESHOLD:
+            self._merge()
+
+    def upsert(self, vehicle_id: int, license_plate: Optional[str]):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((vehicle_id, license_plate))
+            self._upsert(vehicle_id, license_plate)
+
+    def _merge(self):
+        hashes = np.fromiter((h for h, ids in self._pending.items() for _ in ids), dtype=np.int64)
+        ids = np.fromiter((i for ids in self._pending.values() for i in ids), dtype=np.int64)
+        self._hashes, self._ids = self._sorted([self._hashes, hashes], [self._ids, ids])
+        self._pending = defaultdict(list)
+        self._pending_size = 0
+
+    def on_vehicle(self, event: VehicleEvent):
+        self.upsert(event.vehicle_id, event.license_plate)
+
+    def match(self, license_plate: str) -> Optional[Tuple[int, int]]:
+        plate = normalize_plate(license_plate)
+        vehicle_id = self._plates.get(plate)
+        if vehicle_id is not None:
+            return vehicle_id, 0
+        variants = np.unique(variant_hashes(plate, self.max_edits))
+        with self._lock:
+            hashes, ids = self._hashes, self._ids
+            candidates = {i for variant in variants for i in self._pending.get(int(variant), ())}
+        left = np.searchsorted(hashes, variants, side='left')
+        right = np.searchsorted(hashes, variants, side='right')
+        for start, end in zip(left, right):
+            candidates.update(ids[start:end].tolist())
+
+        best, best_distance, ambiguous = None, self.max_edits + 1, False
+        for candidate in candidates:
+            candidate_plate = self._vehicles.get(candidate)
+            if candidate_plate is None:
+                continue
+            distance = edit_distance(plate, candidate_plate, self.max_edits)
+            if distance < best_distance:
+                best, best_distance, ambiguous = candidate, distance, False
+            elif distance == best_distance and distance <= self.max_edits:
+                ambiguous = True
+        # A misread that is equally close to two registered plates must not open the gate for either
+        if best is None or ambiguous:
+            return None
+        return best, best_distance
+
+
+plate_index = PlateIndex()
+
+
+def fuzzy_vehicle_id(license_plate: str) -> Optional[int]:
+    # Counted rather than logged, plates are personal data
+    match = plate_index.match(license_plate)
+    if match is None:
+        plate_index_lookups.labels('unmatched').inc()
+        return None
+    vehicle_id, distance = match
+    plate_index_lookups.labels('fuzzy' if distance else 'normalized').inc()
+    return vehicle_id
+
+
+def find_vehicle(db: Session, license_plate: str) -> Optional[Vehicle]:
+    vehicle = db.query(Vehicle).filter(Vehicle.license_plate == license_plate).first()
+    if vehicle is None:
+        vehicle_id = fuzzy_vehicle_id(license_plate)
+        if vehicle_id is not None:
+            vehicle = db.get(Vehicle, vehicle_id)
+    return vehicle
+
+
+async def find_vehicle_async(db: AsyncSession, license_plate: str) -> Optional[Vehicle]:
+    vehicle = (await db.scalars(select(Vehicle).where(Vehicle.license_plate == license_plate).limit(1))).first()
+    if vehicle is None:
+        vehicle_id = fuzzy_vehicle_id(license_plate)
+        if vehicle_id is not None:
+            vehicle = await db.get(Vehicle, vehicle_id)
+    return vehicle
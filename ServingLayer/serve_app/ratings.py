@@ -0,0 +1,28 @@
+from typing import Optional
+
+from sqlalchemy import Select, func as F, select
+
+from .models import RatingAggregate
+from .schemas import RatingReport
+
+STAR_COLUMNS = ('one_star', 'two_star', 'three_star', 'four_star', 'five_star')
+
+
+def rating_report_query(parking_lot_id: Optional[int] = None) -> Select:
+    # One primary key row per lot, the report over all lots sums one row per lot
+    query = select(*[F.coalesce(F.sum(getattr(RatingAggregate, column)), 0).label(column)
+                     for column in STAR_COLUMNS + ('rating_count', 'rating_sum')])
+    if parking_lot_id is not None:
+        query = query.where(RatingAggregate.parking_lot_id == parking_lot_id)
+    return query
+
+
+def rating_report(parking_lot_id: Optional[int], row) -> Optional[RatingReport]:
+    if not row.rating_count:
+        return None
+    return RatingReport(
+        parking_lot_id=parking_lot_id,
+        rating_count=row.rating_count,
+        average=round(row.rating_sum / row.rating_count, 2),
+        **{column: getattr(row, column) for column in STAR_COLUMNS},
+    )
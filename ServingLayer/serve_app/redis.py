@@ -1,16 +1,124 @@
 import os
-from typing import Annotated
+import threading
+import time
+from typing import Annotated, Callable, Optional
 
 import redis
 from fastapi import Depends
 
+from .metrics import pool_collector, redis_latency
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, name: str = 'default', **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.checkouts = 0
+        self.checkout_errors = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        self.checkouts += 1
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.checkout_errors += 1
+            raise
+        # Pipelines check out under MULTI whether or not they run as a transaction
+        connection.metered_command = ('PIPELINE' if command_name == 'MULTI' else command_name, start)
+        return connection
+
+    def release(self, connection):
+        command_name, start = connection.metered_command
+        redis_latency.labels(self.name, command_name).observe(time.perf_counter() - start)
+        super().release(connection)
+
+    def stats(self) -> dict:
+        # Free slots are either idle connections or not yet created ones
+        in_use = self.max_connections - self.pool.qsize()
+        return {
+            'max_connections': self.max_connections,
+            'created': len(self._connections),
+            'in_use': in_use,
+            'saturation': round(in_use / self.max_connections, 3),
+            'checkouts': self.checkouts,
+            'checkout_errors': self.checkout_errors,
+        }
+
+
+redis_pool = MeteredConnectionPool(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+    timeout=float(os.getenv('REDIS_POOL_TIMEOUT', 2)),
+    health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    socket_keepalive=True,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+pool_collector.add_redis_pool('default', redis_pool)
+
 
 def get_redis():
-    r = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'))
-    try:
-        yield r
-    finally:
-        r.close()
+    return redis_client
+
+
+RedisDependency = Annotated[redis.Redis, Depends(get_redis)]
+
+
+DEVICE_INVALIDATION_CHANNEL = 'device_invalidations'
+
+
+class ChannelListener:
+    def __init__(self, redis_client: redis.Redis, channel: str, on_subscribe: Optional[Callable[[], None]] = None):
+        self.redis_client = redis_client
+        self.channel = channel
+        self.on_subscribe = on_subscribe
+        self.handlers = []
+        self._thread = None
+        self._running = threading.Event()
+
+    def add_handler(self, handler: Callable[[str], None]):
+        self.handlers.append(handler)
+
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name=f'{self.channel}-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while self._running.is_set():
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Messages published while unsubscribed are lost, let the owner resync
+                if self.on_subscribe is not None:
+                    self.on_subscribe()
+                while self._running.is_set():
+                    msg = pubsub.get_message(timeout=1.0)
+                    if msg is None:
+                        continue
+                    data = msg['data'].decode('utf8')
+                    for handler in self.handlers:
+                        try:
+                            handler(data)
+                        except Exception as e:
+                            print(f"Handler {handler} failed on {self.channel}: {e}")
+            except redis.RedisError as e:
+                print(f"Subscription to {self.channel} lost: {e}")
+                time.sleep(1)
+            finally:
+                pubsub.close()
 
 
-RedisDependency = Annotated[redis.Redis, Depends(get_redis)]
\ No newline at end of file
+device_events_redis = redis.Redis(
+    host=os.getenv('DEVICE_EVENTS_REDIS_HOST', os.getenv('REDIS_HOST')),
+    port=os.getenv('DEVICE_EVENTS_REDIS_PORT', os.getenv('REDIS_PORT')),
+    health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    socket_keepalive=True,
+)
@@ -0,0 +1,142 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Optional
+
+import redis
+from confluent_kafka import KafkaException
+
+from .allocation import DELIVERY_WAIT_SECONDS, send_space_state
+from .kafka import DeliveryProducer, SpaceStateEvent, kafka_producer
+from .occupancy import occupancy_index
+from .redis import redis_client
+
+RESERVATION_TTL_SECONDS = float(os.getenv('RESERVATION_TTL_SECONDS', 900))
+RESERVATION_TICK_SECONDS = float(os.getenv('RESERVATION_TICK_SECONDS', 1))
+RESERVATION_RETRY_SECONDS = 30
+DEADLINES_KEY = 'reservation_deadlines'
+
+
+class ReservationExpiry:
+    def __init__(self, redis_client: redis.Redis, kafka_producer: DeliveryProducer,
+                 is_reserved: Callable[[int], bool] = lambda parking_space_id: True,
+                 ttl: float = RESERVATION_TTL_SECONDS, clock: Callable[[], float] = time.time):
+        self.redis_client = redis_client
+        self.kafka_producer = kafka_producer
+        self.is_reserved = is_reserved
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Cancelled or rescheduled entries stay in the heap and are skipped when popped,
+        # _deadlines holds the live deadline of every tracked space
+        self._heap = []
+        self._deadlines = {}
+        self._replay = None
+        self.expired = 0
+
+    def load(self):
+        # Deadlines live in a Redis sorted set as well, so they survive restarts and are shared by replicas
+        with self._lock:
+            self._replay = []
+        deadlines = {int(member): score for member, score in self.redis_client.zrange(DEADLINES_KEY, 0, -1,
+                                                                                     withscores=True)}
+        heap = [(deadline, parking_space_id) for parking_space_id, deadline in deadlines.items()]
+        heapq.heapify(heap)
+        with self._lock:
+            self._deadlines = deadlines
+            self._heap = heap
+            # Reservations tracked or cancelled while the set was read, None deadlines are cancels
+            replay, self._replay = self._replay or [], None
+            for parking_space_id, deadline in replay:
+                if deadline is None:
+                    self._deadlines.pop(parking_space_id, None)
+                else:
+                    self._deadlines[parking_space_id] = deadline
+                    heapq.heappush(self._heap, (deadline, parking_space_id))
+
+    def _schedule(self, parking_space_id: int, deadline: float):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((parking_space_id, deadline))
+            self._deadlines[parking_space_id] = deadline
+            heapq.heappush(self._heap, (deadline, parking_space_id))
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(d, s) for s, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def _add(self, parking_space_id: int, deadline: float):
+        self._schedule(parking_space_id, deadline)
+        self.redis_client.zadd(DEADLINES_KEY, {parking_space_id: deadline})
+
+    def track(self, parking_space_id: int, now: Optional[float] = None):
+        self._add(parking_space_id, (self.clock() if now is None else now) + self.ttl)
+
+    def cancel(self, parking_space_id: int):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((parking_space_id, None))
+            tracked = self._deadlines.pop(parking_space_id, None) is not None
+        if tracked:
+            self.redis_client.zrem(DEADLINES_KEY, parking_space_id)
+
+    def on_space_state(self, event: SpaceStateEvent):
+        if event.state == 'reserved':
+            self.track(event.parking_space_id)
+        else:
+            self.cancel(event.parking_space_id)
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, parking_space_id = heapq.heappop(self._heap)
+                if self._deadlines.get(parking_space_id) == deadline:
+                    del self._deadlines[parking_space_id]
+                    due.append((deadline, parking_space_id))
+        return due
+
+    def tick(self, now: Optional[float] = None) -> list:
+        now = self.clock() if now is None else now
+        due = self._pop_due(now)
+        if not due:
+            return []
+        # ZREM is the claim: whichever replica removes the member publishes the release
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for _, parking_space_id in due:
+            pipeline.zrem(DEADLINES_KEY, parking_space_id)
+        try:
+            claimed = pipeline.execute()
+        except redis.RedisError:
+            for deadline, parking_space_id in due:
+                self._schedule(parking_space_id, deadline)
+            raise
+
+        deliveries = []
+        for (_, parking_space_id), is_claimed in zip(due, claimed):
+            if is_claimed and self.is_reserved(parking_space_id):
+                deliveries.append((parking_space_id,
+                                   send_space_state(self.kafka_producer, parking_space_id, None, 'free')))
+        expired = []
+        for parking_space_id, delivery in deliveries:
+            try:
+                delivery.result(timeout=DELIVERY_WAIT_SECONDS)
+                expired.append(parking_space_id)
+            except (KafkaException, BufferError, FutureTimeoutError) as e:
+                print(f"Failed to release reservation of parking space {parking_space_id}: {e!r}")
+                self._add(parking_space_id, now + RESERVATION_RETRY_SECONDS)
+        self.expired += len(expired)
+        return expired
+
+    def stats(self) -> dict:
+        return {
+            'outstanding': len(self._deadlines),
+            'expired': self.expired,
+        }
+
+
+reservation_expiry = ReservationExpiry(
+    redis_client, kafka_producer,
+    is_reserved=lambda parking_space_id: occupancy_index.state_of(parking_space_id) in ('reserved', None),
+)
@@ -2,7 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class StateType(str, Enum):
@@ -44,20 +44,22 @@ class CapacityReport(BaseModel):
 
 class ParkingSpaceOut(BaseModel):
     id: int
-    longitude: int
-    latitude: int
+    longitude: float
+    latitude: float
     parking_lot_id: int
     vehicle_type: VehicleType
     state: StateType = StateType.free
 
 
 class RatingReport(BaseModel):
-    parking_lot_id: int
+    parking_lot_id: Optional[int] = None
     one_star: int = 0
     two_star: int = 0
     three_star: int = 0
     four_star: int = 0
     five_star: int = 0
+    rating_count: int = 0
+    average: Optional[float] = None
 
 
 class ReserveOrder(BaseModel):
@@ -76,3 +78,40 @@ class VehicleReport(BaseModel):
     car: int = 0
     motorbike: int = 0
     truck: int = 0
+
+
+class IngestEventType(str, Enum):
+    validate_in = 'in'
+    validate_out = 'out'
+    sensor = 'sensor'
+
+
+class IngestEvent(BaseModel):
+    idempotency_key: str = Field(min_length=1, max_length=128)
+    api_key: str
+    type: IngestEventType
+    license_plate: Optional[str] = None
+    user_id: Optional[int] = None
+    timestamp: Optional[datetime] = None
+
+
+class IngestResult(BaseModel):
+    idempotency_key: str
+    status: int
+    detail: Optional[str] = None
+    parking_space: Optional[ParkingSpaceOut] = None
+    sensor_state: Optional[ParkingSpaceState] = None
+    replayed: bool = False
+
+
+class ForecastCounts(BaseModel):
+    arrivals: float = 0
+    departures: float = 0
+    free: int = 0
+
+
+class OccupancyForecast(BaseModel):
+    hour: str
+    car: ForecastCounts = ForecastCounts()
+    motorbike: ForecastCounts = ForecastCounts()
+    truck: ForecastCounts = ForecastCounts()
@@ -0,0 +1,181 @@
+import collections
+import heapq
+import itertools
+import math
+import threading
+from typing import Iterable, Optional
+
+from .kafka import SpaceStateEvent
+
+SPACES_PER_CELL = 4
+
+
+class _Grid:
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(dict)
+        self.size = 0
+        self.bounds = None
+
+    def _cell(self, x: float, y: float):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, space_id: int, x: float, y: float):
+        cx, cy = self._cell(x, y)
+        self.cells[(cx, cy)][space_id] = (x, y)
+        self.size += 1
+        if self.bounds is None:
+            self.bounds = [cx, cy, cx, cy]
+        else:
+            self.bounds = [min(self.bounds[0], cx), min(self.bounds[1], cy),
+                           max(self.bounds[2], cx), max(self.bounds[3], cy)]
+
+    def remove(self, space_id: int, x: float, y: float):
+        key = self._cell(x, y)
+        cell = self.cells.get(key)
+        if cell is not None and cell.pop(space_id, None) is not None:
+            self.size -= 1
+            if not cell:
+                del self.cells[key]
+
+    @staticmethod
+    def _ring(cx: int, cy: int, radius: int):
+        if radius == 0:
+            yield cx, cy
+            return
+        for dx in range(-radius, radius + 1):
+            yield cx + dx, cy - radius
+            yield cx + dx, cy + radius
+        for dy in range(-radius + 1, radius):
+            yield cx - radius, cy + dy
+            yield cx + radius, cy + dy
+
+    def nearest(self, x: float, y: float, k: int):
+        if self.size == 0:
+            return []
+        cx, cy = self._cell(x, y)
+        min_x, min_y, max_x, max_y = self.bounds
+        radius = max(0, min_x - cx, cx - max_x, min_y - cy, cy - max_y)
+        last_radius = max(cx - min_x, max_x - cx, cy - min_y, max_y - cy)
+        best = []
+        while radius <= last_radius:
+            for key in self._ring(cx, cy, radius):
+                cell = self.cells.get(key)
+                if not cell:
+                    continue
+                for space_id, (sx, sy) in cell.items():
+                    distance = (sx - x) ** 2 + (sy - y) ** 2
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, space_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, space_id))
+            # Every space in ring radius + 1 is at least radius cells away from the query point
+            if len(best) == k and -best[0][0] <= (radius * self.cell_size) ** 2:
+                break
+            radius += 1
+        return [space_id for _, space_id in sorted(best, key=lambda item: (-item[0], item[1]))]
+
+    def any(self, k: int):
+        space_ids = (space_id for cell in self.cells.values() for space_id in cell)
+        return list(itertools.islice(space_ids, k))
+
+
+def _cell_size(points: list) -> float:
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    width, height = max(xs) - min(xs), max(ys) - min(ys)
+    if width > 0 and height > 0:
+        return math.sqrt(width * height * SPACES_PER_CELL / len(points))
+    return max(width, height, 1.0) * SPACES_PER_CELL / len(points)
+
+
+class SpatialIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spaces = {}
+        self._free = set()
+        self._grids = {}
+        self._cell_sizes = {}
+        self._gates = {}
+        self._replay = None
+
+    def begin_load(self):
+        # Call before scanning the spaces passed to build. Like OccupancyIndex.load, state changes that
+        # arrive in between are replayed over the scan once build swaps it in.
+        with self._lock:
+            self._replay = []
+
+    def build(self, spaces: Iterable[tuple], gates: dict):
+        positions = {}
+        lot_points = collections.defaultdict(list)
+        free = set()
+        for parking_space_id, parking_lot_id, vehicle_type, x, y, state in spaces:
+            positions[parking_space_id] = (parking_lot_id, vehicle_type, x, y)
+            lot_points[parking_lot_id].append((x, y))
+            if state == 'free':
+                free.add(parking_space_id)
+        cell_sizes = {parking_lot_id: _cell_size(points) for parking_lot_id, points in lot_points.items()}
+        grids = {}
+        for parking_space_id in free:
+            parking_lot_id, vehicle_type, x, y = positions[parking_space_id]
+            grid = grids.get((parking_lot_id, vehicle_type))
+            if grid is None:
+                grid = grids[(parking_lot_id, vehicle_type)] = _Grid(cell_sizes[parking_lot_id])
+            grid.add(parking_space_id, x, y)
+        with self._lock:
+            self._spaces = positions
+            self._free = free
+            self._grids = grids
+            self._cell_sizes = cell_sizes
+            self._gates = dict(gates)
+            replay, self._replay = self._replay or [], None
+            for parking_space_id, state in replay:
+                self._apply(parking_space_id, state)
+
+    def _apply(self, parking_space_id: int, state: str):
+        position = self._spaces.get(parking_space_id)
+        if position is None:
+            return
+        parking_lot_id, vehicle_type, x, y = position
+        is_free = parking_space_id in self._free
+        if state == 'free' and not is_free:
+            grid = self._grids.get((parking_lot_id, vehicle_type))
+            if grid is None:
+                grid = self._grids[(parking_lot_id, vehicle_type)] = _Grid(self._cell_sizes[parking_lot_id])
+            grid.add(parking_space_id, x, y)
+            self._free.add(parking_space_id)
+        elif state != 'free' and is_free:
+            self._grids[(parking_lot_id, vehicle_type)].remove(parking_space_id, x, y)
+            self._free.discard(parking_space_id)
+
+    def apply(self, parking_space_id: int, state: str):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((parking_space_id, state))
+            self._apply(parking_space_id, state)
+
+    def on_space_state(self, event: SpaceStateEvent):
+        self.apply(event.parking_space_id, event.state)
+
+    def nearest(self, parking_lot_id: int, vehicle_type: str, k: int,
+                x: Optional[float] = None, y: Optional[float] = None) -> list:
+        with self._lock:
+            grid = self._grids.get((parking_lot_id, vehicle_type))
+            if grid is None:
+                return []
+            if x is None or y is None:
+                gate = self._gates.get(parking_lot_id)
+                space_ids = grid.nearest(*gate, k) if gate is not None else grid.any(k)
+            else:
+                space_ids = grid.nearest(x, y, k)
+            return [{
+                'id': space_id,
+                'longitude': self._spaces[space_id][2],
+                'latitude': self._spaces[space_id][3],
+                'parking_lot_id': parking_lot_id,
+                'vehicle_type': vehicle_type,
+                'state': 'free',
+            } for space_id in space_ids]
+
+
+spatial_index = SpatialIndex()
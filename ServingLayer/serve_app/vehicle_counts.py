@@ -0,0 +1,68 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+import redis
+import redis.asyncio as async_redis
+
+KEY_PREFIX = 'parking_lot_vehicle'
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+VEHICLE_TYPES = ['car', 'motorbike', 'truck']
+RETENTION_DAYS = int(os.getenv('VEHICLE_COUNTS_RETENTION_DAYS', 90))
+
+
+def hourly_key(hour: str, parking_lot_id: Optional[int] = None) -> str:
+    if parking_lot_id is None:
+        return f'{KEY_PREFIX}:{hour}'
+    return f'{KEY_PREFIX}:{parking_lot_id}:{hour}'
+
+
+def hours_back(final_time: int, hour_range: int) -> list:
+    return [datetime.fromtimestamp(final_time - 3600 * hour).strftime(HOUR_FORMAT) for hour in range(hour_range)]
+
+
+def hourly_records(hours: list, results: list) -> list:
+    res = []
+    for hour, counts in zip(hours, results):
+        record = {
+            'hour': hour,
+        }
+        for vehicle_type, count in zip(VEHICLE_TYPES, counts):
+            record[vehicle_type] = int(count) if count else 0
+        res.append(record)
+    return res
+
+
+def fetch_hourly_counts(redis_client: redis.Redis, final_time: int, hour_range: int,
+                        parking_lot_id: Optional[int] = None) -> list:
+    hours = hours_back(final_time, hour_range)
+    pipeline = redis_client.pipeline(transaction=False)
+    for hour in hours:
+        pipeline.hmget(hourly_key(hour, parking_lot_id), VEHICLE_TYPES)
+    return hourly_records(hours, pipeline.execute())
+
+
+async def fetch_hourly_counts_async(redis_client: async_redis.Redis, final_time: int, hour_range: int,
+                                    parking_lot_id: Optional[int] = None) -> list:
+    hours = hours_back(final_time, hour_range)
+    pipeline = redis_client.pipeline(transaction=False)
+    for hour in hours:
+        pipeline.hmget(hourly_key(hour, parking_lot_id), VEHICLE_TYPES)
+    return hourly_records(hours, await pipeline.execute())
+
+
+def expire_hourly_counts(redis_client: redis.Redis, retention_days: int = RETENTION_DAYS) -> int:
+    # The sink connector cannot set TTLs, so new hour keys get one here. NX leaves keys that
+    # already have an expiry untouched, which makes the sweep idempotent.
+    updated = 0
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in redis_client.scan_iter(match=f'{KEY_PREFIX}:*', count=1000):
+        try:
+            hour_start = datetime.strptime(key.decode('utf8')[-19:], '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+        pipeline.expireat(key, int(hour_start.timestamp()) + retention_days * 24 * 3600, nx=True)
+        if len(pipeline) >= 1000:
+            updated += sum(pipeline.execute())
+    updated += sum(pipeline.execute())
+    return updated
@@ -1,12 +1,29 @@
-from typing import Annotated
-from fastapi import Depends
+from typing import Annotated, Optional
+from fastapi import Depends, Request
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session, sessionmaker
 from ..configs.db_configs import DATABASE_URI, Base
+from ..utils.metrics import db_read_routes, instrument_engine, pool_collector
+from ..utils.replicas import DATABASE_REPLICA_URIS, ReplicaRouter, client_key, create_replica_engine
+from ..utils.sql_profiler import profile_engine
+from .redis_connection import redis_client
 engine = create_engine(DATABASE_URI)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine, 'primary')
+profile_engine(engine)
+pool_collector.add_engine('primary', engine)
 Base.metadata.create_all(engine)
 
+replica_engines = {}
+for number, uri in enumerate(DATABASE_REPLICA_URIS, 1):
+    replica_engines[f'replica{number}'] = create_replica_engine(uri)
+for name, replica_engine in replica_engines.items():
+    instrument_engine(replica_engine, name)
+    profile_engine(replica_engine)
+    pool_collector.add_engine(name, replica_engine)
+replica_router = ReplicaRouter(replica_engines, redis_client)
+
 
 def get_db():
     db = SessionLocal()
@@ -17,3 +34,34 @@ def get_db():
 
 
 DatabaseDependency = Annotated[Session, Depends(get_db)]
+
+
+def read_session(key: Optional[str] = None) -> Session:
+    # On a healthy replica unless there is none or the client wrote within the read-your-writes window.
+    # The connection is checked out here so a replica that just went down falls back to the primary.
+    name, reason = replica_router.route(key)
+    if name is not None:
+        db = SessionLocal(bind=replica_engines[name])
+        try:
+            db.connection()
+        except OperationalError as e:
+            db.close()
+            replica_router.mark_down(name, e)
+            reason = 'replica_error'
+        else:
+            db_read_routes.labels(name, reason).inc()
+            return db
+    db_read_routes.labels('primary', reason).inc()
+    return SessionLocal()
+
+
+def get_read_db(request: Request):
+    db = read_session(client_key(request.headers))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# For handlers that only read and can take a few seconds of replication lag
+ReadDatabaseDependency = Annotated[Session, Depends(get_read_db)]
@@ -1,16 +1,76 @@
 import os
+import time
 from typing import Annotated
 
 import redis
 from fastapi import Depends
 
+from ..utils.metrics import pool_collector, redis_latency
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, name: str = 'default', **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.checkouts = 0
+        self.checkout_errors = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        self.checkouts += 1
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.checkout_errors += 1
+            raise
+        # Pipelines check out under MULTI whether or not they run as a transaction
+        connection.metered_command = ('PIPELINE' if command_name == 'MULTI' else command_name, start)
+        return connection
+
+    def release(self, connection):
+        command_name, start = connection.metered_command
+        redis_latency.labels(self.name, command_name).observe(time.perf_counter() - start)
+        super().release(connection)
+
+    def stats(self) -> dict:
+        # Free slots are either idle connections or not yet created ones
+        in_use = self.max_connections - self.pool.qsize()
+        return {
+            'max_connections': self.max_connections,
+            'created': len(self._connections),
+            'in_use': in_use,
+            'saturation': round(in_use / self.max_connections, 3),
+            'checkouts': self.checkouts,
+            'checkout_errors': self.checkout_errors,
+        }
+
+
+redis_pool = MeteredConnectionPool(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+    timeout=float(os.getenv('REDIS_POOL_TIMEOUT', 2)),
+    health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    socket_keepalive=True,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+pool_collector.add_redis_pool('default', redis_pool)
+
 
 def get_redis():
-    r = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'))
-    try:
-        yield r
-    finally:
-        r.close()
+    return redis_client
 
 
 RedisDependency = Annotated[redis.Redis, Depends(get_redis)]
+
+
+DEVICE_INVALIDATION_CHANNEL = 'device_invalidations'
+
+
+def publish_device_invalidation(redis_client: redis.Redis, api_key: str):
+    # The serving layer caches devices by API key and drops the entry on this message,
+    # its cache TTL still bounds staleness if the publish is lost
+    try:
+        redis_client.publish(DEVICE_INVALIDATION_CHANNEL, api_key)
+    except redis.RedisError as e:
+        print(f"Failed to publish device invalidation: {e}")
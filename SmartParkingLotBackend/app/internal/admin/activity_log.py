@@ -1,22 +1,56 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import APIRouter, Query, status, HTTPException
-from fastapi_pagination import Page
+from fastapi import APIRouter, Depends, Query, status, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
-from app.models.models import ActivityLog, Vehicle
+from app.models.models import ActivityLog, ParkingLot, Vehicle
 from app.models.schemas import ActivityLogAdminOut
+from app.utils import export
+from app.utils.keyset import CursorPage, CursorParamsDependency, keyset_order, paginate_keyset
+from app.utils.search import equals_filter
 
 router = APIRouter(prefix='/activity_logs')
 
+EXPORT_COLUMNS = [
+    ActivityLog.id,
+    ActivityLog.timestamp,
+    ActivityLog.activity_type,
+    ActivityLog.vehicle_id,
+    Vehicle.license_plate,
+    Vehicle.vehicle_type,
+    Vehicle.owner_id,
+    ActivityLog.parking_lot_id,
+    ParkingLot.name.label('parking_lot_name'),
+]
 
-@router.get('/', response_model=Page[ActivityLogAdminOut], status_code=status.HTTP_200_OK)
+
+def activity_log_filters(fromtime: int, totime: int, user_id: Optional[int], parking_lot_id: Optional[int],
+                         license_plate: Optional[str]) -> list:
+    # Conditions on Vehicle need activity_logs joined with vehicles
+    conditions = [datetime.fromtimestamp(fromtime) <= ActivityLog.timestamp,
+                  ActivityLog.timestamp <= datetime.fromtimestamp(totime)]
+    if user_id is not None:
+        conditions.append(Vehicle.owner_id == user_id)
+    if parking_lot_id is not None:
+        conditions.append(ActivityLog.parking_lot_id == parking_lot_id)
+    if license_plate is not None:
+        conditions.append(equals_filter(Vehicle.license_plate, license_plate))
+    return conditions
+
+
+@router.get('/', response_model=Union[Page[ActivityLogAdminOut], CursorPage[ActivityLogAdminOut]],
+            dependencies=[Depends(pagination_ctx(Page[ActivityLogAdminOut]))], status_code=status.HTTP_200_OK)
 def get_activity_logs(
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
+        cursor_params: CursorParamsDependency,
         fromtime: int = Query(default=0, ge=0),
         totime: int = Query(default_factory=lambda: int(datetime.utcnow().timestamp()), ge=0),
         sort: str = Query(default='desc', regex='^(desc|asc)$'),
@@ -24,20 +58,64 @@ def get_activity_logs(
         parking_lot_id: Optional[int] = Query(default=None),
         license_plate: Optional[str] = Query(default=None)):
     if not current_active_user.is_superuser:
-        return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
-    from_timestamp = datetime.fromtimestamp(fromtime)
-    to_timestamp = datetime.fromtimestamp(totime)
-    order_by = ActivityLog.timestamp.desc() if sort == 'desc' else ActivityLog.timestamp.asc()
-    query = db.query(ActivityLog) \
-              .filter(from_timestamp <= ActivityLog.timestamp,
-                      ActivityLog.timestamp <= to_timestamp)
-    if user_id is not None:
-        query = query.join(ActivityLog.vehicle).filter(Vehicle.owner_id == user_id)
-    if parking_lot_id is not None:
-        query = query.filter(ActivityLog.parking_lot_id == parking_lot_id)
-    if license_plate is not None:
-        query = query.join(ActivityLog.vehicle).filter(Vehicle.license_plate.ilike(license_plate.lower()))
-    results = paginate(query.order_by(order_by))
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
+    query = db.query(ActivityLog).options(selectinload(ActivityLog.parking_lot),
+                                          selectinload(ActivityLog.vehicle).selectinload(Vehicle.owner))
+    if user_id is not None or license_plate is not None:
+        query = query.join(ActivityLog.vehicle)
+    query = query.filter(*activity_log_filters(fromtime, totime, user_id, parking_lot_id, license_plate))
+    keys = [ActivityLog.timestamp, ActivityLog.id]
+    if cursor_params.enabled:
+        results = paginate_keyset(db, query, ActivityLogAdminOut, keys, sort == 'desc', cursor_params)
+    else:
+        results = paginate(query.order_by(*keyset_order(keys, sort == 'desc')))
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
     return results
+
+
+def export_schema():
+    pa = export.pa
+    return pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.timestamp('us')),
+        ('activity_type', pa.string()),
+        ('vehicle_id', pa.int64()),
+        ('license_plate', pa.string()),
+        ('vehicle_type', pa.string()),
+        ('owner_id', pa.int64()),
+        ('parking_lot_id', pa.int64()),
+        ('parking_lot_name', pa.string()),
+    ])
+
+
+@router.get('/export', status_code=status.HTTP_200_OK)
+def export_activity_logs(
+        current_active_user: CurrentActiveUserDependency,
+        fromtime: int = Query(default=0, ge=0),
+        totime: int = Query(default_factory=lambda: int(datetime.utcnow().timestamp()), ge=0),
+        user_id: Optional[int] = Query(default=None),
+        parking_lot_id: Optional[int] = Query(default=None),
+        license_plate: Optional[str] = Query(default=None),
+        format: str = Query(default='ndjson', regex='^(ndjson|csv|parquet)$')):
+    # The whole filtered range, oldest first, streamed in batches rather than paged
+    if not current_active_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
+    if format == 'parquet' and export.pq is None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail='Parquet export needs pyarrow')
+    columns = [export.json_column(EXPORT_COLUMNS)] if format == 'ndjson' else export.text_columns(EXPORT_COLUMNS)
+    statement = select(*columns) \
+        .join(Vehicle, Vehicle.id == ActivityLog.vehicle_id) \
+        .join(ParkingLot, ParkingLot.id == ActivityLog.parking_lot_id) \
+        .where(*activity_log_filters(fromtime, totime, user_id, parking_lot_id, license_plate)) \
+        .order_by(ActivityLog.timestamp, ActivityLog.id)
+    batches = export.stream_batches(statement)
+    if format == 'parquet':
+        chunks = export.parquet_chunks(export_schema(), batches)
+    elif format == 'csv':
+        chunks = export.csv_chunks([column.key for column in EXPORT_COLUMNS], batches)
+    else:
+        chunks = export.ndjson_chunks(batches)
+    media_type, extension = export.EXPORT_FORMATS[format]
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="activity_logs.{extension}"'})
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.internal.admin import activity_log, parking_lot, rating_feedback, vehicle
+from app.internal.admin import activity_log, debug, parking_lot, rating_feedback, vehicle
 
 router = APIRouter(
     prefix='/admin',
@@ -10,3 +10,4 @@ router.include_router(activity_log.router)
 router.include_router(rating_feedback.router)
 router.include_router(vehicle.router)
 router.include_router(parking_lot.router)
+router.include_router(debug.router)
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, status, HTTPException
+
+from app.dependencies.oauth2 import CurrentActiveUserDependency
+from app.utils.sql_profiler import sql_profile
+
+router = APIRouter(prefix='/debug')
+
+
+@router.get('/sql', status_code=status.HTTP_200_OK)
+def get_sql_profile(current_active_user: CurrentActiveUserDependency):
+    # Statement counts, N+1 and slow statements of the requests sampled by SQL_PROFILE_SAMPLE_RATE
+    if not current_active_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
+    return sql_profile.stats()
@@ -1,21 +1,28 @@
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import APIRouter, status, Query, HTTPException
-from fastapi_pagination import Page
+from fastapi import APIRouter, Depends, File, status, Query, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
+from app.dependencies.redis_connection import RedisDependency
 from app.models.schemas import ParkingLotAdminOut
 from app.models.models import ParkingLot
+from app.utils.keyset import CursorPage, CursorParamsDependency, paginate_keyset
+from app.utils.provisioning import parse_layout, provision_parking_lot, provisioned_chunks, read_layout
+from app.utils.response_cache import invalidate_tags
 
 router = APIRouter(prefix='/parking_lots')
 
 
-@router.get('/', response_model=Page[ParkingLotAdminOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[ParkingLotAdminOut], CursorPage[ParkingLotAdminOut]],
+            dependencies=[Depends(pagination_ctx(Page[ParkingLotAdminOut]))], status_code=status.HTTP_200_OK)
 def get_all_parking_lots(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         current_active_user: CurrentActiveUserDependency,
+        cursor_params: CursorParamsDependency,
         show_deleted: Optional[bool] = Query(default=False),
 ):
     if not current_active_user.is_superuser:
@@ -23,7 +30,33 @@ def get_all_parking_lots(
     query = db.query(ParkingLot)
     if not show_deleted:
         query = query.filter(ParkingLot.is_active == True)
-    results = paginate(query)
+    if cursor_params.enabled:
+        results = paginate_keyset(db, query, ParkingLotAdminOut, [ParkingLot.id], False, cursor_params)
+    else:
+        results = paginate(query)
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
     return results
+
+
+@router.post('/{parking_lot_id}/layout', status_code=status.HTTP_201_CREATED)
+def provision_layout(
+        parking_lot_id: int,
+        db: DatabaseDependency,
+        current_active_user: CurrentActiveUserDependency,
+        redis_client: RedisDependency,
+        layout: UploadFile = File(description='CSV or .json file of longitude, latitude, vehicle_type, sensor'),
+        cameras: int = Query(default=0, ge=0, le=1000)):
+    # Onboards a lot in one transaction: every space of the layout, their sensors and the lot's cameras.
+    # Streams back the new ids and api keys as NDJSON.
+    if not current_active_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
+    spaces = parse_layout(read_layout(layout.file), layout.filename or '')
+    parking_lot = db.query(ParkingLot).filter(ParkingLot.id == parking_lot_id, ParkingLot.is_active == True).first()
+    if not parking_lot:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Parking lot not found')
+    provisioned = provision_parking_lot(db, parking_lot_id, spaces, cameras)
+    db.commit()
+    invalidate_tags(redis_client, f'parking_lot:{parking_lot_id}')
+    return StreamingResponse(provisioned_chunks(provisioned), status_code=status.HTTP_201_CREATED,
+                             media_type='application/x-ndjson')
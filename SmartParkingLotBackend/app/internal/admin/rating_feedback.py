@@ -1,22 +1,26 @@
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import APIRouter, status, Query, HTTPException
-from fastapi_pagination import Page
+from fastapi import APIRouter, Depends, status, Query, HTTPException
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
 from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
 from app.models.models import RatingFeedback
 from app.models.schemas import RatingFeedbackAdminOut
+from app.utils.keyset import CursorPage, CursorParamsDependency, keyset_order, paginate_keyset
 
 router = APIRouter(prefix='/ratings_feedbacks')
 
 
-@router.get('/', response_model=Page[RatingFeedbackAdminOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[RatingFeedbackAdminOut], CursorPage[RatingFeedbackAdminOut]],
+            dependencies=[Depends(pagination_ctx(Page[RatingFeedbackAdminOut]))], status_code=status.HTTP_200_OK)
 def get_rating_feedbacks(
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
+        cursor_params: CursorParamsDependency,
         show_deleted: Optional[bool] = Query(default=False),
         sort: str = Query(default='desc', regex='^(desc|asc)$'),
         order: str = Query(default='creation', regex='^(creation|rating)$'),
@@ -24,15 +28,19 @@ def get_rating_feedbacks(
 ):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
-    query = db.query(RatingFeedback)
+    query = db.query(RatingFeedback).options(selectinload(RatingFeedback.user),
+                                             selectinload(RatingFeedback.parking_lot))
     if not show_deleted:
         query = query.filter(RatingFeedback.is_active == True)
     if user_id is not None:
         query = query.filter(RatingFeedback.user_id == user_id)
     sort_condition = func.coalesce(RatingFeedback.updated_at, RatingFeedback.created_at) if order == 'creation' \
         else RatingFeedback.rating
-    order_by = sort_condition.desc() if sort == 'desc' else sort_condition.asc()
-    results = paginate(query.order_by(order_by))
+    keys = [sort_condition, RatingFeedback.id]
+    if cursor_params.enabled:
+        results = paginate_keyset(db, query, RatingFeedbackAdminOut, keys, sort == 'desc', cursor_params)
+    else:
+        results = paginate(query.order_by(*keyset_order(keys, sort == 'desc')))
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
     return results
@@ -1,33 +1,40 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import APIRouter, status, Query, HTTPException
-from fastapi_pagination import Page
+from fastapi import APIRouter, Depends, status, Query, HTTPException
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
+from sqlalchemy.orm import selectinload
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
 from app.models.models import Vehicle
 from app.models.schemas import VehicleAdminOut
+from app.utils.keyset import CursorPage, CursorParamsDependency, paginate_keyset
 
 router = APIRouter(prefix='/vehicles')
 
 
-@router.get('/', response_model=Page[VehicleAdminOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[VehicleAdminOut], CursorPage[VehicleAdminOut]],
+            dependencies=[Depends(pagination_ctx(Page[VehicleAdminOut]))], status_code=status.HTTP_200_OK)
 def get_vehicles(
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
+        cursor_params: CursorParamsDependency,
         user_id: Optional[int] = Query(default=None),
         license_plate: Optional[str] = Query(default=None)
 ):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
-    query = db.query(Vehicle)
+    query = db.query(Vehicle).options(selectinload(Vehicle.owner))
     if user_id is not None:
         query = query.filter(Vehicle.owner_id == user_id)
     if license_plate is not None:
         query = query.filter(Vehicle.license_plate == license_plate)
-    results = paginate(query)
+    if cursor_params.enabled:
+        results = paginate_keyset(db, query, VehicleAdminOut, [Vehicle.id], False, cursor_params)
+    else:
+        results = paginate(query)
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
     return results
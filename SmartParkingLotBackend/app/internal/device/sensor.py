@@ -6,8 +6,9 @@ from fastapi import APIRouter, Query, HTTPException, status
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
+from app.dependencies.redis_connection import RedisDependency, publish_device_invalidation
 from app.models.models import Sensor, ParkingSpace
 from app.models.schemas import SensorOut, SensorCreateOut, SensorCreate
 
@@ -19,7 +20,7 @@ router = APIRouter(
 
 @router.get('/', response_model=Page[SensorOut], status_code=status.HTTP_200_OK)
 def get_all_sensors(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         current_active_user: CurrentActiveUserDependency,
         show_deleted: bool = Query(default=False),
         parking_lot_id: Optional[int] = Query(default=None),
@@ -70,6 +71,7 @@ def create_sensor(
 def delete_sensor(
         sensor_id: UUID,
         db: DatabaseDependency,
+        redis_client: RedisDependency,
         current_active_user: CurrentActiveUserDependency
 ):
     if not current_active_user.is_superuser:
@@ -80,4 +82,5 @@ def delete_sensor(
     sensor.is_active = False
     sensor.deleted_at = datetime.utcnow()
     db.commit()
+    publish_device_invalidation(redis_client, sensor.api_key)
     return
@@ -1,14 +1,36 @@
 from .configs.load_env import *
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .configs.allowed_origins import allowed_origins
-from .routes import user, auth, parking_lot, vehicle, activity_log, rating_feedback, parking_space
+from .routes import user, auth, parking_lot, vehicle, activity_log, rating_feedback, parking_space, search
 from fastapi_pagination import add_pagination
 from app.internal.admin import admin
 from app.internal.device import devices
+from .dependencies.db_connection import replica_router
+from .dependencies.redis_connection import redis_pool
+from .utils.jwt import token_cache, user_cache
+from .utils.metrics import MetricsMiddleware, metrics_response
+from .utils.password import password_pool
+from .utils.replicas import ReadYourWritesMiddleware
+from .utils.response_cache import ResponseCacheMiddleware, response_cache
+from .utils.sql_profiler import SQLProfilerMiddleware
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    replica_router.start()
+    password_pool.start()
+    yield
+    replica_router.stop()
+    password_pool.shutdown()
+    redis_pool.disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Inside CORS, so cached responses do not carry the CORS headers of the request that computed them
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -16,6 +38,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ReadYourWritesMiddleware, router=replica_router)
+app.add_middleware(SQLProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(user.router)
@@ -24,12 +49,30 @@ app.include_router(vehicle.router)
 app.include_router(activity_log.router)
 app.include_router(rating_feedback.router)
 app.include_router(parking_space.router)
+app.include_router(search.router)
 app.include_router(admin.router)
 app.include_router(devices.router)
 
 add_pagination(app)
 
 
+@app.get("/stats")
+def get_stats():
+    return {
+        'redis_pool': redis_pool.stats(),
+        'user_cache': user_cache.stats(),
+        'token_cache': token_cache.stats(),
+        'password_pool': password_pool.stats(),
+        'replicas': replica_router.stats(),
+        'response_cache': response_cache.stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return metrics_response()
+
+
 @app.get("/")
 def root():
     return {"message": "Hello World"}
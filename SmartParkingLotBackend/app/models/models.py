@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
+from sqlalchemy import Column, DDL, Integer, String, Boolean, Float, ForeignKey, Index, event, func
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP, UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
 from app.configs.db_configs import Base
 
 
@@ -126,3 +126,60 @@ class ActivityLog(Base):
 
     vehicle = relationship("Vehicle")
     parking_lot = relationship("ParkingLot")
+
+    # Keyset pagination seeks on (timestamp, id), across all logs or within a vehicle's
+    __table_args__ = (
+        Index('ix_activity_logs_timestamp_id', 'timestamp', 'id'),
+        Index('ix_activity_logs_vehicle_id_timestamp_id', 'vehicle_id', 'timestamp', 'id'),
+    )
+
+
+class RatingAggregate(Base):
+    __tablename__ = "rating_aggregates"
+
+    parking_lot_id = Column(Integer, ForeignKey("parking_lots.id", ondelete="CASCADE"), primary_key=True)
+    one_star = Column(Integer, nullable=False, server_default=text("0"))
+    two_star = Column(Integer, nullable=False, server_default=text("0"))
+    three_star = Column(Integer, nullable=False, server_default=text("0"))
+    four_star = Column(Integer, nullable=False, server_default=text("0"))
+    five_star = Column(Integer, nullable=False, server_default=text("0"))
+    rating_count = Column(Integer, nullable=False, server_default=text("0"))
+    rating_sum = Column(Integer, nullable=False, server_default=text("0"))
+    updated_at = Column(TIMESTAMP, server_default=text("now()"))
+
+
+def search_indexes(column: Column) -> tuple:
+    # For app/utils/search.py, Postgres only. lower(column) COLLATE "C" serves prefix and exact matches in index
+    # order, the pg_trgm GIN index substring and typo-tolerant ones.
+    name = f'ix_{column.table.name}_{column.name}'
+    lowered = func.lower(column)
+    return (
+        Index(f'{name}_lower', lowered.collate('C')).ddl_if(dialect='postgresql'),
+        Index(f'{name}_trgm', lowered.label('lowered'), postgresql_using='gin',
+              postgresql_ops={'lowered': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+
+event.listen(Base.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+def backfill_rating_aggregates(target, connection, tables=(), **kw):
+    # rating_aggregates created next to existing feedback, e.g. restored from init.sql, is filled in the same
+    # transaction instead of every lot reading as unrated until the rebuild CLI runs
+    if RatingAggregate.__table__ in tables:
+        from app.utils.rating_aggregate import rebuild_rating_aggregates
+        with Session(bind=connection) as db:
+            rebuilt = rebuild_rating_aggregates(db)
+        print(f"Backfilled rating aggregates for {rebuilt} parking lots")
+
+
+event.listen(Base.metadata, 'after_create', backfill_rating_aggregates)
+
+# create_all only builds these with their tables, app/utils/indexes.py adds them to databases restored from init.sql
+MANAGED_INDEXES = [
+    *ActivityLog.__table_args__,
+    *search_indexes(User.__table__.c.username),
+    *search_indexes(ParkingLot.__table__.c.name),
+    *search_indexes(Vehicle.__table__.c.license_plate),
+]
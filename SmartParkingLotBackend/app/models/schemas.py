@@ -1,7 +1,7 @@
 from enum import Enum
 from uuid import uuid4, UUID
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from datetime import datetime
 from typing import Optional
 
@@ -166,13 +166,21 @@ class BaseRatingFeedback(BaseModel):
 
 
 class RatingFeedbackCreate(BaseRatingFeedback):
-    pass
+    rating: int = Field(ge=1, le=5)
 
 
 class RatingFeedbackUpdate(BaseModel):
-    rating: Optional[int]
+    rating: Optional[int] = Field(None, ge=1, le=5)
     feedback: Optional[str]
 
+    @field_validator('rating')
+    @classmethod
+    def rating_not_null(cls, rating: Optional[int]) -> int:
+        # Left out keeps the rating, an explicit null would clear the NOT NULL column
+        if rating is None:
+            raise ValueError('rating cannot be null')
+        return rating
+
 
 class RatingFeedbackCreateOut(BaseRatingFeedback):
     model_config = ConfigDict(from_attributes=True)
@@ -199,8 +207,8 @@ class RatingFeedbackAdminOut(RatingFeedbackOut):
 
 
 class ParkingSpaceBase(BaseModel):
-    longitude: int
-    latitude: int
+    longitude: float
+    latitude: float
     parking_lot_id: int
     vehicle_type: VehicleType
 
@@ -231,6 +239,14 @@ class ParkingSpaceAdminOut(ParkingSpaceOut):
     parking_lot: ParkingLotAdminOut
 
 
+class ParkingSpaceLayout(BaseModel):
+    # A row of a lot layout file, sensor=false provisions the space without one
+    longitude: float
+    latitude: float
+    vehicle_type: VehicleType
+    sensor: bool = True
+
+
 # Camera
 class CameraBase(BaseModel):
     id: UUID = Field(default_factory=uuid4)
@@ -271,3 +287,11 @@ class SensorOut(SensorBase):
     created_at: datetime
     is_active: bool
     deleted_at: Optional[datetime] = None
+
+
+# Search
+class SearchHit(BaseModel):
+    id: int
+    text: str
+    match: str
+    score: float
@@ -1,13 +1,16 @@
 from datetime import datetime
+from typing import Union
 
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from fastapi_pagination.ext.sqlalchemy import paginate
-from fastapi_pagination import Page
+from fastapi_pagination import Page, pagination_ctx
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 
 from ..models.schemas import ActivityLogOut
 from ..models.models import ActivityLog, Vehicle
-from ..dependencies.db_connection import DatabaseDependency
+from ..dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..utils.keyset import CursorPage, CursorParamsDependency, keyset_order, paginate_keyset
 
 router = APIRouter(
     prefix='/activity_logs',
@@ -15,31 +18,40 @@ router = APIRouter(
 )
 
 
-@router.get('/', response_model=Page[ActivityLogOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[ActivityLogOut], CursorPage[ActivityLogOut]],
+            dependencies=[Depends(pagination_ctx(Page[ActivityLogOut]))], status_code=status.HTTP_200_OK)
 def get_parking_lot_activity_logs(
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
+        cursor_params: CursorParamsDependency,
         fromtime: int = Query(default=0, ge=0),
         totime: int = Query(default_factory=lambda: int(datetime.utcnow().timestamp()), ge=0),
         sort: str = Query(default='desc', regex='^(desc|asc)$')
 ):
     from_timestamp = datetime.fromtimestamp(fromtime)
     to_timestamp = datetime.fromtimestamp(totime)
-    order_by = ActivityLog.timestamp.desc() if sort == 'desc' else ActivityLog.timestamp.asc()
-    return paginate(db.query(ActivityLog)
-                    .join(ActivityLog.vehicle)
-                    .filter(Vehicle.owner_id == current_active_user.id,
-                            from_timestamp <= ActivityLog.timestamp,
-                            ActivityLog.timestamp <= to_timestamp)
-                    .order_by(order_by))
+    # The page's vehicles come with the join, its lots in one more statement rather than one per row
+    query = db.query(ActivityLog) \
+              .join(ActivityLog.vehicle) \
+              .options(contains_eager(ActivityLog.vehicle), selectinload(ActivityLog.parking_lot)) \
+              .filter(Vehicle.owner_id == current_active_user.id,
+                      from_timestamp <= ActivityLog.timestamp,
+                      ActivityLog.timestamp <= to_timestamp)
+    keys = [ActivityLog.timestamp, ActivityLog.id]
+    if cursor_params.enabled:
+        return paginate_keyset(db, query, ActivityLogOut, keys, sort == 'desc', cursor_params)
+    return paginate(query.order_by(*keyset_order(keys, sort == 'desc')))
 
 
 @router.get('/{activity_log_id}', response_model=ActivityLogOut, status_code=status.HTTP_200_OK)
 def get_activity_log_by_id(activity_log_id: int, current_active_user: CurrentActiveUserDependency,
                            db: DatabaseDependency):
-    activity_log = db.query(ActivityLog).filter(ActivityLog.id == activity_log_id).first()
+    # Ownership is checked on the log's own vehicle, not by loading every vehicle of the user
+    activity_log = db.query(ActivityLog) \
+                     .options(joinedload(ActivityLog.vehicle), joinedload(ActivityLog.parking_lot)) \
+                     .filter(ActivityLog.id == activity_log_id).first()
     if not activity_log:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Activity log not found')
-    if activity_log.vehicle_id not in [v.id for v in current_active_user.vehicles]:
+    if activity_log.vehicle.owner_id != current_active_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
     return activity_log
@@ -9,8 +9,8 @@ from ..models.models import User
 from ..dependencies.db_connection import DatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
 from ..dependencies.redis_connection import RedisDependency
-from ..utils.password import verify_password, hash_password
-from ..utils.jwt import create_jwt_token, verify_jwt_token
+from ..utils.password import hash_password, verify_and_update_password
+from ..utils.jwt import bump_user_version, create_jwt_token, verify_jwt_token
 
 router = APIRouter(
     tags=['Auth']
@@ -22,8 +22,18 @@ def login(response: Response, db: DatabaseDependency,
           redis_client: RedisDependency,
           user_credentials: OAuth2PasswordRequestForm = Depends()):
     user = db.query(User).filter(User.username == user_credentials.username).first()
-    if not user or not verify_password(user_credentials.password, user.password):
+    if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not authorized')
+    # Ends the read so the session does not hold a pooled connection while the hash is checked
+    db.expunge(user)
+    db.commit()
+    valid, new_hash = verify_and_update_password(user_credentials.password, user.password)
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not authorized')
+    if new_hash:
+        db.query(User).filter(User.id == user.id).update({User.password: new_hash})
+        db.commit()
+        bump_user_version(redis_client, user.id)
 
     access_token = create_jwt_token(
         data={
@@ -83,10 +93,12 @@ def refresh_access_token(redis_client: RedisDependency,
 
 
 @router.post('/change-password', status_code=status.HTTP_200_OK)
-def change_password(db: DatabaseDependency, current_active_user: CurrentActiveUserDependency, new_password: str):
+def change_password(db: DatabaseDependency, redis_client: RedisDependency,
+                    current_active_user: CurrentActiveUserDependency, new_password: str):
     hashed_password = hash_password(new_password)
     current_active_user.password = hashed_password
     db.commit()
+    bump_user_version(redis_client, current_active_user.id)
     return {
         'message': 'Password changed successfully'
     }
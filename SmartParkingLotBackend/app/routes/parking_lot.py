@@ -8,8 +8,11 @@ from fastapi_pagination.ext.sqlalchemy import paginate
 
 from ..models.schemas import ParkingLotCreate, ParkingLotUpdate, ParkingLotCreateOut, ParkingLotOut
 from ..models.models import ParkingLot
-from ..dependencies.db_connection import DatabaseDependency
+from ..dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..dependencies.redis_connection import RedisDependency
+from ..utils.response_cache import cached, invalidate_tags
+from ..utils.search import prefix_filter
 
 router = APIRouter(
     prefix='/parking-lots',
@@ -19,7 +22,7 @@ router = APIRouter(
 
 @router.get('/', response_model=Page[ParkingLotOut], status_code=status.HTTP_200_OK)
 def get_all_parking_lots(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         current_active_user: CurrentActiveUserDependency,
         show_deleted: bool = Query(default=False),
         name: Optional[str] = Query(default=None),
@@ -28,7 +31,7 @@ def get_all_parking_lots(
     if not current_active_user.is_superuser or not show_deleted:
         query = query.filter(ParkingLot.is_active == True)
     if name is not None:
-        query = query.filter(ParkingLot.name.ilike(f'{name.lower()}%'))
+        query = query.filter(prefix_filter(ParkingLot.name, name))
     results = paginate(query)
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
@@ -54,6 +57,7 @@ def create_parking_lot(
 
 
 @router.get('/{parking_lot_id}', response_model=ParkingLotOut, status_code=status.HTTP_200_OK)
+@cached(scope='role', ttl=300, tags=('parking_lot:{parking_lot_id}',))
 def get_parking_lot_by_id(
         parking_lot_id: int,
         db: DatabaseDependency,
@@ -72,7 +76,8 @@ def update_parking_lot(
         parking_lot_id: int,
         parking_lot_update: ParkingLotUpdate,
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency
+        db: DatabaseDependency,
+        redis_client: RedisDependency
 ):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
@@ -85,6 +90,7 @@ def update_parking_lot(
             setattr(parking_lot, key, value)
         parking_lot.updated_at = datetime.utcnow()
         db.commit()
+        invalidate_tags(redis_client, f'parking_lot:{parking_lot_id}')
         db.refresh(parking_lot)
         return parking_lot
     except IntegrityError:
@@ -92,7 +98,8 @@ def update_parking_lot(
 
 
 @router.delete('/{parking_lot_id}', status_code=status.HTTP_204_NO_CONTENT)
-def delete_parking_lot(parking_lot_id: int, current_active_user: CurrentActiveUserDependency, db: DatabaseDependency):
+def delete_parking_lot(parking_lot_id: int, current_active_user: CurrentActiveUserDependency, db: DatabaseDependency,
+                       redis_client: RedisDependency):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
     parking_lot = db.query(ParkingLot).filter(ParkingLot.id == parking_lot_id, ParkingLot.is_active == True).first()
@@ -101,4 +108,5 @@ def delete_parking_lot(parking_lot_id: int, current_active_user: CurrentActiveUs
     parking_lot.is_active = False
     parking_lot.deleted_at = datetime.utcnow()
     db.commit()
+    invalidate_tags(redis_client, f'parking_lot:{parking_lot_id}')
     return
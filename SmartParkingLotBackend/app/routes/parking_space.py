@@ -5,11 +5,14 @@ from fastapi import APIRouter, status, Query, HTTPException
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
-from app.dependencies.db_connection import DatabaseDependency
+from app.dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from app.dependencies.oauth2 import CurrentActiveUserDependency
+from app.dependencies.redis_connection import RedisDependency
 from app.models.models import ParkingSpace
 from app.models.schemas import ParkingSpaceCreate, ParkingSpaceCreateOut, ParkingSpaceOut
+from app.utils.response_cache import cached, invalidate_tags
 
 router = APIRouter(
     prefix='/parking_spaces',
@@ -19,14 +22,14 @@ router = APIRouter(
 
 @router.get('/', response_model=Page[ParkingSpaceOut], status_code=status.HTTP_200_OK)
 def get_parking_spaces(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         current_active_user: CurrentActiveUserDependency,
         show_deleted: bool = Query(default=False),
         parking_lot_id: Optional[int] = Query(default=None),
         vehicle_type: Optional[str] = Query(default=None, regex='^(car|motorbike|truck)$'),
         show_free_only: bool = Query(default=False)
 ):
-    query = db.query(ParkingSpace)
+    query = db.query(ParkingSpace).options(selectinload(ParkingSpace.vehicle))
     if not current_active_user.is_superuser or not show_deleted:
         query = query.filter(ParkingSpace.is_active == True)
     if parking_lot_id is not None:
@@ -42,6 +45,8 @@ def get_parking_spaces(
 
 
 @router.get('/{parking_space_id}', response_model=ParkingSpaceOut, status_code=status.HTTP_200_OK)
+# The state is also written by the sensor pipeline and the serving layer, which do not invalidate, hence the short ttl
+@cached(scope='role', ttl=5, tags=('parking_space:{parking_space_id}',))
 def get_parking_space_by_id(
         parking_space_id: int,
         current_active_user: CurrentActiveUserDependency,
@@ -74,7 +79,7 @@ def create_parking_space(
 
 
 @router.delete('/{parking_space_id}', status_code=status.HTTP_204_NO_CONTENT)
-def delete_parking_space(parking_space_id: int, db: DatabaseDependency,
+def delete_parking_space(parking_space_id: int, db: DatabaseDependency, redis_client: RedisDependency,
                          current_active_user: CurrentActiveUserDependency):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User does not have admin privileges')
@@ -85,4 +90,5 @@ def delete_parking_space(parking_space_id: int, db: DatabaseDependency,
     parking_space.is_active = False
     parking_space.deleted_at = datetime.utcnow()
     db.commit()
+    invalidate_tags(redis_client, f'parking_space:{parking_space_id}')
     return
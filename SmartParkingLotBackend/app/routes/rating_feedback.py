@@ -1,13 +1,20 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from typing import Union
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from datetime import datetime
-from fastapi_pagination import Page
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
 from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 
 from ..models.schemas import RatingFeedbackCreate, RatingFeedbackUpdate, RatingFeedbackCreateOut, RatingFeedbackOut
 from ..models.models import RatingFeedback, ParkingLot
 from ..dependencies.db_connection import DatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..dependencies.redis_connection import RedisDependency
+from ..utils.keyset import CursorPage, CursorParamsDependency, keyset_order, paginate_keyset
+from ..utils.rating_aggregate import apply_rating_change
+from ..utils.response_cache import cached, invalidate_tags
 
 router = APIRouter(
     prefix='/parking-lots/{parking_lot_id}/rating-feedbacks',
@@ -15,10 +22,14 @@ router = APIRouter(
 )
 
 
-@router.get('/', response_model=Page[RatingFeedbackOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[RatingFeedbackOut], CursorPage[RatingFeedbackOut]],
+            dependencies=[Depends(pagination_ctx(Page[RatingFeedbackOut]))], status_code=status.HTTP_200_OK)
+@cached(scope='public', ttl=300, tags=('parking_lot:{parking_lot_id}', 'rating_feedbacks:{parking_lot_id}'))
 def get_parking_lot_ratings_feedbacks(
         parking_lot_id: int,
+        # Not a replica: a page computed from a lagging one would be cached under the version bumped by the write
         db: DatabaseDependency,
+        cursor_params: CursorParamsDependency,
         sort: str = Query(default='desc', regex='^(desc|asc)$'),
         order: str = Query(default='creation', regex='^(creation|rating)$')
 ):
@@ -27,17 +38,21 @@ def get_parking_lot_ratings_feedbacks(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parking lot no found")
     sort_condition = func.coalesce(RatingFeedback.updated_at, RatingFeedback.created_at) if order == 'creation' \
         else RatingFeedback.rating
-    order_by = sort_condition.desc() if sort == 'desc' else sort_condition.asc()
-    return paginate(db.query(RatingFeedback)
-                    .filter(RatingFeedback.parking_lot_id == parking_lot_id)
-                    .order_by(order_by))
+    query = db.query(RatingFeedback) \
+              .options(selectinload(RatingFeedback.user), selectinload(RatingFeedback.parking_lot)) \
+              .filter(RatingFeedback.parking_lot_id == parking_lot_id)
+    keys = [sort_condition, RatingFeedback.id]
+    if cursor_params.enabled:
+        return paginate_keyset(db, query, RatingFeedbackOut, keys, sort == 'desc', cursor_params)
+    return paginate(query.order_by(*keyset_order(keys, sort == 'desc')))
 
 
 @router.post('/', response_model=RatingFeedbackCreateOut, status_code=status.HTTP_201_CREATED)
 def create_ratings_feedbacks(parking_lot_id: int,
                              rating_feedback: RatingFeedbackCreate,
                              current_active_user: CurrentActiveUserDependency,
-                             db: DatabaseDependency):
+                             db: DatabaseDependency,
+                             redis_client: RedisDependency):
     parking_lot = db.query(ParkingLot).filter(ParkingLot.id == parking_lot_id,
                                               ParkingLot.is_active == True).first()
     if not parking_lot:
@@ -47,7 +62,9 @@ def create_ratings_feedbacks(parking_lot_id: int,
     new_rating_feedback.parking_lot_id = parking_lot_id
     new_rating_feedback.user = current_active_user
     db.add(new_rating_feedback)
+    apply_rating_change(db, parking_lot_id, None, new_rating_feedback.rating)
     db.commit()
+    invalidate_tags(redis_client, f'rating_feedbacks:{parking_lot_id}')
     db.refresh(new_rating_feedback)
     return new_rating_feedback
 
@@ -66,18 +83,22 @@ def update_rating_feedback(parking_lot_id: int,
                            rating_feedback_id: int,
                            rating_feedback_update: RatingFeedbackUpdate,
                            current_active_user: CurrentActiveUserDependency,
-                           db: DatabaseDependency):
+                           db: DatabaseDependency,
+                           redis_client: RedisDependency):
     rating_feedback = db.query(RatingFeedback).filter(RatingFeedback.id == rating_feedback_id,
                                                       RatingFeedback.is_active == True).first()
     if (not rating_feedback) or rating_feedback.parking_lot_id != parking_lot_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Rating feedback not found')
     if rating_feedback.user_id != current_active_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
+    old_rating = rating_feedback.rating
     rating_feedback_update_dict = rating_feedback_update.model_dump(exclude_unset=True)
     for key, value in rating_feedback_update_dict.items():
         setattr(rating_feedback, key, value)
     rating_feedback.updated_at = datetime.utcnow()
+    apply_rating_change(db, parking_lot_id, old_rating, rating_feedback.rating)
     db.commit()
+    invalidate_tags(redis_client, f'rating_feedbacks:{parking_lot_id}')
     db.refresh(rating_feedback)
     return rating_feedback
 
@@ -86,7 +107,8 @@ def update_rating_feedback(parking_lot_id: int,
 def delete_rating_feedback(parking_lot_id: int,
                            rating_feedback_id: int,
                            current_active_user: CurrentActiveUserDependency,
-                           db: DatabaseDependency):
+                           db: DatabaseDependency,
+                           redis_client: RedisDependency):
     rating_feedback = db.query(RatingFeedback).filter(RatingFeedback.id == rating_feedback_id,
                                                       RatingFeedback.is_active == True).first()
     if (not rating_feedback) or rating_feedback.parking_lot_id != parking_lot_id:
@@ -95,5 +117,7 @@ def delete_rating_feedback(parking_lot_id: int,
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
     rating_feedback.is_active = False
     rating_feedback.deleted_at = datetime.utcnow()
+    apply_rating_change(db, parking_lot_id, rating_feedback.rating, None)
     db.commit()
+    invalidate_tags(redis_client, f'rating_feedbacks:{parking_lot_id}')
     return
@@ -0,0 +1,48 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException, status, Query
+
+from ..models.schemas import SearchHit
+from ..models.models import ParkingLot, User, Vehicle
+from ..dependencies.db_connection import ReadDatabaseDependency
+from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..utils.search import search
+
+router = APIRouter(
+    prefix='/search',
+    tags=['Search']
+)
+
+
+@router.get('/vehicles', response_model=List[SearchHit], status_code=status.HTTP_200_OK)
+def search_vehicles(
+        current_active_user: CurrentActiveUserDependency,
+        db: ReadDatabaseDependency,
+        q: str = Query(min_length=1, max_length=32, description='Part of a license plate'),
+        limit: int = Query(default=10, ge=1, le=50)
+):
+    # Admins search every plate, users their own vehicles
+    filters = [] if current_active_user.is_superuser else [Vehicle.owner_id == current_active_user.id]
+    return search(db, Vehicle, Vehicle.license_plate, q, limit, filters)
+
+
+@router.get('/users', response_model=List[SearchHit], status_code=status.HTTP_200_OK)
+def search_users(
+        current_active_user: CurrentActiveUserDependency,
+        db: ReadDatabaseDependency,
+        q: str = Query(min_length=1, max_length=64),
+        limit: int = Query(default=10, ge=1, le=50)
+):
+    if not current_active_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
+    return search(db, User, User.username, q, limit, [User.is_active == True])
+
+
+@router.get('/parking-lots', response_model=List[SearchHit], status_code=status.HTTP_200_OK)
+def search_parking_lots(
+        current_active_user: CurrentActiveUserDependency,
+        db: ReadDatabaseDependency,
+        q: str = Query(min_length=1, max_length=64),
+        limit: int = Query(default=10, ge=1, le=50)
+):
+    return search(db, ParkingLot, ParkingLot.name, q, limit, [ParkingLot.is_active == True])
@@ -7,9 +7,12 @@ from fastapi_pagination.ext.sqlalchemy import paginate
 
 from ..models.schemas import UserCreate, UserCreateOut, UserUpdate, UserOut
 from ..models.models import User
-from ..dependencies.db_connection import DatabaseDependency
+from ..dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..dependencies.redis_connection import RedisDependency
+from ..utils.jwt import bump_user_version
 from ..utils.password import hash_password
+from ..utils.search import prefix_filter
 
 router = APIRouter(
     prefix='/users',
@@ -45,7 +48,7 @@ def get_current_user(current_active_user: CurrentActiveUserDependency):
 # admin
 @router.get('/', response_model=Page[UserOut], status_code=status.HTTP_200_OK)
 def get_all_users(
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
         current_active_user: CurrentActiveUserDependency,
         show_deleted: bool = Query(default=False),
         username: Optional[str] = Query(default=None)
@@ -56,7 +59,7 @@ def get_all_users(
     if not show_deleted:
         query = query.filter(User.is_active == True)
     if username is not None:
-        query = query.filter(User.username.ilike(f'{username.lower()}%'))
+        query = query.filter(prefix_filter(User.username, username))
     return paginate(query)
 
 
@@ -74,6 +77,7 @@ def get_user_by_id(user_id: int, db: DatabaseDependency, current_active_user: Cu
 def update_user(user_id: int,
                 user_update: UserUpdate,
                 db: DatabaseDependency,
+                redis_client: RedisDependency,
                 current_active_user: CurrentActiveUserDependency):
     if not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
@@ -83,12 +87,14 @@ def update_user(user_id: int,
     user.is_superuser = user_update.is_superuser
     user.updated_at = datetime.utcnow()
     db.commit()
+    bump_user_version(redis_client, user.id)
     db.refresh(user)
     return user
 
 
 @router.delete('/{user_id}', status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user_id: int, db: DatabaseDependency, current_active_user: CurrentActiveUserDependency):
+def delete_user(user_id: int, db: DatabaseDependency, redis_client: RedisDependency,
+                current_active_user: CurrentActiveUserDependency):
     if current_active_user.id != user_id and not current_active_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Not allowed')
     user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
@@ -97,4 +103,5 @@ def delete_user(user_id: int, db: DatabaseDependency, current_active_user: Curre
     user.is_active = False
     user.deleted_at = datetime.utcnow()
     db.commit()
+    bump_user_version(redis_client, user.id)
     return
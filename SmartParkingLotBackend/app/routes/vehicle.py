@@ -1,15 +1,17 @@
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from fastapi_pagination import Page
+from fastapi_pagination import Page, pagination_ctx
 from fastapi_pagination.ext.sqlalchemy import paginate
 
 from ..models.schemas import VehicleCreate, VehicleCreateOut, VehicleOut
 from ..models.models import Vehicle
-from ..dependencies.db_connection import DatabaseDependency
+from ..dependencies.db_connection import DatabaseDependency, ReadDatabaseDependency
 from ..dependencies.oauth2 import CurrentActiveUserDependency
+from ..utils.keyset import CursorPage, CursorParamsDependency, paginate_keyset
+from ..utils.search import prefix_filter
 
 import base64
 
@@ -19,16 +21,21 @@ router = APIRouter(
 )
 
 
-@router.get('/', response_model=Page[VehicleOut], status_code=status.HTTP_200_OK)
+@router.get('/', response_model=Union[Page[VehicleOut], CursorPage[VehicleOut]],
+            dependencies=[Depends(pagination_ctx(Page[VehicleOut]))], status_code=status.HTTP_200_OK)
 def get_all_vehicles(
         current_active_user: CurrentActiveUserDependency,
-        db: DatabaseDependency,
+        db: ReadDatabaseDependency,
+        cursor_params: CursorParamsDependency,
         license_plate: Optional[str] = Query(default=None)
 ):
     query = db.query(Vehicle).filter(Vehicle.owner_id == current_active_user.id)
     if license_plate is not None:
-        query = query.filter(Vehicle.license_plate.ilike(f'{license_plate.lower()}%'))
-    results = paginate(query)
+        query = query.filter(prefix_filter(Vehicle.license_plate, license_plate))
+    if cursor_params.enabled:
+        results = paginate_keyset(db, query, VehicleOut, [Vehicle.id], False, cursor_params)
+    else:
+        results = paginate(query)
     if not results.items:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
     return results
@@ -0,0 +1,103 @@
+import csv
+import io
+import os
+from typing import Iterator, Sequence
+
+from sqlalchemy import DateTime, Select, String, Text, cast, func, literal
+
+from ..dependencies.db_connection import engine, read_session
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 10000))
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def stream_batches(statement: Select, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Sequence]:
+    # The response outlives the request's session, so the export opens its own. stream_results makes
+    # psycopg2 use a server-side cursor, memory stays at one batch whatever the size of the result.
+    # Plain rows through the connection skip the ORM's per-row loading. Exports read from a replica if
+    # there is one.
+    with read_session() as db:
+        connection = db.connection().execution_options(stream_results=True, max_row_buffer=batch_size)
+        for batch in connection.execute(statement).partitions(batch_size):
+            yield batch
+
+
+def text_columns(columns: Sequence) -> list:
+    # Timestamps come back as text, parsing them into datetimes only to print them again is most of the
+    # client's time per row
+    return [cast(column, String).label(column.key) if isinstance(column.type, DateTime) else column
+            for column in columns]
+
+
+def json_column(columns: Sequence):
+    # Each row as one JSON object built by the database, far cheaper than json.dumps per row
+    build = func.json_build_object if engine.dialect.name == 'postgresql' else func.json_object
+    return cast(build(*[part for column in columns for part in (literal(column.key), column)]), Text)
+
+
+def ndjson_chunks(batches: Iterator[Sequence]) -> Iterator[bytes]:
+    # Rows of a single json_column
+    for batch in batches:
+        yield ''.join([row[0] + '\n' for row in batch]).encode()
+
+
+def csv_chunks(columns: Sequence[str], batches: Iterator[Sequence]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Nothing matched, the header alone
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file for ParquetWriter, drained after every row group so the file is never held whole
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(schema, batches: Iterator[Sequence]) -> Iterator[bytes]:
+    # One row group per batch, the footer is written when the last one is done. Timestamps arrive as
+    # text from text_columns and are parsed by Arrow.
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in batches:
+        arrays = [pa.array(column, type=pa.string()).cast(field.type) if pa.types.is_timestamp(field.type)
+                  else pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,43 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from ..models.models import MANAGED_INDEXES
+
+
+def ensure_indexes(engine: Engine) -> int:
+    # Idempotent. Builds run CONCURRENTLY, outside a transaction, so writes to the tables go on meanwhile.
+    if engine.dialect.name != 'postgresql':
+        return 0
+    built = 0
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for index in MANAGED_INDEXES:
+            state = connection.execute(text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'),
+                                       {'name': index.name}).scalar()
+            if state is True:
+                continue
+            if state is False:
+                # Left behind by an interrupted concurrent build, IF NOT EXISTS would keep it unusable
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+            print(f"Building index {index.name}")
+            options = index.dialect_options['postgresql']
+            options['concurrently'] = True
+            try:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            finally:
+                options['concurrently'] = False
+            built += 1
+    return built
+
+
+def main():
+    from ..configs import load_env  # noqa: F401
+    from ..dependencies.db_connection import engine
+
+    built = ensure_indexes(engine)
+    print(f"Built {built} of {len(MANAGED_INDEXES)} indexes, the others already existed")
+
+
+if __name__ == '__main__':
+    main()
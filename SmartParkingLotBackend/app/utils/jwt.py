@@ -1,6 +1,7 @@
 import os
 import datetime
-from typing import Union
+import time
+from typing import Optional, Union
 
 import redis
 from fastapi import HTTPException, status, Depends
@@ -8,8 +9,18 @@ from fastapi import HTTPException, status, Depends
 from ..dependencies.db_connection import DatabaseDependency
 from ..dependencies.redis_connection import RedisDependency, get_redis
 from jose import jwt
+from sqlalchemy.orm import Session
 
 from ..models.models import User
+from .cache import MISSING, TTLCache
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+USER_VERSION_KEY_PREFIX = 'user_version'
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(TOKEN_CACHE_SIZE, 0)
 
 
 def create_jwt_token(data: dict, secret_key: str, expiry: dict) -> str:
@@ -22,6 +33,43 @@ def create_jwt_token(data: dict, secret_key: str, expiry: dict) -> str:
     return encoded_jwt
 
 
+def user_version_key(user_id: int) -> str:
+    return f'{USER_VERSION_KEY_PREFIX}:{user_id}'
+
+
+def bump_user_version(redis_client: redis.Redis, user_id: int):
+    # Cached copies of the user in every process are dropped on their next lookup
+    user_cache.invalidate(user_id)
+    try:
+        redis_client.incr(user_version_key(user_id))
+    except redis.RedisError as e:
+        print(f"Failed to bump version of user {user_id}: {e}")
+
+
+def decode_jwt_token(bearer_token: str, secret_key: str) -> dict:
+    # A token's signature and claims cannot change, so the decoded payload is kept until it expires
+    key = (secret_key, bearer_token)
+    payload = token_cache.get(key)
+    if payload is MISSING:
+        payload = jwt.decode(bearer_token, secret_key, algorithms=[os.getenv("ALGORITHM")])
+        if 'exp' in payload:
+            token_cache.set(key, payload, ttl=payload['exp'] - time.time())
+    return payload
+
+
+def resolve_user(db: Session, user_id: int, version: Optional[bytes]) -> Optional[User]:
+    cached = user_cache.get(user_id)
+    if cached is MISSING or cached[0] != version:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return None
+        db.expunge(user)
+        cached = (version, user)
+        user_cache.set(user_id, cached)
+    # Routes get their own session-bound copy, which they can modify and commit
+    return db.merge(cached[1], load=False)
+
+
 def verify_jwt_token(
         bearer_token: str,
         secret_key: str,
@@ -29,16 +77,20 @@ def verify_jwt_token(
         redis_client: RedisDependency):
     exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Could not validate credentials",
                               headers={"WWW-Authenticate": "Bearer"})
-    state = redis_client.get(bearer_token)
-    if state is not None and state.decode('utf8') == 'revoked':
-        raise exception
     try:
-        payload = jwt.decode(bearer_token, secret_key, algorithms=[os.getenv("ALGORITHM")])
+        payload = decode_jwt_token(bearer_token, secret_key)
         user_id = payload.get("user_id")
         is_superuser = payload.get("is_superuser")
         if user_id is None or is_superuser is None:
             raise exception
-        user = db.query(User).filter(User.id == user_id).first()
+        # The revocation check and the user's version share one round trip
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.get(bearer_token)
+        pipeline.get(user_version_key(user_id))
+        state, version = pipeline.execute()
+        if state is not None and state.decode('utf8') == 'revoked':
+            raise exception
+        user = resolve_user(db, user_id, version)
         if (not user) or (is_superuser and not user.is_superuser):
             raise exception
         return user
@@ -0,0 +1,129 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+from datetime import datetime
+from typing import Annotated, Generic, List, Optional, Sequence, Type, TypeVar
+
+from fastapi import Depends, HTTPException, Query, status
+from fastapi_pagination.api import resolve_params
+from pydantic import BaseModel
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Query as ORMQuery, Session
+
+T = TypeVar('T')
+
+
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    size: int
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+class CursorParams:
+    # Opt-in, lists keep offset pagination unless pagination=cursor. The page size is the usual size parameter.
+    def __init__(self,
+                 pagination: str = Query(default='offset', regex='^(offset|cursor)$'),
+                 cursor: Optional[str] = Query(default=None, description='next_cursor of the previous page'),
+                 total: str = Query(default='none', regex='^(none|approx|exact)$',
+                                    description='Total with cursor pagination, approx is the planner estimate')):
+        self.enabled = pagination == 'cursor'
+        self.cursor = cursor
+        self.total = total
+
+
+CursorParamsDependency = Annotated[CursorParams, Depends()]
+
+
+def _dump_value(value):
+    return {'dt': value.isoformat()} if isinstance(value, datetime) else value
+
+
+def _load_value(key, value):
+    # Values must fit the key column, a value of another type would fail in the database instead
+    if value is None:
+        return None
+    python_type = key.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value['dt'])
+    if python_type is int and type(value) is int:
+        return value
+    if python_type is float and type(value) in (int, float):
+        return value
+    if python_type is str and isinstance(value, str):
+        return value
+    raise TypeError(f'{value!r} does not fit {key}')
+
+
+def _signature(payload: str, keys: Sequence, descending: bool) -> str:
+    # Signed with the ordering it was made for, so a cursor from another sort order or an edited one is rejected
+    secret = os.getenv('CURSOR_SECRET_KEY') or os.getenv('JWT_ACCESS_SECRET_KEY') or ''
+    order = f"{'desc' if descending else 'asc'}:{','.join(str(key) for key in keys)}"
+    digest = hmac.new(secret.encode(), f'{order}|{payload}'.encode(), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def encode_cursor(values: Sequence, keys: Sequence, descending: bool) -> str:
+    payload = json.dumps([_dump_value(value) for value in values], separators=(',', ':'))
+    payload = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    return f'{payload}.{_signature(payload, keys, descending)}'
+
+
+def decode_cursor(cursor: str, keys: Sequence, descending: bool) -> list:
+    payload, _, signature = cursor.partition('.')
+    try:
+        if not hmac.compare_digest(signature, _signature(payload, keys, descending)):
+            raise ValueError('Bad signature')
+        values = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError('Wrong number of values')
+        values = [_load_value(key, value) for key, value in zip(keys, values)]
+    except (binascii.Error, ValueError, KeyError, TypeError, NotImplementedError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return values
+
+
+def estimate_count(db: Session, query: ORMQuery) -> int:
+    # The planner's row estimate for the filtered query, no scan. Other databases get an exact count.
+    statement = query.order_by(None).statement
+    if db.bind.dialect.name != 'postgresql':
+        return db.execute(select(func.count()).select_from(statement.subquery())).scalar_one()
+    compiled = statement.compile(dialect=db.bind.dialect)
+    plan = db.connection().exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_order(keys: Sequence, descending: bool) -> list:
+    # The unique last key makes the order total, so offset pages do not drop or repeat rows on ties either
+    return [key.desc() if descending else key.asc() for key in keys]
+
+
+def paginate_keyset(db: Session, query: ORMQuery, schema: Type[BaseModel], keys: Sequence, descending: bool,
+                    params: CursorParams) -> CursorPage:
+    # keys is the ordering and must end with a unique column, usually the primary key. The next page starts
+    # right after the last row of this one, so its cost does not depend on how deep it is, and rows
+    # inserted meanwhile neither shift nor repeat items across pages.
+    size = resolve_params().size
+    page_query = query.order_by(None)
+    if params.cursor is not None:
+        last = tuple_(*decode_cursor(params.cursor, keys, descending))
+        page_query = page_query.filter(tuple_(*keys) < last if descending else tuple_(*keys) > last)
+    rows = page_query.add_columns(*keys).order_by(*keyset_order(keys, descending)).limit(size + 1).all()
+    next_cursor = encode_cursor(rows[size - 1][1:], keys, descending) if len(rows) > size else None
+    if params.total == 'exact':
+        total = query.order_by(None).count()
+    elif params.total == 'approx':
+        total = estimate_count(db, query)
+    else:
+        total = None
+    return CursorPage[schema](
+        items=[schema.model_validate(row[0], from_attributes=True) for row in rows[:size]],
+        size=size,
+        next_cursor=next_cursor,
+        total=total,
+    )
@@ -1,12 +1,103 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from anyio.to_thread import current_default_thread_limiter
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', os.cpu_count() or 1))
+PASSWORD_MAX_PENDING = int(os.getenv('PASSWORD_MAX_PENDING', 4 * max(PASSWORD_WORKERS, 1)))
 
+# Hashes made with any other cost are rehashed on the next successful login
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__default_rounds=BCRYPT_ROUNDS,
+                           bcrypt__min_desired_rounds=BCRYPT_ROUNDS, bcrypt__max_desired_rounds=BCRYPT_ROUNDS)
 
-def hash_password(password: str) -> str:
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordPool:
+    # bcrypt runs in worker processes so a login storm takes at most PASSWORD_WORKERS cores, and at most
+    # max_pending request threads wait on it. Past that requests fail fast with 503 instead of holding
+    # threadpool threads that cheap requests need. With no workers, or before start, hashing runs inline.
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        # Called from the lifespan, after any change to AnyIO's thread limiter
+        if not self.workers:
+            return
+        # Sync routes share the limiter's threads, waiting hashes may hold at most a quarter of them
+        threadpool_size = int(current_default_thread_limiter().total_tokens)
+        self.max_pending = max(1, min(self.max_pending, threadpool_size // 4))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        # Workers come from a fork server started here, forking the server itself would copy
+        # the locks its other threads hold
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method))
+
+    def run(self, fn, *args):
+        executor = self._executor
+        if executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Server busy, try again',
+                                headers={'Retry-After': '1'})
+        with self._lock:
+            self.pending += 1
+        future = executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future.result()
+
+    def _release(self, future: Future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_MAX_PENDING)
+
+
+def hash_password(password: str) -> str:
+    return password_pool.run(_hash, password)
+
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # The second value is a new hash when the stored one was made with another cost
+    return password_pool.run(_verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+import os
+import secrets
+import uuid
+from typing import BinaryIO, Iterator, List, Sequence
+
+from fastapi import HTTPException, status
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import Connection, insert, text
+from sqlalchemy.orm import Session
+
+from ..models.models import Camera, ParkingSpace, Sensor
+from ..models.schemas import ParkingSpaceLayout
+
+LAYOUT_MAX_SPACES = int(os.getenv('LAYOUT_MAX_SPACES', 100000))
+LAYOUT_MAX_BYTES = int(os.getenv('LAYOUT_MAX_BYTES', 32 * 1024 * 1024))
+PROVISION_PAGE_SIZE = int(os.getenv('PROVISION_PAGE_SIZE', 5000))
+
+_layout_adapter = TypeAdapter(List[ParkingSpaceLayout])
+
+
+def read_layout(file: BinaryIO) -> bytes:
+    # Bounded before parsing, so an oversized upload is refused without loading it whole
+    content = file.read(LAYOUT_MAX_BYTES + 1)
+    if len(content) > LAYOUT_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'Layout file larger than {LAYOUT_MAX_BYTES} bytes')
+    return content
+
+
+def parse_layout(content: bytes, filename: str) -> List[ParkingSpaceLayout]:
+    # A JSON array of spaces, or CSV with a header row, columns as in ParkingSpaceLayout. Empty CSV cells
+    # take the default.
+    try:
+        if filename.lower().endswith('.json'):
+            rows = json.loads(content)
+        else:
+            rows = [{key: value for key, value in row.items() if value}
+                    for row in csv.DictReader(io.StringIO(content.decode('utf-8-sig')))]
+        spaces = _layout_adapter.validate_python(rows)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=[{'loc': error['loc'], 'msg': error['msg']} for error in e.errors()[:20]])
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Layout file is not valid JSON or CSV')
+    if not spaces:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Layout file has no parking spaces')
+    if len(spaces) > LAYOUT_MAX_SPACES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {LAYOUT_MAX_SPACES} parking spaces per layout')
+    return spaces
+
+
+def _api_key() -> str:
+    # Same shape as the columns' server default, 64 hex characters
+    return secrets.token_hex(32)
+
+
+def _copy_rows(connection: Connection, model, rows: List[dict]):
+    # COPY ... FROM STDIN in CSV, an empty unquoted field is NULL
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([[row[column] for column in columns] for row in rows])
+    buffer.seek(0)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {model.__tablename__} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _insert_rows(connection: Connection, model, rows: List[dict]):
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        _copy_rows(connection, model, rows)
+    else:
+        connection.execute(insert(model), rows)
+
+
+def _new_space_ids(connection: Connection, rows: List[dict]) -> List[int]:
+    # On Postgres the ids are drawn from the sequence up front so the spaces can be COPYed, elsewhere a
+    # multi-row INSERT ... RETURNING hands them back in the order of the rows
+    if connection.dialect.name == 'postgresql':
+        ids = connection.execute(text("SELECT nextval(pg_get_serial_sequence('parking_spaces', 'id')) "
+                                      "FROM generate_series(1, :count)"), {'count': len(rows)}).scalars().all()
+        _copy_rows(connection, ParkingSpace, [{'id': space_id, **row} for space_id, row in zip(ids, rows)])
+        return ids
+    return connection.execute(insert(ParkingSpace).returning(ParkingSpace.id, sort_by_parameter_order=True),
+                              rows).scalars().all()
+
+
+def provision_parking_lot(db: Session, parking_lot_id: int, spaces: Sequence[ParkingSpaceLayout],
+                          cameras: int) -> dict:
+    # Set-based inserts, one COPY or a few multi-row INSERTs per table instead of a commit and a refresh per
+    # object. Device ids and api keys are made here. The caller commits.
+    connection = db.connection().execution_options(insertmanyvalues_page_size=PROVISION_PAGE_SIZE)
+    space_ids = _new_space_ids(connection, [
+        {'longitude': space.longitude, 'latitude': space.latitude, 'vehicle_type': space.vehicle_type.value,
+         'parking_lot_id': parking_lot_id, 'is_active': True} for space in spaces
+    ])
+    sensors = [{'id': uuid.uuid4(), 'api_key': _api_key(), 'parking_space_id': space_id, 'is_active': True}
+               for space, space_id in zip(spaces, space_ids) if space.sensor]
+    new_cameras = [{'id': uuid.uuid4(), 'api_key': _api_key(), 'parking_lot_id': parking_lot_id, 'is_active': True}
+                   for _ in range(cameras)]
+    _insert_rows(connection, Sensor, sensors)
+    _insert_rows(connection, Camera, new_cameras)
+    return {'space_ids': space_ids, 'sensors': sensors, 'cameras': new_cameras}
+
+
+def provisioned_chunks(provisioned: dict, batch_size: int = 5000) -> Iterator[bytes]:
+    # NDJSON, one line per parking space with its sensor if it got one, then one per camera
+    sensors = {sensor['parking_space_id']: sensor for sensor in provisioned['sensors']}
+    lines = []
+    for space_id in provisioned['space_ids']:
+        sensor = sensors.get(space_id)
+        lines.append(json.dumps({'parking_space_id': space_id,
+                                 'sensor_id': str(sensor['id']) if sensor else None,
+                                 'api_key': sensor['api_key'] if sensor else None}))
+        if len(lines) == batch_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    for camera in provisioned['cameras']:
+        lines.append(json.dumps({'camera_id': str(camera['id']), 'api_key': camera['api_key']}))
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
@@ -0,0 +1,75 @@
+import argparse
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..models.models import RatingAggregate, RatingFeedback
+
+STAR_COLUMNS = {1: 'one_star', 2: 'two_star', 3: 'three_star', 4: 'four_star', 5: 'five_star'}
+
+
+def apply_rating_change(db: Session, parking_lot_id: int, old_rating: Optional[int], new_rating: Optional[int]):
+    # Runs in the same transaction as the feedback change, so the aggregate commits or rolls back with it
+    if old_rating == new_rating:
+        return
+    deltas = {column: 0 for column in STAR_COLUMNS.values()}
+    deltas['rating_count'] = 0
+    deltas['rating_sum'] = 0
+    for rating, sign in ((old_rating, -1), (new_rating, 1)):
+        if rating is None:
+            continue
+        if rating in STAR_COLUMNS:
+            deltas[STAR_COLUMNS[rating]] += sign
+        deltas['rating_count'] += sign
+        deltas['rating_sum'] += sign * rating
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    statement = insert(RatingAggregate).values(parking_lot_id=parking_lot_id, updated_at=datetime.utcnow(), **deltas)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[RatingAggregate.parking_lot_id],
+        set_={
+            'updated_at': statement.excluded.updated_at,
+            **{column: getattr(RatingAggregate, column) + delta for column, delta in deltas.items()},
+        },
+    ))
+
+
+def rebuild_rating_aggregates(db: Session, parking_lot_id: Optional[int] = None) -> int:
+    # Feedback writers upsert under ROW EXCLUSIVE, so they wait here and none is lost between the scan and the swap
+    if db.bind.dialect.name == 'postgresql':
+        db.execute(text('LOCK TABLE rating_aggregates IN SHARE ROW EXCLUSIVE MODE'))
+    query = db.query(
+        RatingFeedback.parking_lot_id,
+        *[func.count(case((RatingFeedback.rating == rating, 1))).label(column)
+          for rating, column in STAR_COLUMNS.items()],
+        func.count(RatingFeedback.rating).label('rating_count'),
+        func.sum(RatingFeedback.rating).label('rating_sum'),
+    ).filter(RatingFeedback.is_active == True).group_by(RatingFeedback.parking_lot_id)
+    stale = db.query(RatingAggregate)
+    if parking_lot_id is not None:
+        query = query.filter(RatingFeedback.parking_lot_id == parking_lot_id)
+        stale = stale.filter(RatingAggregate.parking_lot_id == parking_lot_id)
+    rows = [row._asdict() for row in query.all()]
+    stale.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.add_all([RatingAggregate(updated_at=now, **row) for row in rows])
+    db.commit()
+    return len(rows)
+
+
+def main():
+    from ..configs import load_env  # noqa: F401
+    from ..dependencies.db_connection import SessionLocal
+
+    parser = argparse.ArgumentParser(description='Rebuild rating_aggregates from rating_feedbacks')
+    parser.add_argument('--parking-lot-id', type=int)
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        rebuilt = rebuild_rating_aggregates(db, args.parking_lot_id)
+    print(f"Rebuilt rating aggregates for {rebuilt} parking lots")
+
+
+if __name__ == '__main__':
+    main()
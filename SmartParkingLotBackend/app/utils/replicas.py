@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+from itertools import count
+from typing import Dict, Optional, Tuple
+
+import redis
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import replica_healthy, replica_lag
+
+# Comma separated, empty routes every read to the primary
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+REPLICA_CHECK_SECONDS = float(os.getenv('REPLICA_CHECK_SECONDS', 5))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2))
+# A client's reads go to the primary for this long after its own write, 0 turns it off
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+# A replica that has replayed all the WAL it received is not behind, however old its last transaction is. After
+# a restart the receive position starts behind the replayed one. On WAL written after an idle spell the lag reads
+# as the idle time until it is replayed, at worst sending reads to the primary for one check.
+LAG_QUERY = text("""
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+""")
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def create_replica_engine(uri: str) -> Engine:
+    # A replica that went away should fail its health check quickly rather than hang it
+    connect_args = {'connect_timeout': REPLICA_CONNECT_TIMEOUT} if uri.startswith('postgresql') else {}
+    return create_engine(uri, pool_pre_ping=True, connect_args=connect_args)
+
+
+def client_key(headers) -> Optional[str]:
+    # Writes are attributed to the credential they were made with, a bearer token or a device API key
+    credential = headers.get('authorization') or headers.get('x-api-key')
+    if not credential:
+        return None
+    return 'read_your_writes:' + hashlib.sha1(credential.encode()).hexdigest()
+
+
+class ReplicaRouter:
+    # Round-robin over the replicas that passed their last health check. Stickiness after a write is kept
+    # in Redis so every instance of the app sees it.
+    def __init__(self, engines: Dict[str, Engine], redis_client: redis.Redis):
+        self.engines = engines
+        self.redis_client = redis_client
+        self.healthy = []
+        self.lag = {}
+        self.errors = {}
+        self._next = count()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.engines:
+            return
+        self.check()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='replica-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for engine in self.engines.values():
+            engine.dispose()
+
+    def _run(self):
+        while not self._stopped.wait(REPLICA_CHECK_SECONDS):
+            self.check()
+
+    def check(self):
+        healthy = []
+        for name, engine in self.engines.items():
+            try:
+                with engine.connect() as connection:
+                    lag = float(connection.execute(LAG_QUERY if engine.dialect.name == 'postgresql'
+                                                   else text('SELECT 0')).scalar() or 0)
+            except Exception as e:
+                self.errors[name] = str(e).split('\n')[0]
+                lag = None
+            self.lag[name] = lag
+            replica_lag.labels(name).set(lag if lag is not None else float('nan'))
+            replica_healthy.labels(name).set(lag is not None and lag <= REPLICA_MAX_LAG_SECONDS)
+            if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS:
+                healthy.append(name)
+        if healthy != self.healthy:
+            print(f"Healthy read replicas: {', '.join(healthy) or 'none, reading from the primary'}")
+        self.healthy = healthy
+
+    def mark_down(self, name: str, error: Exception):
+        # A failed checkout takes the replica out until the next health check
+        self.errors[name] = str(error).split('\n')[0]
+        self.healthy = [healthy for healthy in self.healthy if healthy != name]
+        replica_healthy.labels(name).set(0)
+
+    def mark_write(self, key: Optional[str]):
+        if key is None or not self.engines or READ_YOUR_WRITES_SECONDS <= 0:
+            return
+        try:
+            self.redis_client.set(key, 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+        except redis.RedisError as e:
+            print(f"Failed to mark a write for read-your-writes: {e}")
+
+    def route(self, key: Optional[str]) -> Tuple[Optional[str], str]:
+        # The replica to read from and why, None for the primary
+        healthy = self.healthy
+        if not healthy:
+            return None, 'no_replica' if not self.engines else 'replicas_down'
+        if key is not None and READ_YOUR_WRITES_SECONDS > 0:
+            try:
+                if self.redis_client.exists(key):
+                    return None, 'read_your_writes'
+            except redis.RedisError:
+                # Without the marker a recent write could be missing from the replica
+                return None, 'read_your_writes'
+        return healthy[next(self._next) % len(healthy)], 'replica'
+
+    def stats(self) -> dict:
+        return {
+            'replicas': list(self.engines),
+            'healthy': self.healthy,
+            'lag_seconds': self.lag,
+            'last_errors': self.errors,
+            'max_lag_seconds': REPLICA_MAX_LAG_SECONDS,
+            'read_your_writes_seconds': READ_YOUR_WRITES_SECONDS,
+        }
+
+
+class ReadYourWritesMiddleware:
+    # Marks the client before the response to its write is sent, so a read it makes next cannot beat it.
+    # Failed writes count too, one may have committed before failing.
+    def __init__(self, app, router: ReplicaRouter):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] in SAFE_METHODS or not self.router.engines:
+            await self.app(scope, receive, send)
+            return
+        key = client_key({name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']})
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                await run_in_threadpool(self.router.mark_write, key)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
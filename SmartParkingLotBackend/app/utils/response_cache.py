@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import redis
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import BaseRoute, Match
+
+from ..dependencies.redis_connection import redis_client
+from .cache import MISSING, TTLCache
+from .jwt import decode_jwt_token, user_cache, user_version_key
+from .metrics import response_cache_requests, response_cache_saved_db
+from .sql_profiler import sql_timer
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_L1_SIZE = int(os.getenv('RESPONSE_CACHE_L1_SIZE', 10000))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 1 << 20))
+# How long concurrent misses of one key wait for the request computing it before computing it themselves
+RESPONSE_CACHE_WAIT_SECONDS = float(os.getenv('RESPONSE_CACHE_WAIT_SECONDS', 5))
+RESPONSE_KEY_PREFIX = 'response'
+TAG_KEY_PREFIX = 'response_tag'
+SCOPES = ('public', 'role', 'user')
+
+
+class CachePolicy:
+    def __init__(self, scope: str, ttl: float, tags: Sequence[str]):
+        self.scope = scope
+        self.ttl = ttl
+        self.tags = tuple(tags)
+
+
+def cached(scope: str = 'role', ttl: float = 60, tags: Sequence[str] = ()):
+    # Marks a GET route for ResponseCacheMiddleware. scope is who shares an entry: public routes take no
+    # credentials, role entries are shared by admins or by users, user entries are per user. tags are
+    # formatted with the path parameters, and invalidate_tags with any of them drops the entry.
+    if scope not in SCOPES:
+        raise ValueError(f'scope must be one of {SCOPES}')
+
+    def decorator(endpoint):
+        endpoint.cache_policy = CachePolicy(scope, ttl, tags)
+        return endpoint
+
+    return decorator
+
+
+def tag_key(tag: str) -> str:
+    return f'{TAG_KEY_PREFIX}:{tag}'
+
+
+def invalidate_tags(redis_client: redis.Redis, *tags: str):
+    # Call after the commit. Entries keep the tag versions read before they were computed, so one
+    # computed from data older than the commit never matches the bumped version.
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(tag_key(tag))
+        pipeline.execute()
+    except redis.RedisError as e:
+        print(f"Failed to invalidate cached responses tagged {', '.join(tags)}: {e}")
+
+
+class CachedResponse:
+    def __init__(self, versions: list, headers: list, body: bytes, db_seconds: float, expires_at: float):
+        self.versions = versions
+        self.headers = headers
+        self.body = body
+        # DB time of the request that computed it, which every hit saves
+        self.db_seconds = db_seconds
+        self.expires_at = expires_at
+
+    def dumps(self) -> bytes:
+        meta = {'versions': self.versions, 'headers': self.headers, 'db_seconds': self.db_seconds,
+                'expires_at': self.expires_at}
+        return json.dumps(meta).encode() + b'\n' + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'CachedResponse':
+        meta, body = data.split(b'\n', 1)
+        meta = json.loads(meta)
+        return cls(meta['versions'], meta['headers'], body, meta['db_seconds'], meta['expires_at'])
+
+
+class Lookup:
+    # What one round trip to Redis found out about a request to a cached route
+    def __init__(self, key: str, versions: list, verified: bool, entry: Optional[CachedResponse], level: str):
+        self.key = key
+        self.versions = versions
+        self.verified = verified
+        self.entry = entry
+        self.level = level
+
+
+class ResponseCache:
+    def __init__(self, redis_client: redis.Redis):
+        self.redis_client = redis_client
+        self.l1 = TTLCache(RESPONSE_CACHE_L1_SIZE, 0)
+        self.routes = {}
+
+    def caller(self, policy: CachePolicy, headers: dict) -> Optional[Tuple[str, Optional[str], dict]]:
+        # The scope part of the key, the bearer token and its claims. None when the request cannot be
+        # keyed, it then goes to the route as if it was not cached.
+        if policy.scope == 'public':
+            return '', None, {}
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None
+        try:
+            payload = decode_jwt_token(token, os.getenv('JWT_ACCESS_SECRET_KEY'))
+        except Exception:
+            return None
+        if payload.get('user_id') is None or payload.get('is_superuser') is None:
+            return None
+        if policy.scope == 'role':
+            return ('admin' if payload['is_superuser'] else 'user'), token, payload
+        return f"user:{payload['user_id']}", token, payload
+
+    def lookup(self, key: str, tags: Sequence[str], token: Optional[str], payload: dict) -> Optional[Lookup]:
+        # Revocation, the user's version, the tag versions and, if L1 does not have it, the entry. A user
+        # whose current version is not in the user cache is verified by the route and only sees misses.
+        local = self.l1.get(key)
+        pipeline = self.redis_client.pipeline(transaction=False)
+        if token is not None:
+            pipeline.get(token)
+            pipeline.get(user_version_key(payload['user_id']))
+        for tag in tags:
+            pipeline.get(tag_key(tag))
+        if local is MISSING:
+            pipeline.get(key)
+        try:
+            results = pipeline.execute()
+        except redis.RedisError as e:
+            print(f"Response cache unavailable: {e}")
+            return None
+        verified = True
+        if token is not None:
+            state, version = results[:2]
+            results = results[2:]
+            if state is not None and state.decode('utf8') == 'revoked':
+                return None
+            cached_user = user_cache.get(payload['user_id'])
+            verified = cached_user is not MISSING and cached_user[0] == version and cached_user[1].is_active and \
+                (cached_user[1].is_superuser or not payload['is_superuser'])
+        versions = [int(value or 0) for value in results[:len(tags)]]
+        level = 'l1'
+        if local is MISSING:
+            level = 'l2'
+            data = results[len(tags)]
+            local = CachedResponse.loads(data) if data is not None else None
+            if local is not None and local.versions == versions:
+                self.l1.set(key, local, ttl=local.expires_at - time.time())
+        if local is not None and local.versions != versions:
+            self.l1.invalidate(key)
+            local = None
+        return Lookup(key, versions, verified, local, level)
+
+    def store(self, key: str, policy: CachePolicy, entry: CachedResponse):
+        self.l1.set(key, entry, ttl=policy.ttl)
+        try:
+            self.redis_client.set(key, entry.dumps(), px=int(policy.ttl * 1000))
+        except redis.RedisError as e:
+            print(f"Failed to store cached response: {e}")
+
+    def count(self, route: str, outcome: str, entry: Optional[CachedResponse] = None):
+        response_cache_requests.labels(route, outcome).inc()
+        totals = self.routes.setdefault(route, {'hit_l1': 0, 'hit_l2': 0, 'coalesced': 0, 'miss': 0, 'bypass': 0,
+                                                'saved_db_ms': 0.0})
+        totals[outcome] += 1
+        if entry is not None and outcome != 'miss':
+            response_cache_saved_db.labels(route).inc(entry.db_seconds)
+            totals['saved_db_ms'] = round(totals['saved_db_ms'] + entry.db_seconds * 1000, 3)
+
+    def stats(self) -> dict:
+        routes = {}
+        for route, totals in self.routes.items():
+            hits = totals['hit_l1'] + totals['hit_l2'] + totals['coalesced']
+            lookups = hits + totals['miss']
+            routes[route] = {**totals, 'hit_ratio': round(hits / lookups, 4) if lookups else 0.0}
+        return {'enabled': RESPONSE_CACHE_ENABLED, 'l1': self.l1.stats(), 'routes': routes}
+
+
+response_cache = ResponseCache(redis_client)
+
+
+class ResponseCacheMiddleware:
+    # Serves GETs to routes marked with cached before routing, so hits skip the route's dependencies,
+    # the JWT user lookup included. Concurrent misses of one key in this process wait for the first.
+    def __init__(self, app, cache: ResponseCache):
+        self.app = app
+        self.cache = cache
+        self._routes = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def match(self, scope) -> Optional[Tuple[BaseRoute, CachePolicy, dict]]:
+        if self._routes is None:
+            self._routes = [route for route in scope['app'].routes
+                            if getattr(getattr(route, 'endpoint', None), 'cache_policy', None) is not None]
+        for route in self._routes:
+            matched, child_scope = route.matches(scope)
+            if matched == Match.FULL:
+                return route, route.endpoint.cache_policy, child_scope['path_params']
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET' or not RESPONSE_CACHE_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        matched = self.match(scope)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+        matched_route, policy, path_params = matched
+        route = matched_route.path
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        caller = self.cache.caller(policy, headers)
+        lookup = None
+        if caller is not None:
+            caller_scope, token, payload = caller
+            query = urlencode(sorted(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)))
+            digest = hashlib.sha1(f"{caller_scope}|{scope['path']}?{query}".encode()).hexdigest()
+            tags = [tag.format(**path_params) for tag in policy.tags]
+            lookup = await run_in_threadpool(self.cache.lookup, f'{RESPONSE_KEY_PREFIX}:{digest}', tags, token,
+                                             payload)
+        if lookup is None:
+            self.cache.count(route, 'bypass')
+            await self.app(scope, receive, send)
+            return
+        if lookup.verified and lookup.entry is not None:
+            self.cache.count(route, f'hit_{lookup.level}', lookup.entry)
+            await self.replay(scope, matched_route, lookup.entry, send)
+            return
+        inflight = self._inflight.get(lookup.key)
+        if lookup.verified and inflight is not None:
+            try:
+                entry = await asyncio.wait_for(asyncio.shield(inflight), RESPONSE_CACHE_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                entry = None
+            if entry is not None and entry.versions == lookup.versions:
+                self.cache.count(route, 'coalesced', entry)
+                await self.replay(scope, matched_route, entry, send)
+                return
+        self.cache.count(route, 'miss')
+        await self.compute(scope, receive, send, policy, lookup)
+
+    async def compute(self, scope, receive, send, policy: CachePolicy, lookup: Lookup):
+        leader = lookup.key not in self._inflight
+        if leader:
+            self._inflight[lookup.key] = asyncio.get_running_loop().create_future()
+        response = {'status': None, 'headers': [], 'body': [], 'size': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [[name.decode('latin-1'), value.decode('latin-1')]
+                                       for name, value in message.get('headers', [])]
+                message['headers'] = list(message.get('headers', [])) + [(b'x-cache', b'miss')]
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if response['size'] <= RESPONSE_CACHE_MAX_BYTES:
+                    response['body'].append(message.get('body', b''))
+            await send(message)
+
+        entry = None
+        try:
+            with sql_timer() as timer:
+                await self.app(scope, receive, send_wrapper)
+            if response['status'] == 200 and response['size'] <= RESPONSE_CACHE_MAX_BYTES and \
+                    not any(name.lower() == 'set-cookie' for name, _ in response['headers']):
+                entry = CachedResponse(lookup.versions, response['headers'], b''.join(response['body']),
+                                       timer['seconds'], time.time() + policy.ttl)
+                await run_in_threadpool(self.cache.store, lookup.key, policy, entry)
+        finally:
+            if leader:
+                self._inflight.pop(lookup.key).set_result(entry)
+
+    async def replay(self, scope, route: BaseRoute, entry: CachedResponse, send):
+        # Hits never reach the router, the outer middlewares label them with the route set here
+        scope['route'] = route
+        headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in entry.headers]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers + [(b'x-cache', b'hit')]})
+        await send({'type': 'http.response.body', 'body': entry.body})
@@ -0,0 +1,86 @@
+import os
+from difflib import SequenceMatcher
+from typing import List, Sequence
+
+from sqlalchemy import Column, func, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from ..dependencies.db_connection import engine
+
+# Short values such as plates share most of their trigrams, below about 0.5 a typo matches a large part of the table
+SEARCH_SIMILARITY = float(os.getenv('SEARCH_SIMILARITY', 0.5))
+# Budget for each trigram stage. Past it the stage is cancelled and the hits found so far are returned.
+SEARCH_TIMEOUT_MS = int(os.getenv('SEARCH_TIMEOUT_MS', 100))
+
+
+def _postgres() -> bool:
+    return engine.dialect.name == 'postgresql'
+
+
+def normalized(column: Column):
+    # The expression the search indexes of models.search_indexes are built on
+    lowered = func.lower(column)
+    return lowered.collate('C') if _postgres() else lowered
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def prefix_filter(column: Column, value: str):
+    # Case-insensitive prefix match that can use the index, unlike ilike
+    return normalized(column).like(f'{escape_like(value.lower())}%', escape='\\')
+
+
+def equals_filter(column: Column, value: str):
+    return normalized(column) == value.lower()
+
+
+def _score(term: str, value: str) -> float:
+    return round(SequenceMatcher(None, term, value.lower()).ratio(), 3)
+
+
+def search(db: Session, model, column: Column, q: str, limit: int, filters: Sequence = ()) -> List[dict]:
+    # Prefix matches first, in alphabetical order, then substring matches, then on Postgres typo-tolerant
+    # ones, both by similarity. Each stage runs only if the ones before it came short of limit.
+    term = q.strip().lower()
+    hits = []
+    if not term:
+        return hits
+    postgres = _postgres()
+    lowered = func.lower(column)
+    similarity = func.similarity(lowered, term) if postgres else None
+
+    def stage(match: str, condition, order_by):
+        query = db.query(model, similarity) if postgres else db.query(model)
+        query = query.filter(*filters, condition)
+        if hits:
+            query = query.filter(model.id.notin_([hit['id'] for hit in hits]))
+        rows = query.order_by(*order_by).limit(limit - len(hits)).all()
+        for row in rows:
+            item, score = row if postgres else (row, _score(term, getattr(row, column.key)))
+            hits.append({'id': item.id, 'text': getattr(item, column.key), 'match': match, 'score': round(score, 3)})
+
+    key = normalized(column)
+    stage('prefix', key.like(f'{escape_like(term)}%', escape='\\'), (key, model.id))
+    if not postgres:
+        if len(hits) < limit:
+            stage('substring', lowered.like(f'%{escape_like(term)}%', escape='\\'), (func.length(column), model.id))
+        return hits
+    # Trigrams need three characters. The settings are undone with the savepoint if a stage is cancelled,
+    # statement_timeout is put back otherwise.
+    if len(hits) < limit and len(term) >= 3:
+        try:
+            with db.begin_nested():
+                db.execute(text(f'SET LOCAL statement_timeout = {SEARCH_TIMEOUT_MS}'))
+                db.execute(text(f'SET LOCAL pg_trgm.similarity_threshold = {SEARCH_SIMILARITY}'))
+                stage('substring', lowered.like(f'%{escape_like(term)}%', escape='\\'), (similarity.desc(), model.id))
+                if len(hits) < limit:
+                    stage('fuzzy', lowered.op('%')(term), (similarity.desc(), model.id))
+                db.execute(text('SET LOCAL statement_timeout = DEFAULT'))
+        except OperationalError as e:
+            if getattr(e.orig, 'pgcode', None) != '57014':  # query_canceled
+                raise
+            print(f'Search for {term!r} in {column} cancelled after {SEARCH_TIMEOUT_MS} ms')
+    return hits
@@ -0,0 +1,179 @@
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+# 1 profiles every request, as in development. In production a small rate samples a share of the traffic.
+SQL_PROFILE_SAMPLE_RATE = float(os.getenv('SQL_PROFILE_SAMPLE_RATE', 0))
+SQL_SLOW_MS = float(os.getenv('SQL_SLOW_MS', 200))
+# The same statement this many times in one request is reported as N+1
+SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', 5))
+SQL_PROFILE_HISTORY = int(os.getenv('SQL_PROFILE_HISTORY', 100))
+
+_current_profile: ContextVar[Optional['RequestProfile']] = ContextVar('sql_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        # Statements are compiled with bound parameters, so a lazy load repeated per row is one key here
+        self.counts = {}
+        self.slow = []
+
+    def record(self, engine: Engine, statement: str, parameters, executemany: bool, elapsed: float):
+        self.statements += 1
+        self.seconds += elapsed
+        self.counts[statement] = self.counts.get(statement, 0) + 1
+        if elapsed * 1000 >= SQL_SLOW_MS:
+            self.slow.append({'engine': engine, 'statement': statement,
+                              'parameters': None if executemany else parameters, 'ms': round(elapsed * 1000, 1)})
+
+    def repeated(self) -> list:
+        return sorted(({'statement': statement, 'count': count} for statement, count in self.counts.items()
+                       if count >= SQL_REPEAT_THRESHOLD), key=lambda item: -item['count'])
+
+
+class SQLProfile:
+    # Recent profiled requests and totals by route for /admin/debug/sql
+    def __init__(self):
+        self.recent = deque(maxlen=SQL_PROFILE_HISTORY)
+        self.routes = {}
+
+    def add(self, method: str, route: str, status_code: int, profile: RequestProfile) -> dict:
+        entry = {
+            'method': method,
+            'route': route,
+            'status': status_code,
+            'statements': profile.statements,
+            'db_ms': round(profile.seconds * 1000, 1),
+            'repeated': profile.repeated(),
+            'slow': [{'statement': slow['statement'], 'ms': slow['ms'], 'plan': None} for slow in profile.slow],
+        }
+        self.recent.append(entry)
+        totals = self.routes.setdefault(f'{method} {route}', {'requests': 0, 'statements': 0, 'db_ms': 0.0,
+                                                               'max_statements': 0, 'n_plus_one': 0, 'slow': 0})
+        totals['requests'] += 1
+        totals['statements'] += profile.statements
+        totals['db_ms'] = round(totals['db_ms'] + entry['db_ms'], 1)
+        totals['max_statements'] = max(totals['max_statements'], profile.statements)
+        totals['n_plus_one'] += bool(entry['repeated'])
+        totals['slow'] += len(profile.slow)
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            'sample_rate': SQL_PROFILE_SAMPLE_RATE,
+            'slow_ms': SQL_SLOW_MS,
+            'repeat_threshold': SQL_REPEAT_THRESHOLD,
+            'routes': self.routes,
+            'recent': list(self.recent),
+        }
+
+
+sql_profile = SQLProfile()
+
+
+def profile_engine(engine: Engine):
+    # Attributes statements to the request profiled in the current context, if any. Sync routes and
+    # dependencies run in threads that copy the request's context, so they see the same profile.
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            conn.info['profile_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('profile_start', None)
+        profile = _current_profile.get()
+        if start is not None and profile is not None:
+            profile.record(conn.engine, statement, parameters, executemany, time.perf_counter() - start)
+
+
+@contextmanager
+def sql_timer():
+    # DB time of the statements run inside, whether or not the request is being profiled
+    profile = _current_profile.get()
+    token = None
+    if profile is None:
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+    seconds, statements = profile.seconds, profile.statements
+    timer = {'seconds': 0.0, 'statements': 0}
+    try:
+        yield timer
+    finally:
+        timer['seconds'] = profile.seconds - seconds
+        timer['statements'] = profile.statements - statements
+        if token is not None:
+            _current_profile.reset(token)
+
+
+def _one_line(statement: str) -> str:
+    return ' '.join(statement.split())
+
+
+def explain(engine: Engine, statement: str, parameters) -> Optional[str]:
+    # The plan without running the statement again. Only reads are explained.
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    _current_profile.set(None)
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters or ()).all()
+    except Exception as e:
+        return f'EXPLAIN failed: {e}'
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+class SQLProfilerMiddleware:
+    # Adds the request's statement count and DB time to the response headers. N+1 and slow statements
+    # are logged once the response is sent, slow ones with their plan.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or SQL_PROFILE_SAMPLE_RATE <= 0 or random.random() >= SQL_PROFILE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', f'db;dur={profile.seconds * 1000:.1f}'.encode()))
+                headers.append((b'x-db-statements', str(profile.statements).encode()))
+                repeated = profile.repeated()
+                if repeated:
+                    headers.append((b'x-db-repeated', str(max(item['count'] for item in repeated)).encode()))
+                message['headers'] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            await self.report(scope, status_code, profile)
+
+    async def report(self, scope, status_code: int, profile: RequestProfile):
+        route = scope.get('route')
+        entry = sql_profile.add(scope['method'], route.path if route is not None else 'unmatched', status_code,
+                                profile)
+        request = f"{entry['method']} {entry['route']}"
+        for item in entry['repeated']:
+            print(f"N+1: {request} ran {item['count']} times: {_one_line(item['statement'])}")
+        for slow, reported in zip(profile.slow, entry['slow']):
+            reported['plan'] = await run_in_threadpool(explain, slow['engine'], slow['statement'], slow['parameters'])
+            print(f"Slow query: {request} {slow['ms']} ms: {_one_line(slow['statement'])}\n{reported['plan']}")
@@ -0,0 +1,224 @@
+"""Authenticated GET load on the backend, with and without the user and token caches.
+
+Each run serves SmartParkingLotBackend's app.main by uvicorn in a child process
+on a fresh SQLite database and fakeredis, seeded with --users users, a few
+vehicles each and --lots parking lots. Every request carries one of the users'
+access tokens and hits a weighted mix of /users/me, /parking-lots/ and
+/vehicles/. The cached run uses the configured cache sizes, the uncached one
+sets USER_CACHE_SIZE and TOKEN_CACHE_SIZE to 0 so every request decodes its
+token and loads its user again. SQL statements per request are read from the
+app's /metrics before and after the load.
+
+Needs fakeredis and uvicorn on top of the backend requirements.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from common import dump, run_concurrently, summarize
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SmartParkingLotBackend')
+DEFAULT_MIX = 'me=40,parking_lots=40,vehicles=20'
+BACKEND_ENV = {
+    'ALGORITHM': 'HS256',
+    'JWT_ACCESS_SECRET_KEY': 'bench-access-secret',
+    'JWT_REFRESH_SECRET_KEY': 'bench-refresh-secret',
+    'ACCESS_TOKEN_EXPIRE_MINUTES': '60',
+    'REFRESH_TOKEN_EXPIRE_DAYS': '1',
+}
+STATEMENT_COUNT = re.compile(r'^db_statement_duration_seconds_count\{.*\} (\S+)$', re.M)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--vehicles-per-user', type=int, default=3)
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Comma separated endpoint=weight pairs')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for pair in mix.split(','):
+        name, _, weight = pair.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise SystemExit(f'Unknown endpoint {name!r}, expected one of {", ".join(ENDPOINTS)}')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def prepare_backend(database_uri: str = None, **env):
+    # Must run before app is imported, the backend reads its settings and creates its tables on import.
+    # Without a database_uri it gets a fresh SQLite database.
+    for key, value in BACKEND_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ.update(env)
+    os.environ['DATABASE_URI'] = database_uri or f'sqlite:///{tempfile.mkdtemp(prefix="bench-backend-")}/backend.db'
+    sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import UUID
+    from sqlalchemy.ext.compiler import compiles
+
+    from app.configs.db_configs import Base
+    import app.models.models  # noqa: F401
+
+    @compiles(UUID, 'sqlite')
+    def compile_uuid(type_, compiler, **kw):
+        return 'CHAR(32)'
+
+    if database_uri is not None:
+        return
+    # Postgres function defaults like now() do not exist in SQLite, the seeds set the columns they need
+    for table in Base.metadata.tables.values():
+        for column in table.columns:
+            if column.server_default is not None and '(' in str(column.server_default.arg):
+                column.server_default = None
+
+
+def serve(args, cached, tokens_queue):
+    prepare_backend(**({} if cached else {'USER_CACHE_SIZE': '0', 'TOKEN_CACHE_SIZE': '0'}))
+
+    import fakeredis
+    import uvicorn
+    from sqlalchemy import insert
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.models.models import ParkingLot, User, Vehicle
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.utils.jwt import create_jwt_token
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    users = [{'id': i, 'username': f'user{i}', 'password': 'not-used', 'is_superuser': False, 'is_active': True,
+              'created_at': now} for i in range(1, args.users + 1)]
+    vehicles = [{'license_plate': f'{rng.randint(10, 99)}A-{i:06d}', 'vehicle_type': 'car',
+                 'owner_id': i % args.users + 1, 'created_at': now}
+                for i in range(args.users * args.vehicles_per_user)]
+    lots = [{'id': i, 'name': f'Lot {i}', 'longitude': 105.85, 'latitude': 21.03, 'is_active': True,
+             'created_at': now} for i in range(1, args.lots + 1)]
+    with SessionLocal() as session:
+        for model, rows in ((User, users), (Vehicle, vehicles), (ParkingLot, lots)):
+            if rows:
+                session.execute(insert(model), rows)
+        session.commit()
+    tokens_queue.put([create_jwt_token({'user_id': user['id'], 'is_superuser': False},
+                                       secret_key=os.environ['JWT_ACCESS_SECRET_KEY'], expiry={'minutes': 60})
+                      for user in users])
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+
+
+def me(rng):
+    return '/users/me', {}
+
+
+def parking_lots(rng):
+    return '/parking-lots/', {'page': rng.randint(1, 3), 'size': 20}
+
+
+def vehicles(rng):
+    return '/vehicles/', {}
+
+
+ENDPOINTS = {
+    'me': me,
+    'parking_lots': parking_lots,
+    'vehicles': vehicles,
+}
+
+
+def wait_until_up(base_url, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not server.is_alive():
+            raise SystemExit('Backend exited during startup')
+        try:
+            httpx.get(base_url + '/', timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit('Backend did not come up')
+
+
+def statements(client) -> float:
+    return sum(float(count) for count in STATEMENT_COUNT.findall(client.get('/metrics').text))
+
+
+def run(args, weights, cached) -> dict:
+    tokens_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args, cached, tokens_queue), daemon=True)
+    server.start()
+    try:
+        tokens = tokens_queue.get(timeout=600)
+        base_url = f'http://127.0.0.1:{args.port}'
+        wait_until_up(base_url, server)
+
+        rng = random.Random(args.seed)
+        names = rng.choices(list(weights), list(weights.values()), k=args.requests)
+        jobs = [(name, rng.choice(tokens), *ENDPOINTS[name](rng)) for name in names]
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        with httpx.Client(base_url=base_url, limits=limits, timeout=30) as client:
+            def call(job):
+                name, token, url, params = job
+                try:
+                    response = client.get(url, params=params, headers={'Authorization': f'Bearer {token}'})
+                    return name, response.status_code
+                except httpx.HTTPError as e:
+                    return name, type(e).__name__
+
+            before = statements(client)
+            results, latencies, elapsed = run_concurrently(call, jobs, args.concurrency)
+            executed = statements(client) - before
+            caches = client.get('/stats').json()
+    finally:
+        server.terminate()
+        server.join()
+
+    endpoints = {}
+    for name in weights:
+        samples = [(status, latency) for (job_name, status), latency in zip(results, latencies) if job_name == name]
+        statuses = {}
+        for status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = summarize([latency for _, latency in samples], elapsed, statuses=statuses)
+    return {
+        'total': summarize(latencies, elapsed, statements_per_request=round(executed / len(jobs), 3)),
+        'endpoints': endpoints,
+        'user_cache': caches['user_cache'],
+        'token_cache': caches['token_cache'],
+    }
+
+
+def main():
+    args = parse_args()
+    weights = parse_mix(args.mix)
+    uncached = run(args, weights, cached=False)
+    cached = run(args, weights, cached=True)
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'uncached': uncached,
+        'cached': cached,
+        'rps_change_pct': round((cached['total']['rps'] - uncached['total']['rps']) / uncached['total']['rps'] * 100,
+                                1) if uncached['total']['rps'] else None,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Fan-out benchmark for the /parking_lots/stream capacity broadcaster.
+
+Connects --clients in-process subscribers spread over --lots lots, then feeds
+space state events from a thread, standing in for the Kafka listener, at
+--events-per-second. Reports how many events collapsed into each message and
+the delay from a flush to each subscriber receiving its update.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+# The serving models create an engine on import, nothing here touches the database
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from serve_app.capacity_stream import CapacityBroadcaster  # noqa: E402
+from serve_app.kafka import SpaceStateEvent  # noqa: E402
+from serve_app.occupancy import OccupancyIndex  # noqa: E402
+
+from common import dump, summarize  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=10_000)
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--spaces-per-lot', type=int, default=500)
+    parser.add_argument('--events-per-second', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, *columns):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+def feed(index, broadcaster, args, stop, counter):
+    rng = random.Random(args.seed)
+    total = args.lots * args.spaces_per_lot
+    pause = 1 / args.events_per_second
+    while not stop.is_set():
+        space_id = rng.randrange(total)
+        event = SpaceStateEvent(space_id, rng.choice(['free', 'occupied', 'reserved']), None, None)
+        index.on_space_state(event)
+        broadcaster.on_space_state(event)
+        counter[0] += 1
+        time.sleep(pause)
+
+
+async def client(broadcaster, parking_lot_id, flushed_at, latencies, received):
+    queue = broadcaster.subscribe(parking_lot_id)
+    queue.get_nowait()
+    try:
+        while True:
+            await queue.get()
+            latencies.append(time.perf_counter() - flushed_at[0])
+            received[0] += 1
+    finally:
+        broadcaster.unsubscribe(parking_lot_id, queue)
+
+
+async def run(args):
+    rows = [(space_id, space_id // args.spaces_per_lot, 'car', 'free')
+            for space_id in range(args.lots * args.spaces_per_lot)]
+    index = OccupancyIndex()
+    index.load(Rows(rows))
+    broadcaster = CapacityBroadcaster(index, args.interval)
+
+    latencies, received, flushed_at = [], [0], [0.0]
+    clients = [asyncio.ensure_future(client(broadcaster, i % args.lots, flushed_at, latencies, received))
+               for i in range(args.clients)]
+    await asyncio.sleep(0)
+
+    stop, events = threading.Event(), [0]
+    feeder = threading.Thread(target=feed, args=(index, broadcaster, args, stop, events), daemon=True)
+    feeder.start()
+    flush_times = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        await asyncio.sleep(args.interval)
+        flushed_at[0] = time.perf_counter()
+        broadcaster.flush()
+        flush_times.append(time.perf_counter() - flushed_at[0])
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    lot_messages = broadcaster.messages / (args.clients / args.lots)
+    report = summarize(latencies, elapsed, clients=args.clients, events=events[0], messages=received[0],
+                       events_per_lot_message=round(events[0] / max(1.0, lot_messages), 2))
+    report['flush_ms'] = summarize(flush_times, sum(flush_times))
+    return report
+
+
+def main():
+    args = parse_args()
+    dump(asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
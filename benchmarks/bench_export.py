@@ -0,0 +1,120 @@
+"""Throughput and memory of the admin activity log export in each format.
+
+Seeds --logs activity logs as bench_keyset.py does, into a fresh SQLite
+database or the empty database given as DATABASE_URI (--seeded reuses one
+seeded by an earlier run), serves the backend by uvicorn in a child process and
+streams /admin/activity_logs/export once per format. Reports rows per second,
+time to first byte, bytes, chunks received and how much the server's peak RSS
+grew over the export. Use Postgres to exercise the server-side cursor; SQLite
+has none and the driver buffers as it goes.
+
+The database and the app share the machine, on a single core the database's
+share of the work comes out of the rows per second.
+
+Needs fakeredis, uvicorn and pyarrow on top of the backend requirements.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import httpx
+
+from bench_backend_auth import prepare_backend, wait_until_up
+from bench_keyset import seed
+from common import dump
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', type=int, default=1000000)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--formats', default='ndjson,csv,parquet')
+    parser.add_argument('--seeded', action='store_true', help='DATABASE_URI already holds the seeded logs')
+    parser.add_argument('--port', type=int, default=8768)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def serve(args, token_queue):
+    prepare_backend(os.getenv('DATABASE_URI'))
+
+    import fakeredis
+    import uvicorn
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils.jwt import create_jwt_token
+
+    if not args.seeded:
+        with SessionLocal() as session:
+            seed(args, session, models)
+    token_queue.put(create_jwt_token({'user_id': 1, 'is_superuser': True},
+                                     secret_key=os.environ['JWT_ACCESS_SECRET_KEY'], expiry={'minutes': 60}))
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main():
+    args = parse_args()
+    token_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args, token_queue), daemon=True)
+    server.start()
+    formats = {}
+    try:
+        token = token_queue.get(timeout=3600)
+        base_url = f'http://127.0.0.1:{args.port}'
+        wait_until_up(base_url, server)
+        with httpx.Client(base_url=base_url, timeout=600) as client:
+            for export_format in args.formats.split(','):
+                rss_before = peak_rss_mb(server.pid)
+                size = chunks = lines = 0
+                start = time.perf_counter()
+                with client.stream('GET', '/admin/activity_logs/export', params={'format': export_format},
+                                   headers={'Authorization': f'Bearer {token}'}) as response:
+                    if response.status_code != 200:
+                        raise SystemExit(f'{export_format}: {response.status_code} {response.read()[:200]}')
+                    first_byte = time.perf_counter() - start
+                    for chunk in response.iter_raw():
+                        size += len(chunk)
+                        chunks += 1
+                        lines += chunk.count(b'\n')
+                elapsed = time.perf_counter() - start
+                formats[export_format] = {
+                    'rows_per_second': round(args.logs / elapsed),
+                    'seconds': round(elapsed, 2),
+                    'first_byte_ms': round(first_byte * 1000, 1),
+                    'megabytes': round(size / 2 ** 20, 1),
+                    'chunks': chunks,
+                    'peak_rss_growth_mb': round(peak_rss_mb(server.pid) - rss_before, 1),
+                }
+                if export_format != 'parquet':
+                    # One line per row, plus the header in CSV
+                    formats[export_format]['rows'] = lines - (export_format == 'csv')
+    finally:
+        server.terminate()
+        server.join()
+
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'database': (os.getenv('DATABASE_URI') or 'sqlite').split(':')[0],
+        'formats': formats,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
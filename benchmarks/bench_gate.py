@@ -0,0 +1,82 @@
+"""Concurrent gate-entry benchmark for POST /validate/in.
+
+Seeds a dedicated parking lot with free spaces and registered vehicles, fires
+one gate event per vehicle at a running serving layer and reports latency
+percentiles plus every space that was handed to more than one vehicle.
+Run it once against each build with a different --label to compare them.
+"""
+import argparse
+import collections
+from datetime import datetime
+
+import requests
+from sqlalchemy import create_engine, text
+
+from common import dump, run_concurrently, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', required=True)
+    parser.add_argument('--url', default='http://localhost:8001')
+    parser.add_argument('--camera-key', required=True, help='API key of a camera in --parking-lot-id')
+    parser.add_argument('--parking-lot-id', type=int, required=True)
+    parser.add_argument('--user-id', type=int, required=True, help='Owner of the seeded vehicles')
+    parser.add_argument('--vehicle-type', default='car')
+    parser.add_argument('--spaces', type=int, default=500)
+    parser.add_argument('--vehicles', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--label', default='current')
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def seed(engine, args):
+    plates = [f'BENCH{i:06d}' for i in range(args.vehicles)]
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE parking_spaces SET state = 'free', vehicle_id = NULL "
+                          "WHERE parking_lot_id = :lot"), {'lot': args.parking_lot_id})
+        existing = conn.execute(text("SELECT count(*) FROM parking_spaces "
+                                     "WHERE parking_lot_id = :lot AND vehicle_type = :type AND is_active"),
+                                {'lot': args.parking_lot_id, 'type': args.vehicle_type}).scalar()
+        missing = args.spaces - existing
+        if missing > 0:
+            conn.execute(text("INSERT INTO parking_spaces (longitude, latitude, vehicle_type, parking_lot_id, "
+                              "is_active, state) VALUES (:x, :y, :type, :lot, true, 'free')"),
+                         [{'x': i, 'y': 0, 'type': args.vehicle_type, 'lot': args.parking_lot_id}
+                          for i in range(missing)])
+        conn.execute(text("INSERT INTO vehicles (license_plate, vehicle_type, owner_id, is_tracked) "
+                          "VALUES (:plate, :type, :owner, false) ON CONFLICT (license_plate) DO NOTHING"),
+                     [{'plate': plate, 'type': args.vehicle_type, 'owner': args.user_id} for plate in plates])
+    return plates
+
+
+def main():
+    args = parse_args()
+    plates = seed(create_engine(args.database_uri), args)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+
+    def enter(plate):
+        response = session.post(f'{args.url}/validate/in', headers={'X-API-Key': args.camera_key}, json={
+            'license_plate': plate,
+            'user_id': args.user_id,
+            'timestamp': datetime.utcnow().isoformat(),
+        })
+        return response.status_code, response.json().get('id') if response.status_code == 200 else None
+
+    results, latencies, elapsed = run_concurrently(enter, plates, args.concurrency)
+    allocations = collections.Counter(space_id for status_code, space_id in results if status_code == 200)
+    dump(summarize(
+        latencies, elapsed,
+        label=args.label,
+        concurrency=args.concurrency,
+        statuses=dict(collections.Counter(status_code for status_code, _ in results)),
+        allocated=sum(allocations.values()),
+        double_allocations={space_id: count for space_id, count in allocations.items() if count > 1},
+    ), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Reservation publish throughput: per-request producer vs the shared producer.
+
+Runs against librdkafka's built-in mock cluster by default, so no broker is
+needed; pass --bootstrap-servers to use a real one. The per-request mode
+mirrors the old dependency: build a Producer, produce, poll(1), flush.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+from confluent_kafka import Producer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+
+from serve_app.kafka import DeliveryProducer, producer_config  # noqa: E402
+
+from common import dump, run_concurrently, summarize  # noqa: E402
+
+TOPIC = 'parking_space_state_raw'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bootstrap-servers')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def broker_config(args) -> dict:
+    if args.bootstrap_servers:
+        return {'bootstrap.servers': args.bootstrap_servers}
+    return {'test.mock.num.brokers': 3}
+
+
+def message(i):
+    return json.dumps({'vehicle_id': i, 'updated_at': datetime.utcnow().isoformat(), 'state': 'reserved'})
+
+
+def per_request(args):
+    def reserve(i):
+        producer = Producer(broker_config(args))
+        errors = []
+        producer.produce(TOPIC, key=str(i), value=message(i), callback=lambda err, msg: err and errors.append(err))
+        producer.poll(1)
+        producer.flush()
+        return not errors
+
+    return run_concurrently(reserve, range(args.messages), args.concurrency)
+
+
+def shared(args):
+    config = producer_config()
+    del config['bootstrap.servers']
+    config.update(broker_config(args))
+    producer = DeliveryProducer(config)
+    producer.start()
+
+    def reserve(i):
+        producer.produce(TOPIC, key=str(i), value=message(i)).result(timeout=10)
+        return True
+
+    try:
+        return run_concurrently(reserve, range(args.messages), args.concurrency)
+    finally:
+        producer.stop()
+
+
+def main():
+    args = parse_args()
+    report = {}
+    for name, mode in (('per_request', per_request), ('shared', shared)):
+        results, latencies, elapsed = mode(args)
+        report[name] = summarize(latencies, elapsed, delivered=sum(results))
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
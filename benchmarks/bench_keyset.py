@@ -0,0 +1,128 @@
+"""Page latency by depth for offset and cursor pagination of /admin/activity_logs.
+
+Seeds --logs activity logs over --vehicles vehicles and --lots lots into a fresh
+SQLite database, or into the empty database given as DATABASE_URI, then times
+the admin activity log list in-process at each of --depths pages deep, with
+pagination=offset (page=N, which counts and skips the rows before it) and with
+pagination=cursor (starting from the cursor the previous page would have
+returned). Each depth is timed --repeat times and the median is reported.
+
+Use Postgres for representative numbers. SQLite bounds the index range by the
+first upper bound in the WHERE clause, which is the route's time filter rather
+than the cursor, so deep cursor pages still scan there.
+
+Needs fakeredis on top of the backend requirements.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bench_backend_auth import prepare_backend
+from common import dump
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', type=int, default=1000000)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--size', type=int, default=50)
+    parser.add_argument('--depths', default='1,10,100,1000,10000', help='Comma separated page numbers')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def seed(args, session, models):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    session.add(models.User(id=1, username='admin', password='not-used', is_superuser=True, is_active=True,
+                            created_at=now))
+    session.flush()
+    session.execute(models.ParkingLot.__table__.insert(), [
+        {'id': i, 'name': f'Lot {i}', 'longitude': 105.85, 'latitude': 21.03, 'is_active': True, 'created_at': now}
+        for i in range(1, args.lots + 1)
+    ])
+    session.execute(models.Vehicle.__table__.insert(), [
+        {'id': i, 'license_plate': f'30A-{i:06d}', 'vehicle_type': 'car', 'owner_id': 1, 'is_tracked': False,
+         'created_at': now} for i in range(1, args.vehicles + 1)
+    ])
+    start = now - timedelta(days=365)
+    batch = []
+    for i in range(args.logs):
+        batch.append({'activity_type': rng.choice(('in', 'out')), 'vehicle_id': rng.randint(1, args.vehicles),
+                      'parking_lot_id': rng.randint(1, args.lots),
+                      'timestamp': start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))})
+        if len(batch) == 50000 or i == args.logs - 1:
+            session.execute(models.ActivityLog.__table__.insert(), batch)
+            batch = []
+    session.commit()
+
+
+def timed(client, params, headers, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get('/admin/activity_logs/', params=params, headers=headers)
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f'{params}: {response.status_code} {response.text[:200]}')
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def main():
+    args = parse_args()
+    prepare_backend(os.getenv('DATABASE_URI'))
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils.jwt import create_jwt_token
+    from app.utils.keyset import encode_cursor
+
+    start = time.perf_counter()
+    with SessionLocal() as session:
+        seed(args, session, models)
+    seeded = time.perf_counter()
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    token = create_jwt_token({'user_id': 1, 'is_superuser': True}, secret_key=os.environ['JWT_ACCESS_SECRET_KEY'],
+                             expiry={'minutes': 60})
+    headers = {'Authorization': f'Bearer {token}'}
+    keys = [models.ActivityLog.timestamp, models.ActivityLog.id]
+
+    depths = {}
+    with TestClient(app) as client, SessionLocal() as session:
+        for page in [int(depth) for depth in args.depths.split(',')]:
+            if (page - 1) * args.size >= args.logs:
+                continue
+            params = {'size': args.size}
+            if page > 1:
+                # The last row of the previous page, as its next_cursor would carry it
+                last = session.query(*keys).order_by(*[key.desc() for key in keys]) \
+                    .offset((page - 1) * args.size - 1).first()
+                params['cursor'] = encode_cursor(last, keys, True)
+            depths[page] = {
+                'offset_ms': timed(client, {'size': args.size, 'page': page}, headers, args.repeat),
+                'cursor_ms': timed(client, {**params, 'pagination': 'cursor'}, headers, args.repeat),
+            }
+
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'database': os.environ['DATABASE_URI'].split(':')[0],
+        'seed_seconds': round(seeded - start, 1),
+        'depths': depths,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
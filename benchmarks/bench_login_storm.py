@@ -0,0 +1,143 @@
+"""Login storm against the backend while cheap authenticated GETs keep running.
+
+The backend runs by uvicorn in a child process on SQLite and fakeredis, seeded
+with --users users sharing one bcrypt hash made with --seed-rounds. The parent
+fires --logins logins at --login-concurrency and, at the same time, --gets
+/users/me requests at --get-concurrency, and reports latency and status codes
+for both. It runs once with hashing inline in the request threads
+(PASSWORD_WORKERS=0, as before the password pool) and once with the pool, so
+the GET latency under the storm and the share of logins turned away with 503
+can be compared. A --seed-rounds different from --rounds makes every first
+login rehash.
+
+Needs fakeredis and uvicorn on top of the backend requirements.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+
+import httpx
+
+from bench_backend_auth import prepare_backend, wait_until_up
+from common import dump, run_concurrently, summarize
+
+PASSWORD = 'storm-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--login-concurrency', type=int, default=64)
+    parser.add_argument('--gets', type=int, default=2000)
+    parser.add_argument('--get-concurrency', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_ROUNDS of the app')
+    parser.add_argument('--seed-rounds', type=int, help='Cost of the seeded hashes, defaults to --rounds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, help='PASSWORD_MAX_PENDING, defaults to the app default')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def serve(args, workers, token_queue):
+    env = {'BCRYPT_ROUNDS': str(args.rounds), 'PASSWORD_WORKERS': str(workers)}
+    if args.max_pending is not None:
+        env['PASSWORD_MAX_PENDING'] = str(args.max_pending)
+    prepare_backend(**env)
+
+    from datetime import datetime
+
+    import fakeredis
+    import uvicorn
+    from passlib.context import CryptContext
+    from sqlalchemy import insert
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models.models import User
+    from app.utils.jwt import create_jwt_token
+
+    hashed = CryptContext(schemes=['bcrypt'], bcrypt__rounds=args.seed_rounds or args.rounds).hash(PASSWORD)
+    now = datetime.utcnow()
+    with SessionLocal() as session:
+        session.execute(insert(User), [{'id': i, 'username': f'user{i}', 'password': hashed, 'is_superuser': False,
+                                        'is_active': True, 'created_at': now} for i in range(1, args.users + 1)])
+        session.commit()
+    token_queue.put(create_jwt_token({'user_id': 1, 'is_superuser': False},
+                                     secret_key=os.environ['JWT_ACCESS_SECRET_KEY'], expiry={'minutes': 60}))
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+
+
+def statuses_of(results) -> dict:
+    counts = {}
+    for status in results:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return counts
+
+
+def run(args, workers) -> dict:
+    token_queue = multiprocessing.Queue()
+    # Not a daemon, the app starts its own password worker processes
+    server = multiprocessing.Process(target=serve, args=(args, workers, token_queue))
+    server.start()
+    try:
+        token = token_queue.get(timeout=600)
+        base_url = f'http://127.0.0.1:{args.port}'
+        wait_until_up(base_url, server)
+
+        rng = random.Random(args.seed)
+        logins = [f'user{rng.randint(1, args.users)}' for _ in range(args.logins)]
+        concurrency = args.login_concurrency + args.get_concurrency
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        with httpx.Client(base_url=base_url, limits=limits, timeout=120) as client:
+            def login(username):
+                try:
+                    return client.post('/login', data={'username': username, 'password': PASSWORD}).status_code
+                except httpx.HTTPError as e:
+                    return type(e).__name__
+
+            def get(_):
+                try:
+                    return client.get('/users/me', headers={'Authorization': f'Bearer {token}'}).status_code
+                except httpx.HTTPError as e:
+                    return type(e).__name__
+
+            # The GETs start with the storm and run alongside it
+            storm = {}
+            thread = threading.Thread(target=lambda: storm.update(
+                zip(('results', 'latencies', 'elapsed'), run_concurrently(login, logins, args.login_concurrency)))
+            )
+            thread.start()
+            get_results, get_latencies, get_elapsed = run_concurrently(get, range(args.gets), args.get_concurrency)
+            thread.join()
+            pool = client.get('/stats').json()['password_pool']
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        'login': summarize(storm['latencies'], storm['elapsed'], statuses=statuses_of(storm['results'])),
+        'get': summarize(get_latencies, get_elapsed, statuses=statuses_of(get_results)),
+        'password_pool': pool,
+    }
+
+
+def main():
+    args = parse_args()
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'inline': run(args, 0),
+        'pool': run(args, args.workers),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Fuzzy plate matching: lookup latency and precision/recall on noisy OCR reads.
+
+Registers --plates synthetic plates in the 29A-123.45 format, then queries a set
+of reads: registered plates with OCR-style noise (look-alike substitutions, a
+dropped or a doubled character) and plates that were never registered. A match
+is correct when it names the vehicle the read came from; reads of unregistered
+plates should not match at all.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+# The serving models create an engine on import, nothing here touches the database
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from serve_app.plates import PlateIndex  # noqa: E402
+
+from common import dump, summarize  # noqa: E402
+
+SERIES = 'ABCDEFGHKLMNPSTUVXYZ'
+LOOK_ALIKES = {'0': 'D', 'D': '0', '1': 'L', 'L': '1', '2': 'Z', 'Z': '2', '5': 'S', 'S': '5',
+               '8': 'B', 'B': '8', '6': 'G', 'G': '6', '4': 'A', 'A': '4', '7': 'T', 'T': '7'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plates', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20_000)
+    parser.add_argument('--unregistered', type=float, default=0.2, help='Share of reads of unregistered plates')
+    parser.add_argument('--max-edits', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def random_plate(rng):
+    return f'{rng.randint(10, 99)}{rng.choice(SERIES)}-{rng.randint(0, 999):03d}.{rng.randint(0, 99):02d}'
+
+
+def misread(rng, plate):
+    chars = list(plate.replace('-', '').replace('.', ''))
+    i = rng.randrange(len(chars))
+    noise = rng.random()
+    if noise < 0.7:
+        chars[i] = LOOK_ALIKES.get(chars[i], rng.choice(SERIES + '0123456789'))
+    elif noise < 0.85:
+        del chars[i]
+    else:
+        chars.insert(i, chars[i])
+    return ''.join(chars)
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    plates = {}
+    while len(plates) < args.plates:
+        plates.setdefault(random_plate(rng), len(plates) + 1)
+
+    index = PlateIndex(args.max_edits)
+    start = time.perf_counter()
+    index.load((vehicle_id, plate) for plate, vehicle_id in plates.items())
+    build_seconds = time.perf_counter() - start
+
+    registered = list(plates)
+    reads = []
+    for _ in range(args.queries):
+        if rng.random() < args.unregistered:
+            plate = random_plate(rng)
+            if plate not in plates:
+                reads.append((misread(rng, plate), None))
+                continue
+        plate = rng.choice(registered)
+        reads.append((misread(rng, plate), plates[plate]))
+
+    latencies = []
+    true_positives = false_positives = positives = 0
+    for read, expected in reads:
+        start = time.perf_counter()
+        match = index.match(read)
+        latencies.append(time.perf_counter() - start)
+        positives += expected is not None
+        if match is not None:
+            if match[0] == expected:
+                true_positives += 1
+            else:
+                false_positives += 1
+
+    matched = true_positives + false_positives
+    dump(summarize(
+        latencies, sum(latencies), plates=args.plates, max_edits=args.max_edits,
+        build_seconds=round(build_seconds, 1),
+        max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+        precision=round(true_positives / matched, 4) if matched else 0.0,
+        recall=round(true_positives / positives, 4) if positives else 0.0,
+    ), args.output)
+
+
+if __name__ == '__main__':
+    main()
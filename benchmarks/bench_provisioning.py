@@ -0,0 +1,129 @@
+"""Onboarding a lot: per-object POSTs against the bulk layout upload.
+
+Into a fresh SQLite database, or the empty database given as DATABASE_URI,
+creates --singles parking spaces with a sensor each through POST
+/parking_spaces/ and POST /device/sensors/, one request per object as before,
+and extrapolates the rate to --spaces. Then uploads a --spaces layout with
+--cameras cameras to POST /admin/parking_lots/{id}/layout in one request, for
+each of --formats, and reads back the streamed ids and api keys. Runs
+in-process.
+
+Needs fakeredis on top of the backend requirements.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import time
+
+from bench_backend_auth import prepare_backend
+from common import dump
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spaces', type=int, default=50000)
+    parser.add_argument('--cameras', type=int, default=20)
+    parser.add_argument('--singles', type=int, default=500, help='Spaces created one request at a time')
+    parser.add_argument('--formats', default='csv,json')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def layout_file(rows, layout_format) -> bytes:
+    if layout_format == 'json':
+        return json.dumps(rows).encode()
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def main():
+    args = parse_args()
+    prepare_backend(os.getenv('DATABASE_URI'))
+
+    from datetime import datetime
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils.jwt import create_jwt_token
+
+    formats = args.formats.split(',')
+    now = datetime.utcnow()
+    with SessionLocal() as session:
+        session.add(models.User(id=1, username='admin', password='not-used', is_superuser=True, is_active=True,
+                                created_at=now))
+        session.flush()
+        session.execute(models.ParkingLot.__table__.insert(), [
+            {'id': i, 'name': f'Lot {i}', 'longitude': 105.85, 'latitude': 21.03, 'is_active': True,
+             'created_at': now} for i in range(1, len(formats) + 2)
+        ])
+        session.commit()
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    token = create_jwt_token({'user_id': 1, 'is_superuser': True}, secret_key=os.environ['JWT_ACCESS_SECRET_KEY'],
+                             expiry={'minutes': 60})
+    headers = {'Authorization': f'Bearer {token}'}
+    rng = random.Random(args.seed)
+    rows = [{'longitude': round(105.85 + rng.random() / 100, 6), 'latitude': round(21.03 + rng.random() / 100, 6),
+             'vehicle_type': rng.choice(('car', 'motorbike', 'truck'))} for _ in range(args.spaces)]
+
+    results = {}
+    with TestClient(app) as client:
+        start = time.perf_counter()
+        for row in rows[:args.singles]:
+            response = client.post('/parking_spaces/', json={**row, 'longitude': int(row['longitude']),
+                                                             'latitude': int(row['latitude']),
+                                                             'parking_lot_id': 1}, headers=headers)
+            if response.status_code != 201:
+                raise SystemExit(f'single space: {response.status_code} {response.text[:200]}')
+            response = client.post('/device/sensors/', json={'parking_space_id': response.json()['id']},
+                                   headers=headers)
+            if response.status_code != 201:
+                raise SystemExit(f'single sensor: {response.status_code} {response.text[:200]}')
+        elapsed = time.perf_counter() - start
+        results['singles'] = {
+            'spaces': args.singles,
+            'seconds': round(elapsed, 2),
+            'spaces_per_second': round(args.singles / elapsed),
+            'extrapolated_seconds': round(elapsed / args.singles * args.spaces, 1),
+        }
+
+        for lot_id, layout_format in enumerate(formats, start=2):
+            content = layout_file(rows, layout_format)
+            start = time.perf_counter()
+            response = client.post(f'/admin/parking_lots/{lot_id}/layout', params={'cameras': args.cameras},
+                                   files={'layout': (f'layout.{layout_format}', content)}, headers=headers)
+            if response.status_code != 201:
+                raise SystemExit(f'{layout_format}: {response.status_code} {response.text[:200]}')
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            elapsed = time.perf_counter() - start
+            results[layout_format] = {
+                'spaces': sum('parking_space_id' in line for line in lines),
+                'sensors': sum(line.get('sensor_id') is not None for line in lines),
+                'cameras': sum('camera_id' in line for line in lines),
+                'seconds': round(elapsed, 2),
+                'spaces_per_second': round(args.spaces / elapsed),
+                'megabytes_uploaded': round(len(content) / 2 ** 20, 1),
+            }
+
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'database': os.environ['DATABASE_URI'].split(':')[0],
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Requests/sec of a Redis-touching endpoint: per-request client vs the shared pool.
+
+Both routes do what the backend's token check does, one GET on a revocation key.
+The per-request route mirrors the old dependency (new client, close afterwards);
+the pooled route uses serve_app.redis. Needs a reachable Redis at --host/--port.
+"""
+import argparse
+import os
+import sys
+
+import redis
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+
+from common import dump, run_concurrently, summarize  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def build_app(args):
+    os.environ.setdefault('REDIS_HOST', args.host)
+    os.environ.setdefault('REDIS_PORT', str(args.port))
+    from serve_app.redis import get_redis, redis_pool
+
+    def get_redis_per_request():
+        r = redis.Redis(host=args.host, port=args.port)
+        try:
+            yield r
+        finally:
+            r.close()
+
+    app = FastAPI()
+
+    @app.get('/per_request/{token}')
+    def per_request(token: str, r: redis.Redis = Depends(get_redis_per_request)):
+        return {'revoked': r.get(f'blacklist:{token}') is not None}
+
+    @app.get('/pooled/{token}')
+    def pooled(token: str, r: redis.Redis = Depends(get_redis)):
+        return {'revoked': r.get(f'blacklist:{token}') is not None}
+
+    return app, redis_pool
+
+
+def main():
+    args = parse_args()
+    app, redis_pool = build_app(args)
+    report = {}
+    with TestClient(app) as client:
+        for name in ('per_request', 'pooled'):
+            results, latencies, elapsed = run_concurrently(
+                lambda i: client.get(f'/{name}/{i}').status_code == 200, range(args.requests), args.concurrency)
+            report[name] = summarize(latencies, elapsed, ok=sum(results))
+    report['pooled']['redis_pool'] = redis_pool.stats()
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
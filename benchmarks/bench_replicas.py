@@ -0,0 +1,176 @@
+"""Read-replica routing of the backend: where reads go, read-your-writes and failover.
+
+Needs two Postgres servers, the empty database given as DATABASE_URI on the
+primary and the same database on a streaming replica of it given as
+DATABASE_REPLICA_URIS (docker-compose.replica.yml sets one up). Seeds the
+primary as bench_keyset.py does, then in-process:
+
+- reads: --requests vehicle list requests with the replica taking reads, and
+  with every read on the primary, reporting latency and where the reads went.
+- read_your_writes: with the replica applying WAL --lag-ms late (set through
+  recovery_min_apply_delay), registers --writes vehicles and lists each right
+  after, with the read-your-writes window on and then off, counting the lists
+  that miss the vehicle just registered.
+- failover, if --stop-replica and --start-replica commands are given: stops
+  the replica while list requests keep coming, starts it again, and reports
+  failed requests, where reads went meanwhile and how long until the replica
+  took reads again.
+
+Needs fakeredis on top of the backend requirements.
+"""
+import argparse
+import os
+import subprocess
+import time
+
+from bench_backend_auth import prepare_backend
+from bench_keyset import seed
+from common import dump, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', type=int, default=10000)
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--writes', type=int, default=50)
+    parser.add_argument('--lag-ms', type=int, default=300)
+    parser.add_argument('--stop-replica', help='Shell command that stops the replica')
+    parser.add_argument('--start-replica', help='Shell command that starts it again')
+    parser.add_argument('--check-seconds', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def routed(db_read_routes) -> dict:
+    # Counter totals by engine and reason
+    return {f"{sample.labels['engine']}/{sample.labels['reason']}": sample.value
+            for metric in db_read_routes.collect() for sample in metric.samples if sample.name.endswith('_total')}
+
+
+def delta(before: dict, after: dict) -> dict:
+    return {key: int(value - before.get(key, 0)) for key, value in after.items() if value - before.get(key, 0)}
+
+
+def set_apply_delay(engine, delay_ms: int):
+    from sqlalchemy import text
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f"ALTER SYSTEM SET recovery_min_apply_delay = '{delay_ms}ms'"))
+        connection.execute(text('SELECT pg_reload_conf()'))
+
+
+def main():
+    args = parse_args()
+    if not os.getenv('DATABASE_URI') or not os.getenv('DATABASE_REPLICA_URIS'):
+        raise SystemExit('Set DATABASE_URI to the primary and DATABASE_REPLICA_URIS to its replica')
+    prepare_backend(os.getenv('DATABASE_URI'), REPLICA_CHECK_SECONDS=str(args.check_seconds))
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+
+    from app.dependencies.db_connection import SessionLocal, replica_engines, replica_router
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils import replicas
+    from app.utils.jwt import create_jwt_token
+    from app.utils.metrics import db_read_routes
+
+    with SessionLocal() as session:
+        seed(args, session, models)
+        for table in ('users', 'parking_lots', 'vehicles'):
+            session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), max(id)) FROM {table}"))
+        session.commit()
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    replica_router.redis_client = redis_client
+    token = create_jwt_token({'user_id': 1, 'is_superuser': True}, secret_key=os.environ['JWT_ACCESS_SECRET_KEY'],
+                             expiry={'minutes': 60})
+    headers = {'Authorization': f'Bearer {token}'}
+    replica_engine = next(iter(replica_engines.values()))
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'output'}}
+
+    def list_vehicles(client, params=None):
+        start = time.perf_counter()
+        response = client.get('/vehicles/', params=params or {'size': 50}, headers=headers)
+        return response, time.perf_counter() - start
+
+    with TestClient(app) as client:
+        # Wait for the seed to reach the replica
+        deadline = time.monotonic() + 30
+        while list_vehicles(client)[0].status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+        reads = {}
+        for mode in ('replica', 'primary'):
+            engines = dict(replica_router.engines)
+            if mode == 'primary':
+                replica_router.engines, replica_router.healthy = {}, []
+            before = routed(db_read_routes)
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                response, elapsed = list_vehicles(client)
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    raise SystemExit(f'list: {response.status_code} {response.text[:200]}')
+            reads[mode] = summarize(latencies, time.perf_counter() - started,
+                                    routed=delta(before, routed(db_read_routes)))
+            replica_router.engines = engines
+            replica_router.check()
+        report['reads'] = reads
+
+        set_apply_delay(replica_engine, args.lag_ms)
+        window = replicas.READ_YOUR_WRITES_SECONDS
+        read_your_writes = {}
+        try:
+            for mode, seconds in (('on', window), ('off', 0)):
+                replicas.READ_YOUR_WRITES_SECONDS = seconds
+                redis_client.flushall()
+                before = routed(db_read_routes)
+                missed = 0
+                for i in range(args.writes):
+                    plate = f'RYW-{mode}-{i:05d}'
+                    response = client.post('/vehicles/', json={'license_plate': plate, 'vehicle_type': 'car'},
+                                           headers=headers)
+                    if response.status_code != 201:
+                        raise SystemExit(f'create: {response.status_code} {response.text[:200]}')
+                    response, _ = list_vehicles(client, {'license_plate': plate})
+                    missed += response.status_code != 200 or not response.json()['items']
+                read_your_writes[mode] = {'window_seconds': seconds, 'writes': args.writes, 'missed_own_write': missed,
+                                          'routed': delta(before, routed(db_read_routes))}
+        finally:
+            replicas.READ_YOUR_WRITES_SECONDS = window
+            set_apply_delay(replica_engine, 0)
+        report['read_your_writes'] = read_your_writes
+
+        if args.stop_replica and args.start_replica:
+            redis_client.flushall()
+            before = routed(db_read_routes)
+            subprocess.run(args.stop_replica, shell=True, check=True, capture_output=True)
+            failed = 0
+            outage_until = time.monotonic() + 5 * args.check_seconds
+            while time.monotonic() < outage_until:
+                failed += list_vehicles(client)[0].status_code != 200
+            down = delta(before, routed(db_read_routes))
+            subprocess.run(args.start_replica, shell=True, check=True, capture_output=True)
+            restarted = time.monotonic()
+            before = routed(db_read_routes)
+            while time.monotonic() - restarted < 60:
+                failed += list_vehicles(client)[0].status_code != 200
+                if any(key.startswith('replica') for key in delta(before, routed(db_read_routes))):
+                    break
+            report['failover'] = {'failed_requests': failed, 'routed_while_down': down,
+                                  'seconds_to_replica_reads': round(time.monotonic() - restarted, 2)}
+        report['replicas'] = replica_router.stats()
+
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Reservation expiry at scale: tracking, cancelling and expiring with a fake clock.
+
+Tracks --reservations spaces with deadlines spread over the TTL, cancels a share
+of them as if sensors confirmed occupancy, then advances the clock in one-second
+ticks past the TTL. Reports per-operation latency, CPU time per tick and checks
+that exactly the unconfirmed reservations were released. Needs a Redis at
+--host/--port; the sorted set key is cleared first.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import Future
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+# The serving models create an engine on import, nothing here touches the database
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from serve_app.reservations import DEADLINES_KEY, ReservationExpiry  # noqa: E402
+
+from common import dump, summarize  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--reservations', type=int, default=300_000)
+    parser.add_argument('--confirmed', type=float, default=0.8, help='Share of reservations confirmed by a sensor')
+    parser.add_argument('--ttl', type=float, default=900)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+class Producer:
+    def __init__(self):
+        self.released = set()
+
+    def produce(self, topic, key, value):
+        self.released.add(int(key))
+        delivery = Future()
+        delivery.set_result(None)
+        return delivery
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    redis_client = redis.Redis(host=args.host, port=args.port)
+    redis_client.delete(DEADLINES_KEY)
+    producer = Producer()
+    expiry = ReservationExpiry(redis_client, producer, ttl=args.ttl, clock=lambda: 0.0)
+
+    track_latencies = []
+    for parking_space_id in range(args.reservations):
+        start = time.perf_counter()
+        expiry.track(parking_space_id, now=rng.uniform(0, args.ttl))
+        track_latencies.append(time.perf_counter() - start)
+
+    confirmed = set(rng.sample(range(args.reservations), int(args.reservations * args.confirmed)))
+    cancel_latencies = []
+    for parking_space_id in confirmed:
+        start = time.perf_counter()
+        expiry.cancel(parking_space_id)
+        cancel_latencies.append(time.perf_counter() - start)
+
+    restored = ReservationExpiry(redis_client, producer, ttl=args.ttl)
+    start = time.perf_counter()
+    restored.load()
+    load_seconds = time.perf_counter() - start
+
+    tick_cpu = []
+    for now in range(int(args.ttl), int(2 * args.ttl) + 2):
+        start = time.process_time()
+        restored.tick(now=now)
+        tick_cpu.append(time.process_time() - start)
+
+    expected = set(range(args.reservations)) - confirmed
+    dump({
+        'track': summarize(track_latencies, sum(track_latencies)),
+        'cancel': summarize(cancel_latencies, sum(cancel_latencies)),
+        'tick_cpu': summarize(tick_cpu, sum(tick_cpu)),
+        'load_ms': round(load_seconds * 1000, 1),
+        'released': len(producer.released),
+        'released_matches_unconfirmed': producer.released == expected,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
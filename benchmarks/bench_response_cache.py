@@ -0,0 +1,192 @@
+"""Response cache of the backend's parking lot, rating feedback and parking space GETs.
+
+Seeds --lots lots with --feedbacks rating feedbacks each and --spaces parking
+spaces into the empty Postgres database given as DATABASE_URI (the rating
+writes upsert the aggregate, which SQLite cannot run), then in-process:
+
+- reads: --requests GETs of the three cached routes, ids drawn with a skew
+  towards the first lots, with the cache on and then off, reporting latency,
+  hit ratio, DB time saved and the SQL statements the requests ran.
+- stampede: --concurrency concurrent requests for one rating feedback page
+  that is not cached, reporting how many of them computed it.
+- invalidation: --writes times, reads a lot and its feedback page, renames the
+  lot and adds a feedback, and reads both again, counting reads that still
+  show the data from before the write.
+
+Needs fakeredis on top of the backend requirements.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime
+
+from bench_backend_auth import prepare_backend
+from common import dump, run_concurrently, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--feedbacks', type=int, default=200, help='Per lot')
+    parser.add_argument('--spaces', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--writes', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def seed(args, session, models):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    session.add_all([
+        models.User(id=1, username='admin', password='not-used', is_superuser=True, is_active=True, created_at=now),
+        models.User(id=2, username='driver', password='not-used', is_superuser=False, is_active=True, created_at=now),
+    ])
+    session.flush()
+    session.execute(models.ParkingLot.__table__.insert(), [
+        {'id': i, 'name': f'Lot {i}', 'longitude': 105.85, 'latitude': 21.03, 'is_active': True, 'created_at': now}
+        for i in range(1, args.lots + 1)
+    ])
+    session.execute(models.RatingFeedback.__table__.insert(), [
+        {'user_id': 2, 'parking_lot_id': lot, 'rating': rng.randint(1, 5), 'feedback': f'Feedback {i}',
+         'is_active': True, 'created_at': now}
+        for lot in range(1, args.lots + 1) for i in range(args.feedbacks)
+    ])
+    session.execute(models.ParkingSpace.__table__.insert(), [
+        {'id': i, 'longitude': 105.85, 'latitude': 21.03, 'vehicle_type': 'car', 'state': 'free', 'is_active': True,
+         'parking_lot_id': rng.randint(1, args.lots), 'created_at': now}
+        for i in range(1, args.spaces + 1)
+    ])
+    session.commit()
+
+
+def skewed(rng, count: int) -> int:
+    # Most reads go to a few popular ids
+    return min(count, int(rng.paretovariate(1.2)))
+
+
+def main():
+    args = parse_args()
+    if not os.getenv('DATABASE_URI'):
+        raise SystemExit('Set DATABASE_URI to an empty Postgres database')
+    prepare_backend(os.getenv('DATABASE_URI'))
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, text
+
+    from app.dependencies.db_connection import SessionLocal, engine, replica_router
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils import response_cache
+    from app.utils.jwt import create_jwt_token
+
+    with SessionLocal() as session:
+        seed(args, session, models)
+        for table in ('users', 'parking_lots', 'rating_feedbacks', 'parking_spaces'):
+            session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), max(id)) FROM {table}"))
+        session.commit()
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    replica_router.redis_client = redis_client
+    cache = response_cache.response_cache
+    cache.redis_client = redis_client
+    statements = {'count': 0}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(*_):
+        statements['count'] += 1
+
+    headers = {}
+    for user_id, is_superuser in ((1, True), (2, False)):
+        token = create_jwt_token({'user_id': user_id, 'is_superuser': is_superuser},
+                                 secret_key=os.environ['JWT_ACCESS_SECRET_KEY'], expiry={'minutes': 60})
+        headers[user_id] = {'Authorization': f'Bearer {token}'}
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'output'}}
+
+    def reset():
+        redis_client.flushall()
+        cache.l1.clear()
+        cache.routes.clear()
+
+    with TestClient(app) as client:
+        # Fills the user cache, hits are only served to users in it
+        for user_id in headers:
+            client.get('/users/me', headers=headers[user_id])
+
+        def request(job):
+            path, user_id = job
+            response = client.get(path, headers=headers[user_id])
+            if response.status_code != 200:
+                raise SystemExit(f'{path}: {response.status_code} {response.text[:200]}')
+            return response.headers.get('x-cache')
+
+        rng = random.Random(args.seed)
+        jobs = []
+        for _ in range(args.requests):
+            route = rng.random()
+            if route < 0.4:
+                path = f'/parking-lots/{skewed(rng, args.lots)}'
+            elif route < 0.7:
+                path = f'/parking-lots/{skewed(rng, args.lots)}/rating-feedbacks/?size=20'
+            else:
+                path = f'/parking_spaces/{skewed(rng, args.spaces)}'
+            jobs.append((path, rng.choice((1, 2, 2, 2))))
+
+        reads = {}
+        enabled = response_cache.RESPONSE_CACHE_ENABLED
+        try:
+            for mode in ('on', 'off'):
+                response_cache.RESPONSE_CACHE_ENABLED = mode == 'on'
+                reset()
+                statements['count'] = 0
+                latencies = []
+                started = time.perf_counter()
+                for job in jobs:
+                    start = time.perf_counter()
+                    request(job)
+                    latencies.append(time.perf_counter() - start)
+                reads[mode] = summarize(latencies, time.perf_counter() - started, statements=statements['count'],
+                                        cache=cache.stats()['routes'])
+        finally:
+            response_cache.RESPONSE_CACHE_ENABLED = enabled
+        report['reads'] = reads
+
+        reset()
+        statements['count'] = 0
+        path = '/parking-lots/1/rating-feedbacks/?size=50'
+        results, latencies, elapsed = run_concurrently(request, [(path, 2)] * args.concurrency, args.concurrency)
+        report['stampede'] = summarize(latencies, elapsed, statements=statements['count'],
+                                       x_cache={value: results.count(value) for value in set(results)},
+                                       cache=cache.stats()['routes'])
+
+        reset()
+        stale = {'parking_lot': 0, 'rating_feedbacks': 0}
+        lot = skewed(rng, args.lots)
+        for i in range(args.writes):
+            client.get(f'/parking-lots/{lot}', headers=headers[2])
+            client.get(f'/parking-lots/{lot}/rating-feedbacks/?size=5', headers=headers[2])
+            name = f'Lot {lot} renamed {i}'
+            response = client.put(f'/parking-lots/{lot}', json={'name': name}, headers=headers[1])
+            if response.status_code != 200:
+                raise SystemExit(f'update: {response.status_code} {response.text[:200]}')
+            feedback = f'Written {i}'
+            response = client.post(f'/parking-lots/{lot}/rating-feedbacks/', json={'rating': 5, 'feedback': feedback},
+                                    headers=headers[2])
+            if response.status_code != 201:
+                raise SystemExit(f'create: {response.status_code} {response.text[:200]}')
+            stale['parking_lot'] += client.get(f'/parking-lots/{lot}', headers=headers[2]).json()['name'] != name
+            items = client.get(f'/parking-lots/{lot}/rating-feedbacks/?size=5', headers=headers[2]).json()['items']
+            stale['rating_feedbacks'] += not any(item['feedback'] == feedback for item in items)
+        report['invalidation'] = {'writes': args.writes, 'stale_reads': stale, 'cache': cache.stats()['routes']}
+
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
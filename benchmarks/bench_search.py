@@ -0,0 +1,167 @@
+"""Typeahead latency of /search/vehicles by kind of query, against the old ilike filter.
+
+Seeds --vehicles vehicles into the empty Postgres database given as
+DATABASE_URI, generated by the database itself, with the search indexes dropped
+during the load and rebuilt after it (the build time and sizes are reported).
+Without DATABASE_URI a fresh SQLite database is seeded from Python, where only
+prefix and substring matching exist and nothing is indexed for them. Then, for
+--queries plates picked at random, times the endpoint in-process for a prefix
+typed so far, a fragment from the middle of the plate and the whole plate with
+one character wrong, and times the ilike('prefix%') filter the vehicle list
+used before, as a plain query. The trigram stages run under the backend's
+SEARCH_TIMEOUT_MS, set it in the environment to compare budgets.
+
+Needs fakeredis on top of the backend requirements, and Postgres with pg_trgm
+(in contrib) for the trigram stages.
+"""
+import argparse
+import os
+import random
+import time
+
+from bench_backend_auth import prepare_backend
+from common import dump, summarize
+
+PLATE_LETTERS = 'ABCDEFGHKLMNPSTUVXYZ'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vehicles', type=int, default=10000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def plate(i: int) -> str:
+    # Province code, series letter and a serial, distinct for every i
+    return f'{10 + i % 90}{PLATE_LETTERS[i // 90 % 20]}-{i // 1800:06d}'
+
+
+def seed(args, session, models):
+    from sqlalchemy import text
+
+    users = [{'id': i, 'username': f'user{i}', 'password': 'not-used', 'is_superuser': i == 1, 'is_active': True}
+             for i in range(1, args.users + 1)]
+    session.execute(models.User.__table__.insert(), users)
+    if session.bind.dialect.name != 'postgresql':
+        for start in range(0, args.vehicles, 50000):
+            session.execute(models.Vehicle.__table__.insert(), [
+                {'license_plate': plate(i), 'vehicle_type': 'car', 'owner_id': i % args.users + 1, 'is_tracked': False}
+                for i in range(start, min(start + 50000, args.vehicles))
+            ])
+        session.commit()
+        return
+    session.execute(text(f"""
+        INSERT INTO vehicles (license_plate, vehicle_type, owner_id, is_tracked)
+        SELECT (10 + i % 90)::text || substr('{PLATE_LETTERS}', (i / 90 % 20)::int + 1, 1) || '-' ||
+               lpad((i / 1800)::text, 6, '0'), 'car', i % :users + 1, false
+        FROM generate_series(0, :count - 1) AS i
+    """), {'users': args.users, 'count': args.vehicles})
+    session.commit()
+
+
+def typo(value: str, rng: random.Random) -> str:
+    position = rng.randrange(len(value))
+    replacement = rng.choice([c for c in '0123456789' + PLATE_LETTERS if c != value[position]])
+    return value[:position] + replacement + value[position + 1:]
+
+
+def main():
+    args = parse_args()
+    prepare_backend(os.getenv('DATABASE_URI'))
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+
+    from app.dependencies.db_connection import SessionLocal, engine
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils.jwt import create_jwt_token
+    from app.utils.search import prefix_filter
+
+    postgres = engine.dialect.name == 'postgresql'
+    search_indexes = [index for table in (models.User.__table__, models.Vehicle.__table__) for index in table.indexes
+                      if index.name.endswith(('_lower', '_trgm'))]
+    report = {'database': engine.dialect.name, 'config': {key: value for key, value in vars(args).items()
+                                                          if key != 'output'}}
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        for index in search_indexes if postgres else ():
+            index.drop(connection)
+    with SessionLocal() as session:
+        seed(args, session, models)
+    report['seed_seconds'] = round(time.perf_counter() - start, 1)
+    if postgres:
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            for index in search_indexes:
+                index.create(connection)
+            connection.execute(text('ANALYZE users'))
+            connection.execute(text('ANALYZE vehicles'))
+            report['index_mb'] = {name: round(size / 2 ** 20, 1) for name, size in connection.execute(text(
+                "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+                "WHERE relname = 'vehicles'")).all()}
+        report['index_seconds'] = round(time.perf_counter() - start, 1)
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    token = create_jwt_token({'user_id': 1, 'is_superuser': True}, secret_key=os.environ['JWT_ACCESS_SECRET_KEY'],
+                             expiry={'minutes': 60})
+    headers = {'Authorization': f'Bearer {token}'}
+    rng = random.Random(args.seed)
+    plates = [plate(rng.randrange(args.vehicles)) for _ in range(args.queries)]
+    queries = {
+        'prefix_2': [value[:2] for value in plates],
+        'prefix_4': [value[:4] for value in plates],
+        'prefix_7': [value[:7] for value in plates],
+        'fragment_5': [value[-6:-1] for value in plates],
+        'typo': [typo(value, rng) for value in plates],
+    }
+
+    kinds = {}
+    with TestClient(app) as client:
+        client.get('/search/vehicles', params={'q': plates[0]}, headers=headers)
+        for kind, terms in queries.items():
+            latencies, matches = [], {}
+            started = time.perf_counter()
+            for term in terms:
+                start = time.perf_counter()
+                response = client.get('/search/vehicles', params={'q': term, 'limit': args.limit}, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise SystemExit(f'{term}: {response.status_code} {response.text[:200]}')
+                for hit in response.json():
+                    matches[hit['match']] = matches.get(hit['match'], 0) + 1
+            kinds[kind] = summarize(latencies, time.perf_counter() - started, matches=matches)
+        found = 0
+        for value, term in zip(plates, queries['typo']):
+            hits = client.get('/search/vehicles', params={'q': term, 'limit': args.limit}, headers=headers).json()
+            found += value in [hit['text'] for hit in hits]
+        report['typo_recall'] = round(found / len(plates), 3)
+
+    # The vehicle list's plate filter before and after, as its page and count queries, on a sample as the
+    # old one scans
+    with SessionLocal() as session:
+        for kind, condition in (('list_ilike_prefix_4', lambda term: models.Vehicle.license_plate.ilike(f'{term}%')),
+                                ('list_prefix_filter_4', lambda term: prefix_filter(models.Vehicle.license_plate,
+                                                                                     term))):
+            latencies = []
+            for term in queries['prefix_4'][:20]:
+                start = time.perf_counter()
+                query = session.query(models.Vehicle).filter(condition(term.lower()))
+                query.limit(args.limit).all()
+                query.count()
+                latencies.append(time.perf_counter() - start)
+            kinds[kind] = summarize(latencies, sum(latencies))
+    report['kinds'] = kinds
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Load test comparing the sync and async serving apps at 1k concurrent devices.
+
+Start both apps against the same database, e.g.
+    uvicorn serve_app.main:app --port 8001
+    uvicorn serve_app.async_main:app --port 8002
+then each simulated device keeps one connection open and polls /sensors with a
+sensor API key, as the parking sensors do, for --requests-per-device rounds.
+Every --ingest-every rounds it posts a batch of --ingest-batch sensor events to
+/ingest instead, latencies are reported per path.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from common import dump, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sync-url', default='http://localhost:8001')
+    parser.add_argument('--async-url', default='http://localhost:8002')
+    parser.add_argument('--api-key', required=True, help='API key of an active sensor')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--requests-per-device', type=int, default=20)
+    parser.add_argument('--path', default='/sensors')
+    parser.add_argument('--ingest-every', type=int, default=5, help='0 disables the /ingest requests')
+    parser.add_argument('--ingest-batch', type=int, default=10)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def ingest_batch(args) -> list:
+    # Fresh idempotency keys so every batch is processed rather than replayed
+    return [{'idempotency_key': uuid.uuid4().hex, 'api_key': args.api_key, 'type': 'sensor'}
+            for _ in range(args.ingest_batch)]
+
+
+async def device(base_url, args, latencies, statuses):
+    async with httpx.AsyncClient(base_url=base_url, headers={'X-API-Key': args.api_key}, timeout=30) as client:
+        for i in range(args.requests_per_device):
+            path = '/ingest' if args.ingest_every and i % args.ingest_every == args.ingest_every - 1 else args.path
+            start = time.perf_counter()
+            try:
+                if path == '/ingest':
+                    status = (await client.post(path, json=ingest_batch(args))).status_code
+                else:
+                    status = (await client.get(path)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[path].append(time.perf_counter() - start)
+            statuses[path][status] = statuses[path].get(status, 0) + 1
+
+
+async def run(base_url, args):
+    paths = (args.path, '/ingest') if args.ingest_every else (args.path,)
+    latencies, statuses = {path: [] for path in paths}, {path: {} for path in paths}
+    start = time.perf_counter()
+    await asyncio.gather(*(device(base_url, args, latencies, statuses) for _ in range(args.devices)))
+    elapsed = time.perf_counter() - start
+    return {path: summarize(latencies[path], elapsed, devices=args.devices,
+                            statuses={str(k): v for k, v in statuses[path].items()})
+            for path in paths}
+
+
+def main():
+    args = parse_args()
+    report = {}
+    for name, base_url in (('sync', args.sync_url), ('async', args.async_url)):
+        report[name] = asyncio.run(run(base_url, args))
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
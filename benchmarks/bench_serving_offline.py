@@ -0,0 +1,318 @@
+"""Offline load test of serve_app.main with local stand-ins for the compose stack.
+
+The app is served by uvicorn in a child process on a fresh SQLite database,
+fakeredis and a Kafka producer double. The double acknowledges every message
+after --kafka-latency-ms and hands space state messages back to the listener
+handlers, as the stream job and the parking_space_state topic would. Set
+DATABASE_URI to an empty throwaway database, e.g. a local Postgres, to use it
+instead of SQLite; it is seeded the same way.
+
+The child seeds --lots lots with --spaces-per-lot spaces, a sensor per space,
+cameras, --vehicles vehicles and hourly vehicle counts, then the parent drives
+a weighted mix of endpoints at --concurrency and reports p50/p95/p99 and RPS
+per endpoint. Pass --compare with an earlier report to add the relative change.
+
+Needs fakeredis and uvicorn on top of the serving requirements.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+
+import httpx
+from sqlalchemy import UUID, insert
+from sqlalchemy.ext.compiler import compiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{tempfile.mkdtemp(prefix="bench-serving-")}/serving.db')
+
+from serve_app import db  # noqa: E402
+from serve_app.allocation import SPACE_STATE_TOPIC  # noqa: E402
+from serve_app.kafka import SpaceStateEvent  # noqa: E402
+from serve_app.models import Camera, ParkingLot, ParkingSpace, Sensor, Vehicle  # noqa: E402
+from serve_app.vehicle_counts import VEHICLE_TYPES as COUNTED_TYPES, hourly_key, hours_back  # noqa: E402
+
+from common import dump, run_concurrently, summarize  # noqa: E402
+
+VEHICLE_TYPES = (('car', 0.6), ('motorbike', 0.35), ('truck', 0.05))
+DEFAULT_MIX = 'parking_lots=30,recommend=25,sensors=25,vehicles=10,validate_in=10'
+PLATE_SERIES = 'ABCDEFGHKLMNPSTUVXYZ'
+CENTER = (105.85, 21.03)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spaces-per-lot', type=int, default=500)
+    parser.add_argument('--occupancy', type=float, default=0.5, help='Share of spaces seeded as occupied')
+    parser.add_argument('--vehicles', type=int, default=20000)
+    parser.add_argument('--cameras-per-lot', type=int, default=2)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Comma separated endpoint=weight pairs')
+    parser.add_argument('--kafka-latency-ms', type=float, default=5)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--compare', help='Earlier report to compare against')
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for pair in mix.split(','):
+        name, _, weight = pair.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise SystemExit(f'Unknown endpoint {name!r}, expected one of {", ".join(ENDPOINTS)}')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def random_plate(rng):
+    return f'{rng.randint(10, 99)}{rng.choice(PLATE_SERIES)}-{rng.randint(0, 999):03d}.{rng.randint(0, 99):02d}'
+
+
+def random_vehicle_type(rng):
+    return rng.choices([name for name, _ in VEHICLE_TYPES], [weight for _, weight in VEHICLE_TYPES])[0]
+
+
+class LoopbackProducer:
+    def __init__(self, latency: float, handlers: list):
+        self.latency = latency
+        self.handlers = handlers
+        self.produced = 0
+
+    def produce(self, topic, key, value) -> Future:
+        delivery = Future()
+        self.produced += 1
+
+        def deliver():
+            delivery.set_result(None)
+            if topic != SPACE_STATE_TOPIC:
+                return
+            message = json.loads(value)
+            event = SpaceStateEvent(int(key), message['state'], message['vehicle_id'], message['updated_at'])
+            for handler in self.handlers:
+                handler(event)
+
+        if self.latency:
+            threading.Timer(self.latency, deliver).start()
+        else:
+            deliver()
+        return delivery
+
+
+@compiles(UUID, 'sqlite')
+def compile_uuid(type_, compiler, **kw):
+    return 'CHAR(32)'
+
+
+def create_schema():
+    if db.engine.dialect.name == 'sqlite':
+        # Postgres function defaults like now() do not exist in SQLite, the seed sets the columns it needs
+        for table in db.Base.metadata.tables.values():
+            for column in table.columns:
+                if column.server_default is not None and '(' in str(column.server_default.arg):
+                    column.server_default = None
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+    db.Base.metadata.create_all(db.engine)
+
+
+def seed(args, redis_client) -> dict:
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    lots, spaces, sensors, cameras = [], [], [], []
+    for lot_id in range(1, args.lots + 1):
+        x, y = CENTER[0] + rng.uniform(-0.1, 0.1), CENTER[1] + rng.uniform(-0.1, 0.1)
+        lots.append({'id': lot_id, 'name': f'Lot {lot_id}', 'longitude': x, 'latitude': y,
+                     'created_at': now, 'is_active': True})
+        for _ in range(args.spaces_per_lot):
+            space_id = len(spaces) + 1
+            spaces.append({'id': space_id, 'parking_lot_id': lot_id, 'vehicle_type': random_vehicle_type(rng),
+                           'longitude': x + rng.uniform(-0.001, 0.001), 'latitude': y + rng.uniform(-0.001, 0.001),
+                           'state': 'occupied' if rng.random() < args.occupancy else 'free',
+                           'created_at': now, 'is_active': True})
+            sensors.append({'id': uuid.uuid4(), 'api_key': f'sensor-{space_id}', 'parking_space_id': space_id,
+                            'created_at': now, 'is_active': True})
+        for i in range(args.cameras_per_lot):
+            cameras.append({'id': uuid.uuid4(), 'api_key': f'camera-{lot_id}-{i}', 'parking_lot_id': lot_id,
+                            'created_at': now, 'is_active': True})
+    plates = set()
+    while len(plates) < args.vehicles:
+        plates.add(random_plate(rng))
+    vehicles = [{'id': i, 'license_plate': plate, 'vehicle_type': random_vehicle_type(rng), 'owner_id': i,
+                 'created_at': now} for i, plate in enumerate(sorted(plates), 1)]
+
+    with db.SessionLocal() as session:
+        for model, rows in ((ParkingLot, lots), (ParkingSpace, spaces), (Sensor, sensors), (Camera, cameras),
+                            (Vehicle, vehicles)):
+            if rows:
+                session.execute(insert(model), rows)
+        session.commit()
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for hour in hours_back(int(time.time()), 48):
+        for parking_lot_id in [None] + [lot['id'] for lot in lots]:
+            pipeline.hset(hourly_key(hour, parking_lot_id),
+                          mapping={vehicle_type: rng.randint(0, 200) for vehicle_type in COUNTED_TYPES})
+    pipeline.execute()
+
+    return {
+        'lots': [(lot['id'], lot['longitude'], lot['latitude']) for lot in lots],
+        'sensors': [sensor['api_key'] for sensor in sensors],
+        'cameras': [camera['api_key'] for camera in cameras],
+        'vehicles': [(vehicle['license_plate'], vehicle['owner_id']) for vehicle in vehicles],
+    }
+
+
+def serve(args, fixtures_queue):
+    # Runs in the child process so the load generator does not share a GIL with the app
+    import fakeredis
+    import uvicorn
+
+    # Connections opened by the parent on import are not shared with the child
+    db.engine.dispose(close=False)
+    create_schema()
+    from serve_app import main
+    from serve_app.kafka import get_kafka_producer, space_state_listener
+    from serve_app.redis import get_redis
+    from serve_app.reservations import reservation_expiry
+
+    redis_client = fakeredis.FakeRedis()
+    fixtures_queue.put(seed(args, redis_client))
+    producer = LoopbackProducer(args.kafka_latency_ms / 1000, space_state_listener.handlers)
+    reservation_expiry.redis_client = redis_client
+    reservation_expiry.kafka_producer = producer
+    main.app.dependency_overrides[get_redis] = lambda: redis_client
+    main.app.dependency_overrides[get_kafka_producer] = lambda: producer
+
+    # The part of the lifespan that does not need Kafka, the periodic tasks are left out
+    main.reconcile_indexes()
+    reservation_expiry.load()
+    main.load_plate_index()
+    main.add_listener_handlers()
+    uvicorn.run(main.app, host='127.0.0.1', port=args.port, lifespan='off', log_level='warning', access_log=False)
+
+
+def parking_lots(fixtures, rng):
+    return 'GET', '/parking_lots', {'params': {'parking_lot_id': rng.choice(fixtures['lots'])[0]}}
+
+
+def recommend(fixtures, rng):
+    parking_lot_id, x, y = rng.choice(fixtures['lots'])
+    return 'GET', '/recommend', {'params': {
+        'parking_lot_id': parking_lot_id, 'vehicle_type': random_vehicle_type(rng), 'num_results': 3,
+        'longitude': x + rng.uniform(-0.001, 0.001), 'latitude': y + rng.uniform(-0.001, 0.001),
+    }}
+
+
+def sensors(fixtures, rng):
+    return 'GET', '/sensors', {'headers': {'X-API-Key': rng.choice(fixtures['sensors'])}}
+
+
+def vehicles(fixtures, rng):
+    return 'GET', '/vehicles', {'params': {'parking_lot_id': rng.choice(fixtures['lots'])[0], 'hour_range': 24}}
+
+
+def validate_in(fixtures, rng):
+    license_plate, owner_id = rng.choice(fixtures['vehicles'])
+    return 'POST', '/validate/in', {
+        'headers': {'X-API-Key': rng.choice(fixtures['cameras'])},
+        'json': {'license_plate': license_plate, 'user_id': owner_id, 'timestamp': datetime.utcnow().isoformat()},
+    }
+
+
+ENDPOINTS = {
+    'parking_lots': parking_lots,
+    'recommend': recommend,
+    'sensors': sensors,
+    'vehicles': vehicles,
+    'validate_in': validate_in,
+}
+
+
+def wait_until_up(base_url, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not server.is_alive():
+            raise SystemExit('Serving app exited during startup')
+        try:
+            httpx.get(base_url + '/', timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit('Serving app did not come up')
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    def change(new, old):
+        return round((new - old) / old * 100, 1) if old else None
+
+    res = {}
+    for name, summary in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous:
+            res[name] = {f'{metric}_change_pct': change(summary[metric], previous[metric])
+                         for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms')}
+    return res
+
+
+def main():
+    args = parse_args()
+    weights = parse_mix(args.mix)
+    fixtures_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args, fixtures_queue), daemon=True)
+    server.start()
+    try:
+        fixtures = fixtures_queue.get(timeout=600)
+        base_url = f'http://127.0.0.1:{args.port}'
+        wait_until_up(base_url, server)
+
+        rng = random.Random(args.seed)
+        names = rng.choices(list(weights), list(weights.values()), k=args.requests)
+        jobs = [(name, *ENDPOINTS[name](fixtures, rng)) for name in names]
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        with httpx.Client(base_url=base_url, limits=limits, timeout=30) as client:
+            def call(job):
+                name, method, url, kwargs = job
+                try:
+                    return name, client.request(method, url, **kwargs).status_code
+                except httpx.HTTPError as e:
+                    return name, type(e).__name__
+
+            results, latencies, elapsed = run_concurrently(call, jobs, args.concurrency)
+    finally:
+        server.terminate()
+        server.join()
+
+    endpoints = {}
+    for name in weights:
+        samples = [(status, latency) for (job_name, status), latency in zip(results, latencies) if job_name == name]
+        statuses = {}
+        for status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        # Every endpoint shares the run, so its rate is its share of the overall throughput
+        endpoints[name] = summarize([latency for _, latency in samples], elapsed, statuses=statuses)
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('compare', 'output')},
+        'database': os.getenv('DATABASE_URI', 'sqlite').split(':')[0],
+        'total': summarize(latencies, elapsed),
+        'endpoints': endpoints,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report['compare'] = compare(report, json.load(f))
+    dump(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Nearest-free-space lookup benchmark for the /recommend spatial index.
+
+Builds one lot of --spaces spaces on a jittered grid with a share of them
+occupied, then times k-nearest queries from random points and while spaces
+flip between free and occupied. Results are checked against a brute-force scan.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ServingLayer'))
+
+from serve_app.spatial import SpatialIndex  # noqa: E402
+
+from common import dump, summarize  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spaces', type=int, default=50_000)
+    parser.add_argument('--occupied', type=float, default=0.7, help='Share of spaces that start occupied')
+    parser.add_argument('--queries', type=int, default=20_000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    side = int(args.spaces ** 0.5) + 1
+    spaces = []
+    for space_id in range(args.spaces):
+        x = (space_id % side) * 3 + rng.random()
+        y = (space_id // side) * 5 + rng.random()
+        state = 'occupied' if rng.random() < args.occupied else 'free'
+        spaces.append((space_id, 1, 'car', x, y, state))
+
+    index = SpatialIndex()
+    start = time.perf_counter()
+    index.build(spaces, {1: (0.0, 0.0)})
+    build_seconds = time.perf_counter() - start
+
+    states = {space_id: state for space_id, _, _, _, _, state in spaces}
+    positions = {space_id: (x, y) for space_id, _, _, x, y, _ in spaces}
+    latencies = []
+    mismatches = 0
+    for i in range(args.queries):
+        changed = rng.randrange(args.spaces)
+        states[changed] = 'free' if states[changed] != 'free' else 'occupied'
+        index.apply(changed, states[changed])
+
+        x, y = rng.uniform(0, side * 3), rng.uniform(0, side * 5)
+        start = time.perf_counter()
+        result = index.nearest(1, 'car', args.k, x, y)
+        latencies.append(time.perf_counter() - start)
+
+        if i % 500 == 0:
+            expected = sorted((space_id for space_id, state in states.items() if state == 'free'),
+                              key=lambda s: ((positions[s][0] - x) ** 2 + (positions[s][1] - y) ** 2, s))[:args.k]
+            mismatches += [space['id'] for space in result] != expected
+
+    dump(summarize(latencies, sum(latencies), spaces=args.spaces, k=args.k,
+                   build_ms=round(build_seconds * 1000, 1), brute_force_mismatches=mismatches), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Statements per request of the backend's list routes, and the profiler's own cost.
+
+Seeds --logs activity logs as bench_keyset.py does, plus occupied parking spaces
+and rating feedbacks, into a fresh SQLite database or the empty database given
+as DATABASE_URI. Then requests each route in-process --repeat times with every
+request profiled (SQL_PROFILE_SAMPLE_RATE=1) and reports the statements and DB
+time from the response headers, the largest number of times one statement
+repeated within a request (N+1 shows up as about the page size), and the median
+latency with the profiler on and off.
+
+Needs fakeredis on top of the backend requirements.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from bench_backend_auth import prepare_backend
+from bench_keyset import seed
+from common import dump
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', type=int, default=20000)
+    parser.add_argument('--vehicles', type=int, default=500)
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    prepare_backend(os.getenv('DATABASE_URI'), SQL_PROFILE_SAMPLE_RATE='1', SQL_REPEAT_THRESHOLD='2')
+
+    from datetime import datetime
+
+    import fakeredis
+    from fastapi.testclient import TestClient
+
+    from app.dependencies.db_connection import SessionLocal
+    from app.dependencies.redis_connection import get_redis
+    from app.main import app
+    from app.models import models
+    from app.utils import sql_profiler
+    from app.utils.jwt import create_jwt_token
+
+    now = datetime.utcnow()
+    with SessionLocal() as session:
+        seed(args, session, models)
+        session.execute(models.ParkingSpace.__table__.insert(), [
+            {'longitude': 105.85, 'latitude': 21.03, 'vehicle_type': 'car', 'state': 'occupied', 'vehicle_id': i,
+             'parking_lot_id': i % args.lots + 1, 'is_active': True, 'created_at': now}
+            for i in range(1, min(args.vehicles, 2 * args.size) + 1)
+        ])
+        session.execute(models.RatingFeedback.__table__.insert(), [
+            {'user_id': 1, 'parking_lot_id': 1, 'rating': i % 5 + 1, 'is_active': True, 'created_at': now}
+            for i in range(2 * args.size)
+        ])
+        session.commit()
+
+    redis_client = fakeredis.FakeRedis()
+    app.dependency_overrides[get_redis] = lambda: redis_client
+    token = create_jwt_token({'user_id': 1, 'is_superuser': True}, secret_key=os.environ['JWT_ACCESS_SECRET_KEY'],
+                             expiry={'minutes': 60})
+    headers = {'Authorization': f'Bearer {token}'}
+    paths = [
+        '/activity_logs/',
+        '/activity_logs/1',
+        '/admin/activity_logs/',
+        '/admin/vehicles/',
+        '/admin/ratings_feedbacks/',
+        '/parking-lots/1/rating-feedbacks/',
+        '/parking_spaces/',
+    ]
+
+    routes = {}
+    with TestClient(app) as client:
+        for path in paths:
+            samples = {}
+            for rate in (1.0, 0.0):
+                sql_profiler.SQL_PROFILE_SAMPLE_RATE = rate
+                samples[rate] = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    response = client.get(path, params={'size': args.size}, headers=headers)
+                    samples[rate].append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise SystemExit(f'{path}: {response.status_code} {response.text[:200]}')
+                    if rate:
+                        profiled = response.headers
+            routes[path] = {
+                'statements': int(profiled['x-db-statements']),
+                'most_repeated': int(profiled.get('x-db-repeated', 1)),
+                'server_timing': profiled['server-timing'],
+                'profiled_ms': round(statistics.median(samples[1.0]) * 1000, 2),
+                'unprofiled_ms': round(statistics.median(samples[0.0]) * 1000, 2),
+            }
+
+    dump({
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'database': os.environ['DATABASE_URI'].split(':')[0],
+        'routes': routes,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, **extra):
+    report = {
+        'count': len(latencies),
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+    report.update(extra)
+    return report
+
+
+def run_concurrently(fn, jobs, concurrency):
+    def timed(job):
+        start = time.perf_counter()
+        result = fn(job)
+        return result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, jobs))
+    elapsed = time.perf_counter() - start
+    return [result for result, _ in outcomes], [latency for _, latency in outcomes], elapsed
+
+
+def dump(report, path=None):
+    text = json.dumps(report, indent=2)
+    print(text)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')